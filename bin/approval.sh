@@ -11,22 +11,22 @@ export OUTDIR=$DIR/output
 export DATADIR=$DIR/data
 export PYTHONPATH=$PYTHONDIR:$PYTHONPATH
 
-export APPROVAL_FILE=approval_polls.csv
-export CULLED_APPROVAL_FILE=culled_polls.csv
+# Point this at a pollster_standin.py to run against local feeds
+export HUFFPO_HOST=${HUFFPO_HOST:-http://elections.huffingtonpost.com}
+
 export APPROVAL_MATLAB_FILE=obama_approval_matlab.csv # specified in Obama_timeseries.m
 export POLLSTERS_FILE=pollsters.p
 export APPROVAL_HISTORY_FILE=Obama_approval_history.csv
 export APPROVAL_HISTORY_GRAPH=Obama_generic_history.jpg
-export APPROVAL_URL=http://elections.huffingtonpost.com/pollster/obama-job-approval.csv
+export APPROVAL_URL=$HUFFPO_HOST/pollster/obama-job-approval.csv
 export APPROVAL_BANNER=approval_banner.html
 
 #XXX list of output files
 
 cd $DATADIR
 
-wget $APPROVAL_URL -O $APPROVAL_FILE
-python $PYTHONDIR/cull_partisan_approvals.py $APPROVAL_FILE $CULLED_APPROVAL_FILE
-python $PYTHONDIR/convert_huffpost_csv.py $CULLED_APPROVAL_FILE $APPROVAL_MATLAB_FILE $POLLSTERS_FILE
+# Download, cull partisan polls and convert for MATLAB in one pass
+python $PYTHONDIR/approval_ingest.py $APPROVAL_URL $APPROVAL_MATLAB_FILE $POLLSTERS_FILE
 mv -f $APPROVAL_MATLAB_FILE $MATLABDIR
 cd $MATLABDIR
 sh $BINDIR/Xrun.sh "matlab -r Obama_runner"
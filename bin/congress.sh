@@ -11,17 +11,20 @@ export OUTDIR=$DIR/output
 export DATADIR=$DIR/data
 export PYTHONPATH=$PYTHONDIR:$PYTHONPATH
 
+# Point this at a pollster_standin.py to run against local feeds
+export HUFFPO_HOST=${HUFFPO_HOST:-http://elections.huffingtonpost.com}
+
 ### House stuff
 export HOUSE_FILE=house_race_polls.csv
 export HOUSE_MATLAB_FILE=house_race_matlab.csv # specified in House_timeseries.m
 export POLLSTERS_FILE=pollsters.p
 export HOUSE_HISTORY_FILE=House_median_history.csv
 export HOUSE_HISTORY_GRAPH=House_generic_history.jpg
-export HOUSE_URL=http://elections.huffingtonpost.com/pollster/2016-national-house-race.csv
+export HOUSE_URL=$HUFFPO_HOST/pollster/2016-national-house-race.csv
 
 cd $DATADIR
 
-wget $HOUSE_URL -O $HOUSE_FILE
+python $PYTHONDIR/http_cache.py $HOUSE_URL $HOUSE_FILE
 python $PYTHONDIR/convert_huffpost_csv.py $HOUSE_FILE $HOUSE_MATLAB_FILE $POLLSTERS_FILE
 cd $MATLABDIR
 sh $BINDIR/Xrun.sh "matlab -r House_runner"
@@ -46,7 +49,7 @@ export SEN_SEAT_HIST=Senate_seat_history.jpg
 cd $DATADIR
 
 # Get new Senate polls
-python $PYTHONDIR/senate_update_polls.py
+python $PYTHONDIR/senate_update_polls.py --base-url $HUFFPO_HOST --incremental
 
 # If this has already run today, trim off the last line
 if cat $SEN_HISTORY_FILE | grep -e ^`date +%j`
@@ -12,12 +12,15 @@ export OUTDIR=$DIR/output
 export DATADIR=$DIR/data
 export PYTHONPATH=$PYTHONDIR:$PYTHONPATH
 
+# Point this at a pollster_standin.py to run against local feeds
+export HUFFPO_HOST=${HUFFPO_HOST:-http://elections.huffingtonpost.com}
+
 export EV_POLLS_FILE=2016.EV.polls.median.txt # from ev_update_polls.py
 export EV_HISTORY_FILE=EV_estimate_history.csv
 
 cd $DATADIR
 
-python $PYTHONDIR/ev_update_polls.py
+python $PYTHONDIR/ev_update_polls.py --base-url $HUFFPO_HOST --incremental
 
 # If this has already run today, trim off the last line
 if [ -e $EV_HISTORY_FILE ] && cat $EV_HISTORY_FILE | grep -e ^`date +%j`
@@ -15,28 +15,10 @@
 ############################################################################
 
 HISTORY=Senate_estimate_history.csv
-POLLS=2014.Senate.polls.median.txt
-NUM_PER_DAY=18
+POLLS=2016.Senate.polls.median.txt
 
 cd /web/matlab
 mv $HISTORY $HISTORY.old # Make a backup
-touch $HISTORY
 
-
-mv $POLLS $POLLS.master
-last_day=$((`wc -l $POLLS.master | awk '{print $1}'` / $NUM_PER_DAY))
-day=1
-
-while [ $day -le $last_day ]; do
-    amount=$((day*$NUM_PER_DAY))
-    echo "Day: $day, Amount: $amount"
-
-    tail -$amount $POLLS.master > $POLLS
-
-    matlab -nodisplay -r Senate_runner 2>&1 > /dev/null
-
-    day=$((day+1))
-done
-
-# Since it's now the same as $POLLS
-rm $POLLS.master
+# Every day of $POLLS at once, rather than one MATLAB run per day
+python ../python/estimate_history.py --no-ev --senate-polls $POLLS
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+
+############################################################################
+#
+# One-pass ingest of the HuffPost approval feed into the MATLAB csv.
+#
+# This does in a single read what cull_partisan_approvals.py followed by
+# convert_huffpost_csv.py used to do with an intermediate file: the rows
+# stream through the partisan filter, the pollster encoding and the datenum
+# conversion and are written out as they come, so memory use doesn't grow
+# with the feed. The source can be a file, or a URL, in which case the rows
+# are read off the HTTP response as it arrives (and kept in the http_cache
+# on the way). The request goes through a request_scheduler, so it is
+# retried with backoff as the other fetches are.
+#
+#     python approval_ingest.py URL_OR_FILE OUTPUT_CSV POLLSTER_ID_TABLE
+#
+############################################################################
+
+import sys, socket
+import http_cache, request_scheduler
+from convert_huffpost_csv import PollsterEncoding, huffpost_rows, matlab_rows, write_rows
+from cull_partisan_approvals import cull_partisan
+
+
+def open_source(source):
+    if source.startswith("http://") or source.startswith("https://"):
+        # Without a timeout a server that stops sending hangs the stage
+        socket.setdefaulttimeout(5)
+        cache = http_cache.HTTPCache()
+        # The transport opens the response rather than reading it, so the
+        # FetchResult's body is the reader. Only getting the response is
+        # retried; once rows are being written, a failure is final.
+        scheduler = request_scheduler.RequestScheduler(cache.open, rate=0)
+        result = scheduler.fetch(source)
+        if not result.ok:
+            raise IOError("could not fetch the approval feed: %s" % result)
+        return (result.body, cache)
+    return (open(source, 'r'), None)
+
+
+def ingest_approvals(source, out_filename, pollster_file):
+    (lines, cache) = open_source(source)
+    try:
+        rows = huffpost_rows(lines)
+        rows = cull_partisan(rows)
+        rows = matlab_rows(rows, PollsterEncoding(pollster_file))
+        write_rows(rows, out_filename)
+    finally:
+        lines.close()
+
+    if cache:
+        print cache.summary()
+        print cache.pool.summary()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        raise ValueError("Usage: requires 3 arguments: url_or_input_csv output_csv pollster_id_table")
+    ingest_approvals(sys.argv[1], sys.argv[2], sys.argv[3])
@@ -1,6 +1,6 @@
 # Author: Ryan Buckley <ryancbuckley@gmail.com>
 
-import csv, datetime, pickle, sys
+import csv, datetime, os, pickle, sys
 class PollsterEncoding:
     """Provide a relatively neat interface for keeping a table of
     pollster names and corresponding numeric IDs."""
@@ -71,34 +71,50 @@ def reformat_huffpost_csv(in_filename, out_filename, pollster_file):
     New, MATLAB-compatible csv is written to out_filename.
     """
 
-    pollsters = PollsterEncoding(pollster_file)
-    outrows = []
     with open(in_filename,'r') as csvfile:
-        #has_header = csv.Sniffer().has_header(csvfile.read(8192))
-        # UPDATE 9/2/16: HuffPost added a "Question Text" field and had a newline
-        # in a question text string, causing the sniffer to choke
-        has_header = True # All HuffPost CSVs seem to have a header
-        csvfile.seek(0)  # rewind
-        csvreader = csv.reader(csvfile)
-        if has_header:
-            next(csvreader)  # skip header row
-
-        for row in csvreader:
-            # Note: python list indices start at 0
-            # These numbers are one off from those in the docstring
-            row[0] = pollsters.get( row[0] )
-            # HuffPo added entry time in addition to date. we look for just a date
-            # Plus, the addition of a date added an erroneous date string
-            # UPDATE 1/21/16: HuffPost screwed up their output format (again)
-            # now just check if length > 1
-            if len(row[3].split()) > 1:
-                row[3] = row[3].split()[0]
-            row[1:4] = (datestr_to_datenum(date) for date in row[1:4])
-            outrows.append( row[0:5] + [int(float(x)) if x else "" for x in row[7:10]] )
-
-    with open(out_filename, 'w') as out_file:
+        write_rows(matlab_rows(huffpost_rows(csvfile), PollsterEncoding(pollster_file)),
+                   out_filename)
+
+# The conversion is split into generator stages, so that rows stream from
+# the input to the output one at a time (see also approval_ingest.py)
+
+def huffpost_rows(lines):
+    """Generator stage: the data rows of a HuffPost csv, given its lines"""
+    #has_header = csv.Sniffer().has_header(csvfile.read(8192))
+    # UPDATE 9/2/16: HuffPost added a "Question Text" field and had a newline
+    # in a question text string, causing the sniffer to choke
+    has_header = True # All HuffPost CSVs seem to have a header
+    csvreader = csv.reader(lines)
+    if has_header:
+        next(csvreader)  # skip header row
+    for row in csvreader:
+        yield row
+
+def matlab_rows(rows, pollsters):
+    """Generator stage: convert HuffPost rows to MATLAB rows, as described
+    in reformat_huffpost_csv"""
+    for row in rows:
+        # Note: python list indices start at 0
+        # These numbers are one off from those in the docstring
+        row[0] = pollsters.get( row[0] )
+        # HuffPo added entry time in addition to date. we look for just a date
+        # Plus, the addition of a date added an erroneous date string
+        # UPDATE 1/21/16: HuffPost screwed up their output format (again)
+        # now just check if length > 1
+        if len(row[3].split()) > 1:
+            row[3] = row[3].split()[0]
+        row[1:4] = (datestr_to_datenum(date) for date in row[1:4])
+        yield row[0:5] + [int(float(x)) if x else "" for x in row[7:10]]
+
+def write_rows(rows, out_filename):
+    """Write rows to out_filename as they come. The file is only replaced
+    once all of them have been written, so a bad row leaves the previous
+    output in place."""
+    tmp_filename = out_filename + '.tmp'
+    with open(tmp_filename, 'w') as out_file:
         csvwriter = csv.writer(out_file)
-        csvwriter.writerows(outrows)
+        csvwriter.writerows(rows)
+    os.rename(tmp_filename, out_filename)
 
 if __name__ == "__main__":
     if len(sys.argv) != 4:
@@ -1,18 +1,21 @@
 import sys, csv
 
 
-def cull_partisan_approvals(input_csv, output_csv):
-    outrows = [];
-    with open(input_csv, 'r') as csvfile:
-        csvreader = csv.reader(csvfile)
+partisan_words = ['independent', 'republican', 'democrat', 'gop']
+
+def cull_partisan(rows):
+    """Generator stage: pass through the rows whose population (column 6)
+    isn't a partisan subgroup"""
+    for row in rows:
+        if not [s for s in partisan_words if s in row[5].lower()]:
+            yield row
 
-        for row in csvreader:
-            if not [s for s in ['independent', 'republican', 'democrat', 'gop'] if s in row[5].lower()]:
-                outrows.append(row)
 
-    with open(output_csv, 'w') as out_file:
-        csvwriter = csv.writer(out_file)
-        csvwriter.writerows(outrows)
+def cull_partisan_approvals(input_csv, output_csv):
+    with open(input_csv, 'r') as csvfile:
+        with open(output_csv, 'w') as out_file:
+            csvwriter = csv.writer(out_file)
+            csvwriter.writerows(cull_partisan(csv.reader(csvfile)))
 
 
 if __name__ == "__main__":
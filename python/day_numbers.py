@@ -0,0 +1,72 @@
+############################################################################
+#
+# Dates as integer day numbers.
+#
+# The poll updaters work with dates as day numbers (date.toordinal(), so
+# January 1 of year 1 is day 1): windows and mid dates are integer
+# arithmetic, and comparisons are integer comparisons. Dates are parsed
+# into day numbers once, as the polls come in, and turned back into
+# datetime.dates only where a person will read them.
+#
+# Each distinct date string is parsed only once, as are the conversions
+# back; a season has a few hundred distinct days at most.
+#
+############################################################################
+
+import datetime, time
+
+days_before_month = [0, 0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334]
+days_in_month = [0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+parsed = {}
+dates = {}
+days_of_year = {}
+
+
+def day_number(date):
+    return date.toordinal()
+
+
+def is_leap(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+def ordinal(year, month, day):
+    """The day number of year-month-day, as date(year, month, day).toordinal()"""
+    if not (1 <= month <= 12 and 1 <= day <= days_in_month[month]) or \
+       (month == 2 and day == 29 and not is_leap(year)) or not 1 <= year <= 9999:
+        raise ValueError("no such date: %04d-%02d-%02d" % (year, month, day))
+    y = year - 1
+    return (y*365 + y//4 - y//100 + y//400 + days_before_month[month]
+            + (month > 2 and is_leap(year)) + day)
+
+
+def parse_day(date_string):
+    """The day number for a YYYY-MM-DD date string"""
+    day = parsed.get(date_string)
+    if day is None:
+        s = date_string
+        if len(s) == 10 and s[4] == "-" and s[7] == "-" and \
+           s[:4].isdigit() and s[5:7].isdigit() and s[8:].isdigit():
+            day = ordinal(int(s[:4]), int(s[5:7]), int(s[8:]))
+        else:
+            # Not the fixed format (say, no leading zeros): the slow way
+            day = ordinal(*time.strptime(s, "%Y-%m-%d")[0:3])
+        parsed[date_string] = day
+    return day
+
+
+def date_of(day):
+    """The datetime.date for a day number"""
+    date = dates.get(day)
+    if date is None:
+        date = dates[day] = datetime.date.fromordinal(day)
+    return date
+
+
+def day_of_year(day):
+    """January 1 = 1, as strftime("%j") gives it"""
+    n = days_of_year.get(day)
+    if n is None:
+        n = days_of_year[day] = day - ordinal(date_of(day).year, 1, 1) + 1
+    return n
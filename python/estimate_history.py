@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+############################################################################
+#
+# Rebuilds EV_estimate_history.csv and Senate_estimate_history.csv from the
+# poll median histories, in one go.
+#
+# EV_estimator.m and Senate_estimator.m each append a line to their history
+# when they run, so rebuilding a history (EV_regenerate.m,
+# congress/regenerate-history.sh) meant starting MATLAB once for every day
+# of the campaign, on a copy of the median file cut back to that day. Here
+# each median file is read once (see ev_estimator.read_poll_history()) and
+# every day's estimate and meta-margin is worked out together, from
+# (days x states) arrays; with --jobs, the days are shared out between
+# worker processes. The files get the lines the nightly runs would have
+# appended, one per day, oldest first:
+#
+# EV_estimate_history.csv
+#    the day of the year, then the numbers in EV_estimates.csv
+#
+# Senate_estimate_history.csv
+#    the day of the year, then the numbers in Senate_estimates.csv
+#
+# The EV November probabilities are worked out as of each day, with the
+# mean meta-margin of the days before it as the prior, as if the nightly
+# run had been made that day and the history had been rebuilt up to it.
+#
+# Script written for election.princeton.edu run by Samuel S.-H. Wang under
+# noncommercial-use-only license:
+# You may use or modify this software, but only for noncommericial purposes.
+# To seek a commercial-use license, contact sswang@princeton.edu
+#
+############################################################################
+
+import argparse, multiprocessing
+from numpy import array, array_split
+import ev_estimator, senate_estimator
+from ev_estimator import dlm_number
+
+############################################################################
+#
+# Global configuration and variables
+#
+############################################################################
+
+# (--jobs)
+process_jobs = 1
+
+############################################################################
+#
+# The calculation
+#
+############################################################################
+
+
+# The outputs for each day of a stack of days of an estimator's polls, as
+# (analysis date, outputs) for each day: the columns of outputs, one entry
+# per day, turned around
+def day_lines(estimate, outputs):
+    return zip(estimate.analysisdate.tolist(),
+               zip(*[column.tolist() for column in outputs]))
+
+
+# (analysis date, outputs, meta-margin) for each of a stack of days of
+# 2016.EV.polls.median.txt. The outputs leave out the November
+# probabilities, which depend on the days before. With --jobs this runs in
+# a multiprocessing worker.
+
+def ev_days(polls):
+    metamargins = ev_estimator.solve_metamargins(polls)
+    estimate = ev_estimator.estimate(polls)
+    lines = day_lines(estimate, ev_estimator.estimate_outputs(estimate, metamargins, ()))
+    return [line + (metamargin,) for (line, metamargin) in zip(lines, metamargins.tolist())]
+
+
+# (analysis date, outputs) for each of a stack of days of
+# 2016.Senate.polls.median.txt. With --jobs this runs in a multiprocessing
+# worker.
+
+def senate_days(polls):
+    metamargins = senate_estimator.metamargin(polls)
+    estimate = senate_estimator.estimate(polls)
+    return day_lines(estimate, senate_estimator.estimate_outputs(estimate, metamargins))
+
+
+# Runs days_function on the days of history (newest first, as the median
+# files are), split into process_jobs stacks, and returns what it gives
+# for each day, oldest first
+
+def by_day(days_function, history):
+    stacks = [stack for stack in array_split(array(history[::-1]), max(process_jobs, 1))
+              if len(stack)]
+    if process_jobs > 1:
+        pool = multiprocessing.Pool(process_jobs)
+        try:
+            results = pool.map(days_function, stacks, chunksize=1)
+        finally:
+            pool.terminate()
+    else:
+        results = map(days_function, stacks)
+    return [day for result in results for day in result]
+
+
+def write_history(lines, filename):
+    with open(filename, "w") as f:
+        for (analysisdate, outputs) in lines:
+            f.write(",".join(dlm_number(x) for x in [analysisdate] + list(outputs)) + "\n")
+
+
+def ev_history(polls_filename=ev_estimator.polls_filename):
+    days = by_day(ev_days, ev_estimator.read_poll_history(polls_filename))
+    lines = []
+    metamargins = []
+    for (analysisdate, outputs, metamargin) in days:
+        prior = (sum(metamargins) / len(metamargins) if metamargins
+                 else ev_estimator.default_prior_metamargin)
+        november = ev_estimator.november_win_probabilities(
+                metamargin, ev_estimator.day_of_analysis(analysisdate), prior)
+        lines.append((analysisdate, outputs + november))
+        metamargins.append(metamargin)
+    return lines
+
+
+def senate_history(polls_filename=senate_estimator.polls_filename):
+    history = ev_estimator.read_poll_history(polls_filename, len(senate_estimator.races))
+    return by_day(senate_days, history)
+
+
+def main():
+    global process_jobs
+
+    parser = argparse.ArgumentParser(description="Rebuild %s and %s from every day "
+                                     "of %s and %s" % (ev_estimator.estimate_history_filename,
+                                     senate_estimator.estimate_history_filename,
+                                     ev_estimator.polls_filename,
+                                     senate_estimator.polls_filename))
+    parser.add_argument("--ev-polls", default=ev_estimator.polls_filename,
+                        help="the EV poll medians to read (default %(default)s)")
+    parser.add_argument("--senate-polls", default=senate_estimator.polls_filename,
+                        help="the Senate poll medians to read (default %(default)s)")
+    parser.add_argument("--no-ev", action="store_true",
+                        help="leave %s alone" % ev_estimator.estimate_history_filename)
+    parser.add_argument("--no-senate", action="store_true",
+                        help="leave %s alone" % senate_estimator.estimate_history_filename)
+    parser.add_argument("--jobs", type=int, default=process_jobs,
+                        help="number of processes to compute the days' "
+                        "estimates in")
+    args = parser.parse_args()
+    process_jobs = args.jobs
+
+    if not args.no_ev:
+        lines = ev_history(args.ev_polls)
+        write_history(lines, ev_estimator.estimate_history_filename)
+        print "%s: %d days" % (ev_estimator.estimate_history_filename, len(lines))
+    if not args.no_senate:
+        lines = senate_history(args.senate_polls)
+        write_history(lines, senate_estimator.estimate_history_filename)
+        print "%s: %d days" % (senate_estimator.estimate_history_filename, len(lines))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,682 @@
+#!/usr/bin/env python
+
+############################################################################
+#
+# The electoral vote distribution, in NumPy.
+#
+# This is EV_estimator.m and EV_median.m without MATLAB. It reads the 51
+# lines for one day from 2016.EV.polls.median.txt (as written by
+# ev_update_polls.py), turns each state's median margin into a probability
+# of a Clinton win, and builds the exact probability distribution of all
+# 2^51 outcomes in the Electoral College. From that it writes
+#
+# EV_estimates.csv
+#    all in one line:
+#    2 values - medianEV for the two candidates, where a margin>0 favors
+#    the first candidate (Clinton);
+#    2 values - modeEV for the two candidates;
+#    3 values - assigned (>95% prob) EV for each candidate, with a third
+#    entry for undecided;
+#    4 values - confidence intervals for candidate 1's EV: +/-1 sigma,
+#    then 95% band;
+#    1 value - number of state polls used to make the estimates;
+#    1 value - the meta-margin (-999 if not calculated; see below);
+#    1 value - the probability of candidate 1 winning 270 or more EV;
+#    2 values - the drift-based and Bayesian probabilities of candidate 1
+#    winning in November, as EV_prediction.m works them out (see below).
+#
+# EV_histogram.csv
+#    A 538-line file giving the probability of each EV outcome. Line 1 is
+#    the probability of candidate #1 getting 1 EV, and so on.
+#
+# EV_stateprobs.csv
+#    A 51-line file giving, state by state: the percentage probability of
+#    a candidate #1 win; the median margin; the same probability with a
+#    2-point bias towards each candidate; the postal abbreviation; and the
+#    probability of a win in November, allowing for drift until then.
+#
+# EV_MM_table.csv (with --mm-table)
+#    The median EV for candidate #1 with each of the bias values scanned
+#    for the meta-margin by EV_estimator.m, one per line: the bias less the
+#    meta-margin, then the median EV.
+#
+# EV_jerseyvotes.csv
+#    The power of a voter in each state to influence the overall outcome
+#    (see voter_power), relative to the most powerful state's, one line per
+#    state, most powerful first: the state's index, its postal
+#    abbreviation, and its voter power.
+#
+# with the numbers formatted as MATLAB's dlmwrite and num2str format them,
+# so the files are the same as EV_estimator.m wrote. Everything is also
+# available as functions, for scripts which want the numbers themselves:
+#
+#    estimate = ev_estimator.estimate(ev_estimator.read_polls())
+#    estimate.median_ev, estimate.histogram, ...
+#
+# estimate() also takes a stack of days (days x 51 x columns, as
+# read_poll_history() gives them), giving an Estimate of arrays with one
+# entry per day; estimate_history.py uses that to rebuild
+# EV_estimate_history.csv in one go.
+#
+# Each state's polls are summarized by a z-score, margin/SEM. As in
+# EV_estimator.m, which replaces the SEMs in the file with 3 after flooring
+# them at 3, every state's SEM is taken to be sem_floor unless use_poll_sems
+# is set.
+#
+# The distribution is built by convolving each state's two outcomes in
+# turn, as EV_median.m did with conv(). The convolution with a state's
+# [p, 0, ..., 0, 1-p] is p times the distribution so far plus 1-p times the
+# same shifted by the state's EV, which is what this does, for any number
+# of sets of probabilities at once (as the meta-margin scan needs).
+#
+# The meta-margin is the bias, added to every state's margin, which would
+# make the median EV a tie: the smallest bias giving candidate #1 at least
+# 269 EV, negated. EV_estimator.m found it by scanning ~340 biases (a grid
+# 0.02 points apart around where it expected the tie, and whole points
+# from -20 to 20). The median EV only goes up as the bias does, so
+# solve_metamargin() brackets the tie and bisects instead, to the nearest
+# metamargin_tolerance: the same answer as the grid, from a dozen or so
+# distributions. The grid scan is still here (metamargin_scan()), with all
+# of its biases done as one batch, for the EV_MM_table.csv diagnostic.
+# solve_metamargins() does the bisection for a stack of days at once.
+#
+# The November probabilities follow EV_prediction.m. The meta-margin is
+# expected to drift by prediction_drift_rate * sqrt(days to the election)
+# points, spread as a Student's t with 3 degrees of freedom: the drift-based
+# probability is that of it staying above 0. The Bayesian one multiplies
+# that spread by a prior, a t with 1 degree of freedom around the mean
+# meta-margin in EV_estimate_history.csv so far.
+#
+# Script written for election.princeton.edu run by Samuel S.-H. Wang under
+# noncommercial-use-only license:
+# You may use or modify this software, but only for noncommericial purposes.
+# To seek a commercial-use license, contact sswang@princeton.edu
+#
+############################################################################
+
+import os, math, datetime, argparse, collections
+from numpy import arange, array, arctan, asarray, cumsum, floor, loadtxt, pi, \
+    sqrt, unique, vectorize, where, zeros, float64
+import median_history, voter_power
+from day_numbers import day_number, day_of_year, parse_day
+
+############################################################################
+#
+# Global configuration and variables
+#
+############################################################################
+
+polls_filename = "2016.EV.polls.median.txt"
+estimates_filename = "EV_estimates.csv"
+histogram_filename = "EV_histogram.csv"
+stateprobs_filename = "EV_stateprobs.csv"
+mm_table_filename = "EV_MM_table.csv"
+jerseyvotes_filename = "EV_jerseyvotes.csv"
+estimate_history_filename = "EV_estimate_history.csv"
+
+# In the order of the lines for each day in polls_filename
+states = ("AL AK AZ AR CA CO CT DC DE FL GA HI ID IL IN IA KS KY LA ME MD MA "
+          "MI MN MS MO MT NE NV NH NJ NM NY NC ND OH OK OR PA RI SC SD TN TX "
+          "UT VT VA WA WV WI WY").split()
+electoral_votes = array([9, 3, 11, 6, 55, 9, 7, 3, 3, 29, 16, 4, 4, 20, 11, 6, 6, 8,
+                         8, 4, 10, 11, 16, 10, 6, 10, 3, 5, 6, 4, 14, 5, 29, 15, 3,
+                         18, 7, 7, 20, 4, 9, 3, 11, 38, 6, 3, 13, 12, 5, 10, 3])
+total_ev = electoral_votes.sum()
+assert total_ev == 538 and len(states) == len(electoral_votes)
+
+# The columns of polls_filename
+num_polls_column = 0
+margin_column = 2
+sem_column = 3
+analysisdate_column = 4
+
+sem_floor = 3
+use_poll_sems = False
+safe_pct = 95                   # a state is assigned if this likely, either way
+tied_ev = 269                   # probability_gop_win is of this many EV or fewer
+stateprobs_bias = 2             # the D+2% and R+2% columns of EV_stateprobs.csv
+
+# The confidence intervals, as cumulative probabilities: +/-1 sigma, then 95%
+one_sigma_low = 0.15865
+one_sigma_high = 0.84135
+ninety_five_low = 0.025
+ninety_five_high = 0.975
+
+# The drift between now and November, for the November column of
+# EV_stateprobs.csv: max_drift more than drift_days out, shrinking to a
+# minimum of min_drift on election day
+election_day = day_number(datetime.date(2016, 11, 8))
+drift_days = 90
+max_drift = 7
+min_drift = 0.5
+
+# The meta-margin scan: a fine grid (in hundredths of a point) of
+# fine_scan_width from a guess at where the median EV crosses a tie, and a
+# coarse one of whole points over coarse_scan_range
+fine_scan_step = 2
+fine_scan_width = 600
+coarse_scan_range = (-20, 20)
+no_metamargin = -999
+
+# Voter power is the change in the probability of a Trump win when a state's
+# margin moves jerseyvotes_nudge points towards Trump, per thousand voters
+# in the last election (as EV_jerseyvotes.m has them), with the margins
+# biased by the meta-margin so that the race is tied. New Jersey's is not
+# rounded.
+jerseyvotes_nudge = 0.1
+voters = array([2099819, 326197, 2293475, 1086617, 13464495, 2401361, 1646783, 265853,
+                412412, 8390744, 3921693, 453568, 655032, 5513635, 2751054, 1530386,
+                1235801, 1826620, 1960761, 731163, 2622549, 3080985, 5001766, 2900873,
+                1289865, 2925205, 490109, 798444, 961581, 707611, 3868237, 830158,
+                7590551, 4296847, 316621, 5697927, 1462661, 1814251, 5992384, 471766,
+                1920969, 381975, 2599749, 8077795, 942678, 325046, 3716905, 3036878,
+                713451, 2976356, 253137])
+unrounded_jerseyvotes = ["NJ"]
+
+# solve_metamargin() finds the meta-margin to within this many points (1/N
+# of a point, so that its answers fall on the scan's grid), looking no
+# further than max_bias points either way
+metamargin_tolerance = 0.02
+max_bias = 50
+
+MetaMargin = collections.namedtuple("MetaMargin", "metamargin bracket evaluations")
+
+# EV_prediction.m's November probabilities: the meta-margin drifts by
+# prediction_drift_rate * sqrt(days left), but at least min and at most max
+# points; the prior is prior_sd wide around the mean meta-margin in the
+# history (or default_prior_metamargin, with no history); the
+# distributions are taken prediction_step points apart out to
+# prediction_sigmas drifts either way
+prediction_drift_rate = 0.4
+prediction_min_drift = 0.5
+prediction_max_drift = 3
+default_prior_metamargin = 3.5
+prior_sd = 6
+prediction_step = 0.02
+prediction_sigmas = 4
+metamargin_history_column = 13  # in estimate_history_filename
+
+erf = vectorize(math.erf, otypes=[float64])
+
+Estimate = collections.namedtuple("Estimate",
+        "margins sems num_polls analysisdate stateprobs histogram cumulative_prob "
+        "median_ev mode_ev assigned_ev confidence_intervals probability_gop_win")
+
+############################################################################
+#
+# Reading the polls
+#
+############################################################################
+
+
+# Returns the (days x 51 x columns) array of polls_filename, newest day
+# first. The binary copy ev_update_polls.py writes alongside it is used if
+# it is up to date. (senate_estimator reads its own file, with num_states
+# races, the same way.)
+
+def read_poll_history(filename=polls_filename, num_states=len(states)):
+    binary = median_history.binary_filename(filename)
+    if os.path.exists(binary) and os.path.getmtime(binary) >= os.path.getmtime(filename):
+        return median_history.History(binary).records
+    polldata = loadtxt(filename, ndmin=2)
+    if len(polldata) % num_states:
+        raise ValueError("%s is not a multiple of %d lines long" % (filename, num_states))
+    return polldata.reshape(-1, num_states, polldata.shape[1])
+
+
+# Returns the (51 x columns) block for analysisdate (a day of the year, as
+# in the file), or the newest if analysisdate is 0 or not in the file. As
+# in EV_estimator.m, a date newer than the newest in the file is not looked
+# for, the file being newest first.
+
+def read_polls(filename=polls_filename, analysisdate=0, history=None):
+    if history is None:
+        history = read_poll_history(filename)
+    dates = history[:, 0, analysisdate_column]
+    newest = dates.argmax()
+    if analysisdate > 0:
+        matches = (dates == analysisdate).nonzero()[0]
+        if len(matches):
+            return history[max(matches[0], newest)]
+    return history[newest]
+
+
+############################################################################
+#
+# The calculation
+#
+############################################################################
+
+
+# MATLAB's round(): halves away from zero
+def matlab_round(x):
+    x = asarray(x, float64)
+    return (x >= 0) * floor(x + 0.5) - (x < 0) * floor(-x + 0.5)
+
+
+# The SEM used for each state
+def state_sems(polls):
+    if use_poll_sems:
+        sems = polls[:, sem_column].copy()
+        sems[sems < sem_floor] = sem_floor
+        return sems
+    return zeros(polls.shape[:-1]) + sem_floor
+
+
+# Probability of a Clinton win in each state, from the z-scores of the
+# margins with biaspct added. bias may be an array (of shape (n, 1) for n
+# sets of probabilities).
+
+def win_probabilities(margins, sems, bias=0):
+    z = (margins + bias) / sems
+    return (erf(z / sqrt(2)) + 1) / 2
+
+
+# The histogram of EV outcomes for each set of state probabilities:
+# histogram[..., i] is the probability of i + 1 EV for Clinton
+
+def ev_histograms(prob_dem):
+    prob_dem = asarray(prob_dem, float64)
+    # distribution[..., k] is the probability of k EV for Trump
+    distribution = zeros(prob_dem.shape[:-1] + (total_ev + 1,))
+    distribution[..., 0] = 1
+    width = 1
+    for (i, ev) in enumerate(electoral_votes.tolist()):
+        p = prob_dem[..., i:i + 1]
+        shifted = distribution[..., :width] * (1 - p)
+        distribution[..., :width] *= p
+        distribution[..., ev:ev + width] += shifted
+        width += ev
+    return distribution[..., total_ev - 1::-1]
+
+
+# The number of entries of each cumulative histogram below x (or, with
+# or_equal, no more than x): searchsorted() along the last axis
+def count_below(cumulative, x, or_equal=False):
+    return ((cumulative <= x) if or_equal else (cumulative < x)).sum(axis=-1)
+
+
+# The Estimate for a day's 51 lines of polls_filename, biased by biaspct
+# points towards Clinton. polls may also be a stack of days, in which case
+# each of the Estimate's numbers is an array with one per day.
+
+def estimate(polls, biaspct=0):
+    margins = polls[..., margin_column]
+    sems = state_sems(polls)
+    prob_dem = win_probabilities(margins, sems, biaspct)
+    stateprobs = matlab_round(prob_dem * 100)
+
+    histogram = ev_histograms(prob_dem)
+    cumulative_prob = cumsum(histogram, axis=-1)
+
+    # Median and confidence bands from the cumulative histogram
+    median_ev = count_below(cumulative_prob, 0.5) + 1
+    confidence_intervals = [count_below(cumulative_prob, one_sigma_low, True),
+                            count_below(cumulative_prob, one_sigma_high) + 1,
+                            count_below(cumulative_prob, ninety_five_low, True),
+                            count_below(cumulative_prob, ninety_five_high) + 1]
+    mode_ev = histogram.argmax(axis=-1) + 1
+
+    # Safe EV for each party
+    assigned = [(electoral_votes * (stateprobs >= safe_pct)).sum(axis=-1),
+                (electoral_votes * (stateprobs <= 100 - safe_pct)).sum(axis=-1)]
+    assigned.append(total_ev - assigned[0] - assigned[1])
+
+    return Estimate(margins, sems, polls[..., num_polls_column].sum(axis=-1),
+                    polls[..., 0, analysisdate_column].astype(int), stateprobs, histogram,
+                    cumulative_prob,
+                    (median_ev, total_ev - median_ev), (mode_ev, total_ev - mode_ev),
+                    tuple(assigned), tuple(confidence_intervals),
+                    cumulative_prob[..., tied_ev - 1])
+
+
+# The drift until November, for a day number
+def november_drift(today):
+    days_to_election = election_day - today
+    if days_to_election > drift_days:
+        return max_drift
+    elif days_to_election < 1:
+        return min_drift
+    return sqrt((float(days_to_election) / drift_days * max_drift)**2 + min_drift**2)
+
+
+# The day number of a day of the election year (the analysisdate column)
+def day_of_analysis(analysisdate):
+    return election_day - day_of_year(election_day) + int(analysisdate)
+
+
+############################################################################
+#
+# The meta-margin
+#
+############################################################################
+
+
+# The bias values to scan for the meta-margin, in order, given the median EV
+# with no bias. These are EV_estimator.m's
+#
+#    union(startrange:0.02:startrange+6, -20:1:20)
+#
+# with startrange = round((269-medianEV)/1.25)/10-2, worked out in
+# hundredths of a point so that the two ranges line up exactly.
+
+def metamargin_biases(median_ev):
+    start = int(matlab_round((tied_ev - median_ev) / 1.25)) * 10 - 200
+    fine = range(start, start + fine_scan_width + 1, fine_scan_step)
+    coarse = range(coarse_scan_range[0] * 100, coarse_scan_range[1] * 100 + 1, 100)
+    return array(sorted(set(fine) | set(coarse))) / 100.0
+
+
+# The median EV for candidate #1 with each bias added to the margins, all
+# at once. For a stack of days' polls, biases has one bias for each day.
+
+def median_evs(polls, biases):
+    prob_dem = win_probabilities(polls[..., margin_column], state_sems(polls),
+                                 asarray(biases, float64)[..., None])
+    cumulative = cumsum(ev_histograms(prob_dem), axis=-1)
+    # The first EV with at least half of the probability at or below it
+    return (cumulative < 0.5).sum(axis=-1) + 1
+
+
+# The meta-margin given the median EVs for each of biases (in order)
+def metamargin(biases, median_evs):
+    winning = (median_evs >= tied_ev).nonzero()[0]
+    if len(winning) == 0:
+        raise ValueError("no bias in the scan (up to %s) gives a median of %d EV"
+                         % (biases[-1], tied_ev))
+    return -biases[winning[0]]
+
+
+# Returns a MetaMargin for a day's polls, given their Estimate (the search
+# starts from its median EV): the meta-margin, the (lower, upper) biases
+# found either side of the tie, tolerance apart, and the number of
+# distributions computed to find them
+
+def solve_metamargin(polls, estimate, tolerance=None):
+    steps = metamargin_steps(tolerance)
+    limit = max_bias * steps
+
+    # Biases are k / steps for whole numbers k
+    evaluations = [0]
+    def wins(k):
+        if abs(k) > limit:
+            raise ValueError("no bias within %d points gives a median of %d EV"
+                             % (max_bias, tied_ev))
+        evaluations[0] += 1
+        return median_evs(polls, [k / float(steps)])[0] >= tied_ev
+
+    # Bracket the tie, starting where EV_estimator.m centred its scan and
+    # widening the step each time
+    guess = int(matlab_round((tied_ev - estimate.median_ev[0]) / 1.25)) * steps / 10
+    step = steps
+    if wins(guess):
+        (lo, hi) = (guess - step, guess)
+        while wins(lo):
+            step *= 2
+            (lo, hi) = (lo - step, lo)
+    else:
+        (lo, hi) = (guess, guess + step)
+        while not wins(hi):
+            step *= 2
+            (lo, hi) = (hi, hi + step)
+
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if wins(mid):
+            hi = mid
+        else:
+            lo = mid
+
+    return MetaMargin(-hi / float(steps), (lo / float(steps), hi / float(steps)),
+                      evaluations[0])
+
+
+# The number of biases per point for a meta-margin tolerance
+def metamargin_steps(tolerance=None):
+    if tolerance is None:
+        tolerance = metamargin_tolerance
+    steps = int(round(1.0 / tolerance))
+    if abs(steps * tolerance - 1) > 1e-9:
+        raise ValueError("the meta-margin tolerance must be 1/N of a point")
+    return steps
+
+
+# The smallest whole number k in (lo, hi] for which wins(k), for arrays of
+# lo and hi with wins(hi) true: a bisection of every (lo, hi) at once,
+# wins() taking an array of ks. wins() must never go from true to false
+# as k goes up. (senate_estimator finds its meta-margins this way too.)
+
+def first_winning(wins, lo, hi):
+    lo = asarray(lo)
+    hi = asarray(hi)
+    while (hi - lo > 1).any():
+        mid = (lo + hi) // 2
+        active = hi - lo > 1
+        won = wins(mid)
+        hi = where(active & won, mid, hi)
+        lo = where(active & ~won, mid, lo)
+    return hi
+
+
+# The meta-margins for a stack of days' polls, all found together: the
+# same answers as solve_metamargin(), from a bisection of the biases
+# between -max_bias and max_bias, each step one distribution per day
+
+def solve_metamargins(polls, tolerance=None):
+    steps = metamargin_steps(tolerance)
+    limit = max_bias * steps
+    def wins(k):
+        return median_evs(polls, k / float(steps)) >= tied_ev
+
+    lo = zeros(polls.shape[:-2], int) - limit
+    hi = lo + 2 * limit
+    if wins(lo).any() or not wins(hi).all():
+        raise ValueError("no bias within %d points gives a median of %d EV"
+                         % (max_bias, tied_ev))
+    return -first_winning(wins, lo, hi) / float(steps)
+
+
+# Returns (the meta-margin, biases, median EVs) for a day's polls, given
+# their Estimate (the scan is centred on its median EV), scanning the grid
+# of biases EV_estimator.m did
+
+def metamargin_scan(polls, estimate):
+    biases = metamargin_biases(estimate.median_ev[0])
+    evs = median_evs(polls, biases)
+    return (metamargin(biases, evs), biases, evs)
+
+
+############################################################################
+#
+# November win probabilities
+#
+############################################################################
+
+
+# Student's t cumulative distribution, 3 degrees of freedom (tcdf(t, 3))
+def t3_cdf(t):
+    return 0.5 + (t / (sqrt(3) * (1 + t * t / 3)) + arctan(t / sqrt(3))) / pi
+
+
+# Student's t density with dof degrees of freedom, up to a constant factor
+# (EV_prediction.m's tpdf()s are normalized to sum to 1 anyway)
+def t_density(t, dof):
+    return (1 + t * t / dof) ** (-(dof + 1) / 2.0)
+
+
+# The mean meta-margin in an EV_estimate_history.csv, counting each date
+# once (as mean_MM.m does), or default_prior_metamargin if it has none
+def mean_metamargin(filename=estimate_history_filename):
+    if not os.path.exists(filename):
+        return default_prior_metamargin
+    history = loadtxt(filename, delimiter=",", ndmin=2)
+    if len(history) == 0:
+        return default_prior_metamargin
+    first = unique(history[:, 0], return_index=True)[1]
+    return history[first, metamargin_history_column].mean()
+
+
+# The drift-based and Bayesian probabilities of candidate #1 winning in
+# November, given the meta-margin on today (a day number) and the prior
+# meta-margin
+
+def november_win_probabilities(metamargin, today, prior_metamargin):
+    days_to_election = election_day - today
+    drift = min(prediction_drift_rate * sqrt(max(days_to_election, 0)),
+                prediction_max_drift)
+    drift = max(drift, prediction_min_drift)
+
+    # MATLAB's mm-4*drift:0.02:mm+4*drift
+    n = int(floor(2 * prediction_sigmas * drift / prediction_step + 1e-9))
+    mrange = metamargin - prediction_sigmas * drift + prediction_step * arange(n + 1)
+    now = t_density((mrange - metamargin) / drift, 3)
+    prior = t_density((mrange - prior_metamargin) / prior_sd, 1)
+    prediction = now / now.sum() * prior / prior.sum()
+    return (t3_cdf(metamargin / drift),
+            prediction[mrange >= 0].sum() / prediction.sum())
+
+
+############################################################################
+#
+# Voter power
+#
+############################################################################
+
+
+# The voter power in each state, given the day's polls and the meta-margin
+def jerseyvotes(polls, metamargin):
+    biaspct = -metamargin if metamargin > no_metamargin else 0
+    margins = polls[:, margin_column]
+    sems = state_sems(polls)
+    # Clinton takes 1 to tied_ev EV: a Trump win, as EV_jerseyvotes.m counts it
+    differences = voter_power.window_changes(
+            win_probabilities(margins, sems, biaspct),
+            win_probabilities(margins - jerseyvotes_nudge, sems, biaspct),
+            electoral_votes, 1, tied_ev) * 10000
+    return voter_power.normalized(differences, matlab_round(voters / 1000.0),
+                                  [states.index(state) for state in unrounded_jerseyvotes])
+
+
+############################################################################
+#
+# Writing the files, as MATLAB did
+#
+############################################################################
+
+
+# dlmwrite's number format
+def dlm_number(x):
+    return "%.5g" % x
+
+
+# num2str's number format
+def num2str(x):
+    if x == int(x):
+        return "%d" % x
+    digits = int(math.floor(math.log10(abs(x)))) + 5
+    return "%.*g" % (max(digits, 5), x)
+
+
+# The numbers in a line of EV_estimates.csv, given the Estimate, the
+# meta-margin and the (drift-based, Bayesian) November probabilities
+def estimate_outputs(estimate, metamargin, november):
+    return (list(estimate.median_ev) + list(estimate.mode_ev) + list(estimate.assigned_ev)
+            + list(estimate.confidence_intervals)
+            + [estimate.num_polls, metamargin, 1 - estimate.probability_gop_win]
+            + list(november))
+
+
+def write_estimates(outputs, filename=estimates_filename):
+    with open(filename, "w") as f:
+        f.write(",".join(dlm_number(x) for x in outputs) + "\n")
+
+
+def write_mm_table(metamargin, biases, median_evs, filename=mm_table_filename):
+    with open(filename, "w") as f:
+        for (bias, ev) in zip(biases, median_evs):
+            f.write("%s,%s\n" % (dlm_number(bias + metamargin), dlm_number(ev)))
+
+
+def write_jerseyvotes(power, filename=jerseyvotes_filename):
+    with open(filename, "w") as f:
+        for i in voter_power.display_order(power):
+            f.write("%d,%s,%s\n" % (i + 1, states[i], num2str(power[i])))
+
+
+def write_histogram(estimate, filename=histogram_filename):
+    with open(filename, "w") as f:
+        f.write("".join(dlm_number(x) + "\n" for x in estimate.histogram))
+
+
+def write_stateprobs(estimate, today, filename=stateprobs_filename):
+    margins = estimate.margins
+    sems = estimate.sems
+    d2probs = matlab_round(win_probabilities(margins, sems, stateprobs_bias) * 100)
+    r2probs = matlab_round(win_probabilities(margins, sems, -stateprobs_bias) * 100)
+    drift_sems = sqrt(november_drift(today)**2 + sems**2)
+    novprobs = matlab_round(win_probabilities(margins, drift_sems) * 100)
+    with open(filename, "w") as f:
+        for i in range(len(states)):
+            f.write(",".join([num2str(estimate.stateprobs[i]), num2str(margins[i]),
+                              num2str(d2probs[i]), num2str(r2probs[i]), states[i],
+                              num2str(novprobs[i])]) + "\n")
+
+
+def main():
+    global use_poll_sems
+
+    parser = argparse.ArgumentParser(description="Compute the EV distribution from %s "
+                                     "and write %s, %s, %s and %s" % (polls_filename,
+                                     estimates_filename, histogram_filename,
+                                     stateprobs_filename, jerseyvotes_filename))
+    parser.add_argument("--polls", default=polls_filename,
+                        help="the poll medians to read (default %(default)s)")
+    parser.add_argument("--analysisdate", type=int, default=0,
+                        help="the day of the year to use (default: the newest)")
+    parser.add_argument("--bias", type=float, default=0,
+                        help="points to add to each margin (biaspct); only "
+                        "%s is written if it isn't 0" % estimates_filename)
+    parser.add_argument("--today", type=parse_day,
+                        default=day_number(datetime.date.today()),
+                        help="the date (YYYY-MM-DD) to count the days to the "
+                        "election from, for the November probabilities")
+    parser.add_argument("--history", default=estimate_history_filename,
+                        help="the estimate history to take the prior meta-margin "
+                        "from (default %(default)s)")
+    parser.add_argument("--use-poll-sems", action="store_true",
+                        help="use each state's SEM (at least %d) rather than "
+                        "%d for all of them" % (sem_floor, sem_floor))
+    parser.add_argument("--no-metamargin", action="store_true",
+                        help="skip the meta-margin (metacalc=0)")
+    parser.add_argument("--mm-tolerance", type=float, default=metamargin_tolerance,
+                        help="find the meta-margin to within this many points, "
+                        "1/N of a point (default %(default)s)")
+    parser.add_argument("--mm-table", action="store_true",
+                        help="also scan EV_estimator.m's grid of biases and "
+                        "write the median EVs to %s" % mm_table_filename)
+    args = parser.parse_args()
+    use_poll_sems = args.use_poll_sems
+
+    polls = read_polls(args.polls, args.analysisdate)
+    result = estimate(polls, args.bias)
+    mm = no_metamargin
+    if not args.no_metamargin:
+        solved = solve_metamargin(polls, result, args.mm_tolerance)
+        mm = solved.metamargin
+        print "Meta-margin %g: median below %d EV at a bias of %g, not at %g " \
+            "(%d distributions)" % ((mm, tied_ev) + solved.bracket + (solved.evaluations,))
+        if args.mm_table:
+            (scanned, biases, evs) = metamargin_scan(polls, result)
+            if scanned != mm:
+                print "The %s scan gives a meta-margin of %g" % (mm_table_filename, scanned)
+            write_mm_table(mm, biases, evs)
+    november = november_win_probabilities(mm, args.today, mean_metamargin(args.history))
+    write_estimates(estimate_outputs(result, mm, november))
+    write_jerseyvotes(jerseyvotes(polls, mm))
+    if args.bias == 0:
+        write_histogram(result)
+        write_stateprobs(result, args.today)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,8 +33,13 @@
 #    
 ############################################################################
 
-import os, sys, urllib2, datetime, time, xml.dom.minidom, socket
+import os, re, datetime, socket, argparse, cStringIO
+import multiprocessing, bisect, collections
 from numpy import *
+import fetch_engine, pollster_xml, http_cache, request_scheduler, poll_archive
+import history_cache, poll_store, poll_statistics, median_history
+from day_numbers import day_number, date_of, parse_day, day_of_year
+from poll_index import PollIndex
 
 ############################################################################
 #
@@ -43,17 +48,67 @@ from numpy import *
 ############################################################################
 
 output_filename = "2016.EV.polls.median.txt"
+# The columns of output_filename, for the binary copy of it
+output_fields = ["num_polls", "oldest_end_date", "margin", "sem", "analysisdate", "statenum"]
 midtype = "median"
 num_recent_polls_to_use = 3
+# ...or the polls from this many days before the most recent one, if more
+recent_days = 7
+# Polls which started before this day are ignored
+first_poll_day = day_number(datetime.date(2016, 1, 1))
 huffpo_base_url = ""
-huffpo_childNodes_per_page = 21 # 10 polls per page, plus space childNode on either side
 archive_dir = "archive/ev/"
-
-huffpo_base_url = 'http://elections.huffingtonpost.com/pollster/api/polls.xml?question=16-%s-Pres-GE%%20TrumpvClinton&page=%s'
-
-state_polls = {}
-# state_polls is a dictionary with each an entry for each state. Each entry
-# is a list of tuples. Each tuple represents one poll and is of the form:
+archive_page_re = re.compile(r"^([A-Z]{2})(\d+)\.xml$") # e.g. OH2.xml
+# Fetched pages which held new polls are appended to a compressed
+# poll_archive in archive_dir. Paging stops at the first page with nothing
+# new (see below), so the archive on its own doesn't hold every poll: the
+# poll index does, and anything reading the archive has to read the index
+# too.
+
+# The state feeds are fetched in parallel. fetch_threads bounds the number
+# of states in flight at once. The request_scheduler caps the request rate
+# against HuffPost across all of them at max_requests_per_second (0 means
+# no cap), backing off when the server is busy, and retries failed pages.
+fetch_threads = 8
+max_requests_per_second = 4.0
+max_requests_per_host = 4
+scheduler = None
+
+# Pages are fetched through an on-disk HTTP cache, with conditional GETs
+page_cache = None
+
+huffpo_host = 'http://elections.huffingtonpost.com' # --base-url replaces this
+huffpo_base_url = huffpo_host + '/pollster/api/polls.xml?question=16-%s-Pres-GE%%20TrumpvClinton&page=%s'
+huffpo_question = "16-%s-Pres-GE TrumpvClinton"
+
+# Polls already ingested are kept in a sqlite index in archive_dir. Paging
+# through a state's feed stops at the first page holding only known polls,
+# and the older polls are loaded from the index instead. full_crawl ignores
+# the index and pages through every feed to the end (and rebuilds it). The
+# index, not the page archive, is the record of every poll seen so far.
+poll_index_filename = "poll_index.sqlite"
+poll_index = None
+known_polls = {}
+full_crawl = False
+
+# With --incremental, the statistics for each (state, day) are kept in a
+# history_cache in archive_dir, and only recomputed when the polls which
+# had ended by that day have changed
+history_cache_filename = "history_cache.json"
+history = None
+
+# The states' statistics can be computed in parallel, in this many processes
+# (--jobs)
+process_jobs = 1
+
+# The fields of the exploratory analysis files which aren't needed for the
+# statistics, kept in state_polls alongside the polls
+analysis_columns = ["vtype", "method", "trump", "clinton", "other", "undecided"]
+
+state_polls = poll_store.PollStore(analysis_columns)
+# state_polls is a poll_store.PollStore with the polls for each state (and
+# the national polls, as "US"). For the statistics, the polls are turned
+# back into tuples of the form:
 # (margin, start date, end date, mid date, population, polling organization)
 
 prev_outcome = {}
@@ -61,14 +116,11 @@ prev_outcome = {}
 # the outcome from the previous election for states which have had sparse
 # polling, if any, during the current campaign
 
-poll_ids = []
-max_filenum = 0
+poll_ids = set()
 
 # Files for exploratory analysis
 state_filename = "2016_StatePolls.csv"
-state_file = None
 national_filename = "2016_NationalPolls.csv"
-national_file = None
 
 us_state_abbrev = {
     'alabama': 'AL',
@@ -131,24 +183,48 @@ us_state_abbrev = {
 ############################################################################
 
 def main():
-    global max_filenum
     global midtype
     global output_filename
     global huffpo_base_url
-    global state_file, national_file
-
-    try:
-        if sys.argv[1] == "--mean":
-            midtype = "mean"
-            output_filename = "polls.mean.txt"
-    except:
-        pass
+    global fetch_threads, max_requests_per_second, scheduler
+    global full_crawl, page_cache, history, process_jobs
+
+    parser = argparse.ArgumentParser(description="Fetch the HuffPost state "
+                                     "polls and write %s" % output_filename)
+    parser.add_argument("--mean", action="store_true",
+                        help="use the mean rather than the median")
+    parser.add_argument("--threads", type=int, default=fetch_threads,
+                        help="number of state feeds to fetch at once")
+    parser.add_argument("--rate", type=float, default=max_requests_per_second,
+                        help="maximum requests per second (0 = no limit)")
+    parser.add_argument("--full", action="store_true",
+                        help="page through every feed, ignoring the poll index")
+    parser.add_argument("--replay", metavar="ARCHIVE_DIR",
+                        help="rebuild the polls from the pages archived in "
+                        "ARCHIVE_DIR instead of fetching them")
+    parser.add_argument("--base-url", default=huffpo_host,
+                        help="fetch from this server instead of HuffPost, "
+                        "e.g. a pollster_standin.py")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only recompute the days whose polls have "
+                        "changed since the last run")
+    parser.add_argument("--jobs", type=int, default=process_jobs,
+                        help="number of processes to compute the states' "
+                        "statistics in")
+    args = parser.parse_args()
+
+    if args.mean:
+        midtype = "mean"
+        output_filename = "polls.mean.txt"
+    fetch_threads = args.threads
+    max_requests_per_second = args.rate
+    full_crawl = args.full
+    process_jobs = args.jobs
+    huffpo_base_url = args.base_url.rstrip("/") + huffpo_base_url[len(huffpo_host):]
 
     for state in state_names:
-        state_polls[state] = []
+        state_polls.add_state(state)
 
-    state_file = init_analysis_file(state_filename)
-    national_file = init_analysis_file(national_filename)
     store_prev_outcome()
     
     # load base url
@@ -156,21 +232,30 @@ def main():
     #huffpo_base_url = huffpo_config.readline()[:-1]
     #huffpo_config.close()
 
-    # process archive of polls XXX why were we doing this? We get all polls anyway...
-    #for fname in os.listdir(archive_dir):
-    #    n = int(fname.split(".")[0])
-    #    if n > max_filenum:
-    #        max_filenum = n
-    #    parse_pollfile(archive_dir + fname)
+    if args.replay:
+        # rebuild the polls offline, from an earlier run's archive
+        replay_archive(args.replay)
+    else:
+        # get the latest polls
+        socket.setdefaulttimeout(5)
+        page_cache = http_cache.HTTPCache()
+        scheduler = request_scheduler.RequestScheduler(page_cache.fetch,
+                rate=max_requests_per_second, per_host=max_requests_per_host)
+        fetch_latest_polls()
+        print page_cache.summary()
+        print page_cache.pool.summary()
+
+    state_polls.freeze()
+    write_analysis_files()
 
-    # get the latest polls
-    socket.setdefaulttimeout(5)
-    fetch_latest_polls()
+    if args.incremental:
+        history = history_cache.HistoryCache(archive_dir + history_cache_filename)
 
     process_polls()
 
-    state_file.close()
-    national_file.close()
+    if history:
+        history.save()
+        print history.summary()
 
 
 def init_analysis_file(filename):
@@ -183,56 +268,31 @@ def init_analysis_file(filename):
     return outfile
 
 
-############################################################################
-#
-# Returns the median and std. error
-#
-############################################################################
-
-# The std. error is given by:
-#         std. deviation / sqrt(num of polls)
-#
-# We robustly estimate the std. deviation from the median absolute
-# deviation (MAD) using the standard formula:
-#        std. deviation =  MAD / invcdf(0.75)
-#
-# The MAD is defined as median( abs[samples - median(samples)] )
-# invcdf(0.75) is approximately 0.6745
-
-def get_statistics(set):
-    [margins, sdates, edates, mdates, pop, poll_orgs] = zip(*set)
-    set = array(margins)
-
-    num = set.size
-    assert num >= 3
-
-    if midtype == "median":
-        median_margin = median(set)
-        mad = median(abs(set - median_margin))
-        sem_est = mad/0.6745/sqrt(num)
-
-        return (median_margin, sem_est)
-
-    else:
-        assert midtype == "mean"
+# Write every poll to the state or national analysis file, in the order
+# they were processed
 
-        mean_margin = mean(set)
-        sem = std(set) / sqrt(num)
-
-        return (mean_margin, sem)
-
-# Special case for when only two polls are available
-
-def get_two_statistics(set):
-    [margins, sdates, edates, mdates, pop, poll_args] = zip(*set)
-    set = array(margins)
-
-    assert set.size == 2
+def write_analysis_files():
+    state_file = init_analysis_file(state_filename)
+    national_file = init_analysis_file(national_filename)
 
-    mean_margin = mean(set)
-    sem = max(std(set) / sqrt(set.size), 3)
+    rows = state_polls.in_added_order(arange(len(state_polls.state_code)))
+    columns = zip(state_polls.state_of(rows), state_polls.tuples(rows),
+                  *[state_polls.strings(rows, name) for name in analysis_columns])
+    for (state, poll, vtype, method, trump, clinton, other, undecided) in columns:
+        (margin, start, end, mid, pop, poll_org, affil) = poll
+        (start_date, end_date, mid_date) = (date_of(start), date_of(end), date_of(mid))
+        f = national_file if state == "US" else state_file
+
+        d = (start_date.month, start_date.day,start_date.year,
+             end_date.month, end_date.day, end_date.year,
+             mid_date.month, mid_date.day, mid_date.year)
+        f.write("%s,\"%s\",%d,\"%s\",\"%s\"," % (state, poll_org, pop, vtype, method))
+        f.write("%d,%d,%d,%d,%d,%d," % d[:6])
+        f.write("%s,%s,%s,%s," % (trump, clinton, other, undecided))
+        f.write("%s/%s/%s,%s/%s/%s,%s/%s/%s\n" % d)
 
-    return (mean_margin, sem)
+    state_file.close()
+    national_file.close()
 
 
 ############################################################################
@@ -253,114 +313,254 @@ def get_two_statistics(set):
 # Remember, the format of the tuple for each list:
 # (margin, start date, end date, mid date, pop, polling organization)
 
-def write_statistics(pfile, polls, nopolls):
-    # Number of polls available on this date for this state
-    num = len(polls)
-
-    if num == 0:
-        assert False
-    elif num == 1:
-        pfile.write("%s " % (0 if nopolls else num)) # if there were no real polls, write 0 in first column
-        pfile.write("%s " % int(polls[0][2].strftime("%j")))
-        pfile.write("%s " % polls[0][0])
-        pfile.write("%s " % sqrt(1.0/polls[0][4]))
-    elif num == 2:
-        pfile.write("%s " % num)
-        pfile.write("%s " % int(polls[1][2].strftime("%j")))
-        pfile.write("%s %s " % get_two_statistics(polls))
-    else:
-        # We want to use only the three most recent polls, as defined by the
-        # end date, and allowing for ties
-        polls.sort(key=lambda x: x[2], reverse=True)
-        third_date = polls[num_recent_polls_to_use - 1][2]
-        last_three = filter(lambda x: x[2] >= third_date, polls)
-
-        # Or, if this gives more polls, use the polls from the 7 days prior
-        # to the most recent poll.
-        polls.sort(key=lambda x: x[2], reverse=True)
-        most_recent_date = polls[0][2]
-        seven_days_prior = most_recent_date - datetime.timedelta(7, 0, 0)
-        last_seven_days = filter(lambda x: x[2] >= seven_days_prior, polls)
-
-        if (len(last_seven_days) > len(last_three)):
-            working_subset = last_seven_days
+# Returns the line of statistics for each of windows. Each window is a list
+# of the rows of state_polls in use on a day, in the order working_subset
+# gives them, or empty if there are none and the previous outcome is used.
+# The statistics for all of the windows are computed in one go.
+
+def write_statistics(state, windows):
+    rows = array([row for window in windows for row in window], int)
+    (margins, mask) = poll_statistics.padded(state_polls.columns["margin"][rows],
+                                             [len(window) for window in windows])
+
+    # A single poll's std. error comes from its population
+    single = [i for i in range(len(windows)) if len(windows[i]) == 1]
+    single_sem = zeros(len(windows))
+    single_sem[single] = sqrt(1.0 / state_polls.columns["pop"][[windows[i][0] for i in single]])
+
+    (mid, sem, count) = poll_statistics.window_statistics(margins, mask, midtype, single_sem)
+
+    end = state_polls.columns["end"]
+
+    lines = []
+    for (i, window) in enumerate(windows):
+        num = len(window)
+        if num == 0:
+            # if there were no real polls, write 0 in first column
+            poll = prev_outcome[state]
+            stats = (0, day_of_year(day_number(poll[2])), poll[0], sqrt(1.0/poll[4]))
+        elif num == 1:
+            stats = (num, day_of_year(int(end[window[0]])), float(mid[i]), sem[i])
+        elif num == 2:
+            # The minimum SEM for two polls has always been written as
+            # the int 3, which "%s" writes as "3"
+            stats = (num, day_of_year(int(end[window[1]])), mid[i],
+                     sem[i] if sem[i] > poll_statistics.two_poll_min_sem
+                     else poll_statistics.two_poll_min_sem)
         else:
-            working_subset = last_three
+            stats = (num, day_of_year(int(end[window[-1]])), mid[i], sem[i])
+        lines.append("%s %s %s %s " % stats)
 
-        pfile.write("%s " % len(working_subset))
-        pfile.write("%s " % int(working_subset[-1][2].strftime("%j")))
-        pfile.write("%s %s " % get_statistics(working_subset))
+    return lines
 
 
-def drop_overlapping_polls(polls):
-    if len(polls) <= 1:
-        return polls
+# Computes one state's statistics for every day. With --jobs this runs in
+# a multiprocessing worker, so the cells it stores in the history cache are
+# sent back along with them.
 
-    cleaned_polls = []
+def state_history(job):
+    (state, days) = job
+    statistics = state_statistics_by_day(state, state_polls.rows(state), days)
+    return (statistics, history.updates() if history else None)
 
-    # Reverse the order [::-1] so when multiple entries have the same pollster and date,
-    # the poll accepted is the first one that was originally entered into the feed.
-    # The motivation here is to respect each pollster's judgment about the topline result.
-    # sort by: pollster, start date (old to new), end date (old to new)
-    by_pollster = sorted(polls[::-1], key=lambda x: (x[5], x[1], x[2]))
-
-    prev_pollster = by_pollster[0][5]
-    prev_start    = by_pollster[0][1]
-    prev_end      = by_pollster[0][2]
-    prev_poll     = by_pollster[0]
-    cleaned_polls.append(by_pollster[0])
-
-    for poll in by_pollster[1:]:
-        if prev_pollster != poll[5]:
-            prev_pollster = poll[5]
-        else:
-            if prev_end > poll[1]:
-                cleaned_polls.pop()
-
-        prev_start    = poll[1]
-        prev_end      = poll[2]
-        prev_poll     = poll
-        cleaned_polls.append(poll)
-
-    # write_statistics expects polls to be sorted from newest to oldest
-    # by mid-date
-    cleaned_polls.sort(key=lambda x: x[3], reverse=True)
-    return cleaned_polls
 
 def process_polls():
     pfile = open(output_filename, "w")
 
-    # Make sure the polls are sorted with most recent first
-    for state in state_polls.keys():
-        polls = state_polls[state]
-        polls.sort(key=lambda x: x[2], reverse=True)
+    # The polls in state_polls are sorted with most recent first
+    days = list(campaign_season())
+    jobs = [(state, days) for state in sorted(state_names)]
+    if process_jobs > 1:
+        pool = multiprocessing.Pool(process_jobs)
+        try:
+            results = pool.map(state_history, jobs, chunksize=1)
+        finally:
+            pool.terminate()
+    else:
+        results = map(state_history, jobs)
+
+    statistics = {}
+    for ((state, days), (state_statistics, updates)) in zip(jobs, results):
+        statistics[state] = state_statistics
+        if history:
+            history.merge(updates)
 
     # Write the 51 lines of output statistics for each day, from now
-    # back to May 22
-    for day in campaign_season():
+    # back to May 22, and the same again in binary
+    states = sorted(state_names, key=lambda x: state_names[x])
+    binary = median_history.HistoryWriter(median_history.binary_filename(output_filename),
+                                          states, days, output_fields)
+    for day in days:
         statenum = 1
-        for state in sorted(state_names, key=lambda x: state_names[x]):
-            polls = state_polls[state]
+        for state in states:
+            line = statistics[state][day] + "%s %d\n" % (day_of_year(day), statenum)
+            pfile.write(line)
+            binary.add_line(day, statenum, line)
+            statenum += 1
 
-            # Remember, the format of the tuple for each list:
-            # (margin, start date, end date, mid date, pop, polling org)
-            polls_ended_before_day = filter(lambda x: x[2] < day, polls)
+    pfile.close()
+    binary.close()
 
-            #  reject two polls by the same pollster if their
-            # [startdate,enddate] intervals overlap (i.e. if older
-            # enddate>=newer startdate).
-            cleaned_polls = drop_overlapping_polls(polls_ended_before_day)
 
-            nopolls = False
-            if len(cleaned_polls) == 0:
-                cleaned_polls = [ prev_outcome[state] ]
-                nopolls = True
+############################################################################
+#
+# Sweep-line construction of each state's statistics, day by day.
+#
+# On a given day, the polls used for a state are those which ended before
+# that day, less any overlapped by a later poll from the same pollster
+# (when several polls are tied, the one entered into the feed first is
+# kept, respecting each pollster's judgment about the topline result). A
+# poll is dropped once such a poll has ended, so each poll is in use over a
+# single run of days: from the day after it ended, up to and including the
+# day the first overlapping poll ended. overlap_cleaned_runs works these
+# out for all of a state's polls at once, so that the polls in use on any
+# day are a mask (overlap_cleaned_on). Rather than apply that mask and sort
+# for every day, we walk the days in order, adding and removing polls as
+# their runs start and stop, and only recompute the statistics when the
+# set changes.
+#
+############################################################################
 
-            write_statistics(pfile, cleaned_polls, nopolls)
-            pfile.write("%s %d\n" % (int(day.strftime("%j")), statenum))
-            statenum += 1
 
-    pfile.close()
+# The polls of a state which are ever in use, each with the first and last
+# day it is in use (valid_from and valid_until, as day numbers; those which
+# are never dropped are valid until still_valid). rows are the polls'
+# state_polls rows and keys their sort keys, both in the order the overlap
+# rule sorts the polls in: by pollster, start date and end date, with ties
+# going to the poll entered into the feed first. Each key is (pollster
+# code, start, end, tie-break, row).
+
+OverlapRuns = collections.namedtuple("OverlapRuns", "rows keys valid_from valid_until")
+still_valid = iinfo(int32).max
+
+# Returns the OverlapRuns for rows, state_polls rows sorted as they are kept
+# (newest first by end date)
+
+def overlap_cleaned_runs(rows):
+    columns = state_polls.columns
+    pollster = columns["pollster"][rows].astype(int64)
+    start = columns["start"][rows].astype(int64)
+    end = columns["end"][rows].astype(int64)
+    n = len(rows)
+
+    order = lexsort((-arange(n), end, start, pollster))
+    (pollster, start, end) = (pollster[order], start[order], end[order])
+
+    # The later polls by the same pollster which overlap a poll are the ones
+    # right after it which start before it ends. As the polls are sorted by
+    # pollster and then start date, those run from the next poll up to the
+    # first one (by that or any later pollster) at or after (pollster, end).
+    by_start = (pollster << 32) + start
+    first = arange(1, n + 1)
+    after = maximum(searchsorted(by_start, (pollster << 32) + end, side="left"), first)
+    overlapped = after > first
+
+    # The poll is in use from the day after it ended until the day the
+    # first of those ended. reduceat needs an index past the last poll.
+    valid_from = end + 1
+    valid_until = zeros(n, int64) + still_valid
+    if n:
+        earliest = minimum.reduceat(concatenate([end, [0]]),
+                                    column_stack((first, after)).ravel())[::2]
+        valid_until[overlapped] = earliest[overlapped]
+    used = valid_until >= valid_from
+
+    order = order[used]
+    keys = zip(pollster[used].tolist(), start[used].tolist(), end[used].tolist(),
+               (-order).tolist(), rows[order].tolist())
+    return OverlapRuns(rows[order], keys, valid_from[used], valid_until[used])
+
+
+# The rows of the polls in use on day: those which ended before it, less
+# any overlapped by a later poll from the same pollster which has ended,
+# newest first by mid date
+
+def overlap_cleaned_on(runs, day):
+    in_use = (runs.valid_from <= day) & (day <= runs.valid_until)
+    rows = runs.rows[in_use]
+    return rows[argsort(-state_polls.columns["mid"][rows], kind="mergesort")]
+
+
+# Returns {day: the statistics written for the state on that day}
+
+def state_statistics_by_day(state, rows, days):
+    # Polls in use are kept sorted newest first by end date, then mid date,
+    # then in the order the overlap rule sorts them: the order
+    # write_statistics would leave them in
+    runs = overlap_cleaned_runs(rows)
+    mid = state_polls.columns["mid"][runs.rows].tolist()
+    entries = [(-key[2], -key_mid, key) for (key, key_mid) in zip(runs.keys, mid)]
+    valid_from = runs.valid_from.tolist()
+    valid_until = runs.valid_until.tolist()
+    starts = [(valid_from[i], None, entries[i])
+              for i in argsort(runs.valid_from, kind="mergesort").tolist()]
+    stops = [(None, valid_until[i], entries[i])
+             for i in argsort(runs.valid_until, kind="mergesort").tolist()
+             if valid_until[i] != still_valid]
+
+    if history:
+        digests = history_cache.input_digests(state_polls.digest_rows(rows), days,
+                repr((midtype, num_recent_polls_to_use, recent_days,
+                      prev_outcome.get(state))))
+
+    # Each day gets either a line from the history cache or the number of
+    # a window of polls, for write_statistics to do all at once
+    in_use = []
+    next_start = 0
+    next_stop = 0
+    windows = []
+    cells = []
+    line = None
+
+    for day in sorted(days):
+        changed = line is None
+        while next_start < len(starts) and starts[next_start][0] <= day:
+            bisect.insort(in_use, starts[next_start][2])
+            next_start += 1
+            changed = True
+        while next_stop < len(stops) and stops[next_stop][1] < day:
+            del in_use[bisect.bisect_left(in_use, stops[next_stop][2])]
+            next_stop += 1
+            changed = True
+
+        cached = history.lookup(state, day, digests[day]) if history else None
+        if cached is not None:
+            line = cached
+        elif changed:
+            windows.append(working_subset(in_use))
+            line = len(windows) - 1
+        cells.append((day, line, cached is not None))
+
+    lines = write_statistics(state, windows)
+
+    statistics = {}
+    for (day, line, reused) in cells:
+        if not isinstance(line, str):
+            line = lines[line]
+        if history:
+            history.store(state, day, digests[day], line, reused=reused)
+        statistics[day] = line
+
+    return statistics
+
+
+# The rows of the polls in use which the statistics are computed from
+
+def working_subset(in_use):
+    if len(in_use) <= 2:
+        # Newest first by mid date, as overlap_cleaned_on leaves them
+        by_mid = sorted(in_use, key=lambda x: (x[1], x[2]))
+        return [x[2][4] for x in by_mid]
+
+    # We want to use only the three most recent polls, as defined by the
+    # end date, and allowing for ties. Or, if this gives more polls, use the
+    # polls from the 7 days prior to the most recent poll.
+    # in_use starts with the negated end date, so those ending on or after
+    # the oldest date wanted are the ones before (-oldest + 1,)
+    third_date = -in_use[num_recent_polls_to_use - 1][0]
+    seven_days_prior = -in_use[0][0] - recent_days
+    oldest = min(third_date, seven_days_prior)
+    return [x[2][4] for x in in_use[:bisect.bisect_left(in_use, (-oldest + 1,))]]
 
 ############################################################################
 #
@@ -369,46 +569,177 @@ def process_polls():
 ############################################################################
 
 
+# Returns a request_scheduler.FetchResult
 def url_fetcher(page_num, state):
-    tries = 0
+    return scheduler.fetch(huffpo_base_url % (state, str(page_num)))
+
+
+def fetch_state_pages(state):
+    # Runs on a fetch_engine worker thread. Only fetch and parse here; the
+    # shared state (poll_ids, state_polls, the CSV files) is updated by
+    # fetch_latest_polls on the main thread, in the original state order.
+    # Returns the pages fetched, and the failed FetchResult if we couldn't
+    # get to the end of the feed.
+    pages = []
+    page_num = 0
     while True:
-        try:
-            f = urllib2.urlopen(huffpo_base_url % (state, str(page_num)))
-            return f
-        except urllib2.URLError:
-            if tries < 3:
-                tries += 1
-                time.sleep(2)
-            else:
-                print "FAIL on page %d (tried three times)" % page_num
-                sys.stdout.flush()
-                raise
+        page_num += 1
+        print "Fetching page %s for %s" % (str(page_num), state)
+        result = url_fetcher(page_num, state)
+        if not result.ok:
+            return (pages, result)
+
+        body = result.body
+        polls = list(pollster_xml.iter_polls(cStringIO.StringIO(body)))
+
+        if len(polls) == 0:
+            return (pages, None)
+
+        # Once a whole page is polls we already have, the rest of the
+        # feed is in the poll index too
+        known = known_polls[state]
+        new = [poll for poll in polls if poll.poll_id not in known]
+        if known and len(new) == 0:
+            return (pages, None)
+
+        pages.append((page_num, body, polls))
 
 
 def fetch_latest_polls():
-    global max_filenum
+    global poll_index
 
+    poll_index = PollIndex(archive_dir + poll_index_filename)
+    page_archive = poll_archive.PollArchive(archive_dir)
     for state in us_state_abbrev.values():
-        page_num = 0
-        stop = False
-        while (not stop):
-            page_num += 1
-            print "Fetching page %s for %s" % (str(page_num), state)
-            page = url_fetcher(page_num, state)
+        if full_crawl:
+            known_polls[state] = set()
+        else:
+            known_polls[state] = poll_index.known_ids(state, huffpo_question % state)
+
+    latencies = []
+    for (state, (pages, failure), elapsed) in fetch_engine.imap_ordered(
+            fetch_state_pages, us_state_abbrev.values(), fetch_threads):
+        latencies.append((state, elapsed, len(pages) + 1))
+        state_history = []
+
+        for (page_num, body, polls) in pages:
+            polls = unique_polls(polls)
+            process_pollfile(polls, state)
+            state_history.extend(polls)
+
+            # Archive the page as it came off the wire, as long as it
+            # held something new. The polls we already had are in the
+            # poll index, not here.
+            if len(polls) > 0:
+                name = "%s%s.xml" % (state, str(page_num))
+                page_archive.append("page", name, body, state=state)
+                print "Archived %d polls from %s" % (len(polls), name)
+
+        # Pick up the older polls from the index. Those which were also on
+        # the pages we fetched have already been processed and are skipped.
+        # If we couldn't get through the feed, fall back on the index even
+        # for a full crawl.
+        if failure is not None:
+            print "Could not fetch all of %s: %s" % (state, failure)
+        if not full_crawl or failure is not None:
+            polls = unique_polls(poll_index.polls(state, huffpo_question % state))
+            process_pollfile(polls, state)
+            state_history.extend(polls)
+            print "Loaded %d polls for %s from the poll index" % (len(polls), state)
+
+        poll_index.replace(state, huffpo_question % state, state_history)
+
+    poll_index.close()
+    fetch_engine.report_latencies(latencies)
+    scheduler.report_failures()
+
 
-            (xmldoc, stop) = parse_pollfile(page, state)
-            xmldoc.childNodes[0].normalize()
+############################################################################
+#
+# Replays the pages archived by fetch_latest_polls, without the network.
+# The pages are parsed in parallel, then processed in the same order that
+# fetch_latest_polls would have processed them, each state's followed by
+# the state's polls from the poll index in the archive directory (if there
+# is one), as the live run loads them: the archive only has the pages
+# which held new polls. Every version of every page is read from the
+# poll_archive, not just the latest, since a page's name is only its
+# position in the feed at the time: as new polls come in, the older ones
+# move on to later pages, and a poll may be only in an old version of a
+# page. The polls are told apart by poll ID, and each run's pages are read
+# newest run first, which is the order the live run saw them in. A
+# directory of loose XML pages, as written by older versions of this
+# script, works too.
+#
+############################################################################
+
+
+def load_archive_page(page):
+    # Runs in a multiprocessing worker. page is a poll_archive.ArchiveEntry
+    # or the name of a loose XML file.
+    if isinstance(page, poll_archive.ArchiveEntry):
+        page = cStringIO.StringIO(poll_archive.read_entry(page))
+    return list(pollster_xml.iter_polls(page))
 
-            if len(xmldoc.childNodes[0].childNodes) > 1:
-                max_filenum += 1
-                f = open("%s%s%s.xml" % (archive_dir, state, str(page_num)), 'w')
-                s=xmldoc.toxml(encoding="utf-8")
-                f.write(s)
-                f.close()
-                print "Wrote %d polls to %s" % (0.5 * (len(xmldoc.childNodes[0].childNodes) - 1), "%s%s%s.xml" % (archive_dir, state, str(page_num)))
 
-            if not stop:
-                time.sleep(1)
+# Puts (page number, page) pairs for one state, as archived (oldest
+# first), in the order to replay them: each run archived its pages in page
+# order, so a page number no higher than the last starts a new run
+
+def newest_run_first(pages):
+    runs = []
+    for (page_num, page) in pages:
+        if not runs or page_num <= runs[-1][-1][0]:
+            runs.append([])
+        runs[-1].append((page_num, page))
+    return [page for run in reversed(runs) for page in run]
+
+
+def replay_archive(replay_dir):
+    if poll_archive.exists(replay_dir):
+        found = [(entry.name, entry) for entry in
+                 poll_archive.PollArchive(replay_dir).entries(kind="page")]
+    else:
+        found = [(fname, os.path.join(replay_dir, fname))
+                 for fname in os.listdir(replay_dir)]
+
+    pages = {}
+    for (fname, page) in found:
+        m = archive_page_re.match(fname)
+        if m:
+            pages.setdefault(m.group(1), []).append((int(m.group(2)), page))
+    if not poll_archive.exists(replay_dir):
+        # Loose files: one version of each page, in no particular order
+        for state_pages in pages.values():
+            state_pages.sort()
+
+    order = [(state, page) for state in us_state_abbrev.values()
+             for (page_num, page) in newest_run_first(pages.get(state, []))]
+
+    pool = multiprocessing.Pool()
+    try:
+        loaded = pool.map(load_archive_page, [page for (state, page) in order])
+    finally:
+        pool.terminate()
+
+    loaded_by_state = {}
+    for ((state, page), polls) in zip(order, loaded):
+        loaded_by_state.setdefault(state, []).append(polls)
+
+    index_file = os.path.join(replay_dir, poll_index_filename)
+    index = PollIndex(index_file) if os.path.exists(index_file) else None
+    for state in us_state_abbrev.values():
+        for polls in loaded_by_state.get(state, []):
+            process_pollfile(unique_polls(polls), state)
+        # The polls already seen, skipping those on the pages, as in
+        # fetch_latest_polls
+        if index:
+            process_pollfile(unique_polls(index.polls(state, huffpo_question % state)),
+                             state)
+    if index:
+        index.close()
+
+    print "Replayed %d archived pages from %s%s" % (len(order), replay_dir,
+                                                    " and its poll index" if index else "")
 
 
 ############################################################################
@@ -420,51 +751,30 @@ def fetch_latest_polls():
 ############################################################################
 
 
-def parse_pollfile(filename, state):
-    (xmldoc, stop) = unique_polls(filename)
-    process_pollfile(xmldoc, state)
-    return (xmldoc, stop)
-
-
-def unique_polls(filename):
-    xmldoc = xml.dom.minidom.parse(filename)
-    
-    pi_nodes = xmldoc.getElementsByTagName("id")
-
-    if len(pi_nodes) == 0:
-        return (xmldoc, True)
-    
-    for pi_node in pi_nodes:
-        poll_id = int(pi_node.childNodes[0].nodeValue)
+# Returns the polls (pollster_xml.PollRecords) we have not seen before
 
-        if poll_id in poll_ids:
-            poll_node = pi_node.parentNode
-            polls = poll_node.parentNode
-            polls.removeChild(poll_node)
-        else:
-            poll_ids.append(poll_id)
-    
-    return (xmldoc, False)
+def unique_polls(polls):
+    new_polls = []
 
+    for poll in polls:
+        if poll.poll_id in poll_ids:
+            continue
+        if poll.poll_id is not None:
+            poll_ids.add(poll.poll_id)
+        new_polls.append(poll)
 
-def get_opt_subelem(elem, name, default):
-    tmp = elem.getElementsByTagName(name)
-    if len(tmp) > 0 and tmp[0].hasChildNodes():
-        return tmp[0].childNodes[0].nodeValue
-    return default
+    return new_polls
 
 
 def subpop_parse(subpop):
     values = {"Clinton":"", "Trump":"", "Other":"", "Undecided":""}
 
-    vtype = get_opt_subelem(subpop, "name", "")
-    pop = int(get_opt_subelem(subpop, "observations", "1")) # if no population size, pretend it's 1
-
-    responses = subpop.getElementsByTagName("response")
+    vtype = subpop.name or ""
+    pop = int(subpop.observations or "1") # if no population size, pretend it's 1
 
-    for r in responses:
-        candidate = r.getElementsByTagName("choice")[0].childNodes[0].nodeValue
-        value = r.getElementsByTagName("value")[0].childNodes[0].nodeValue
+    for (candidate, value) in subpop.responses:
+        if candidate is None or value is None:
+            raise ValueError("response without a choice or value")
         for v in values.keys():
             if candidate.count(v):
                 candidate = v
@@ -477,64 +787,48 @@ def subpop_parse(subpop):
 
 
 def process_subpop(poll_org, method, state, start_date, end_date, subpop):
-    global state_file, national_file
-
     (vtype, pop, values) = subpop_parse(subpop)
 
     mid_date = start_date + ((end_date - start_date) / 2)
     margin = float(values["Clinton"]) - float(values["Trump"]) 
-    f = None
-
-    if state != "US":
-        state_polls[state].append((margin, start_date, end_date,
-                                   mid_date, pop, poll_org))
-        f = state_file
-    else:
-        f = national_file
-
-    d = (start_date.month, start_date.day,start_date.year,
-         end_date.month, end_date.day, end_date.year,
-         mid_date.month, mid_date.day, mid_date.year)
-    f.write("%s,\"%s\",%d,\"%s\",\"%s\"," % (state, poll_org, pop, vtype, method))
-    f.write("%d,%d,%d,%d,%d,%d," % d[:6])
-    f.write("%s,%s,%s,%s," % (values["Trump"], values["Clinton"],
-        values["Other"], values["Undecided"]))
-    f.write("%s/%s/%s,%s/%s/%s,%s/%s/%s\n" % d)
 
+    # The national polls only go into the analysis file
+    state_polls.add(state, margin, start_date, end_date, mid_date, pop, poll_org,
+                    vtype=vtype, method=method, trump=values["Trump"],
+                    clinton=values["Clinton"], other=values["Other"],
+                    undecided=values["Undecided"])
 
-def process_pollfile(xmldoc, state):
-    codes = xmldoc.getElementsByTagName("code")
-    presCodes = filter(lambda x: x.hasChildNodes() and x.childNodes[0].nodeValue.endswith("Pres-GE TrumpvClinton"), codes)
-    questions = map(lambda x: x.parentNode, presCodes)
 
-    for q in questions:
-        try:
-            poll = q.parentNode.parentNode
-            poll_org = poll.getElementsByTagName("pollster")[0].childNodes[0].nodeValue
-            method = get_opt_subelem(poll, "method", "")
-            start_date = strpdate(poll.getElementsByTagName("start_date")[0].childNodes[0].nodeValue)
-            end_date = strpdate(poll.getElementsByTagName("end_date")[0].childNodes[0].nodeValue)
-
-            if start_date < datetime.date(2016, 1, 1):
+def process_pollfile(polls, state):
+    for poll in polls:
+        for q in poll.questions:
+            if q.code is None or not q.code.endswith("Pres-GE TrumpvClinton"):
                 continue
 
-            subpops = q.getElementsByTagName("subpopulation")
-
-            if len(subpops) >= 2:
-                for subpop in subpops:
-                    vtype = get_opt_subelem(subpop, "name", "")
-                    if vtype == "Likely Voter":
-                        process_subpop(poll_org, method, state, start_date, end_date, subpop)
-            else:
-                for subpop in subpops:
-                    process_subpop(poll_org, method, state, start_date, end_date, subpop)
-        except Exception as e:
             try:
-                print "Problem processing poll #%s: %s" % (q.parentNode.parentNode.getElementsByTagName("id")[0].childNodes[0].nodeValue, e.message)
-                print q.parentNode.parentNode.toprettyxml(encoding="utf-8")
-            except:
-                print "Very bad problem with below question. Ignoring:"
-                print q.toprettyxml(encoding="utf-8")
+                if poll.pollster is None:
+                    raise ValueError("no pollster")
+                poll_org = poll.pollster
+                method = poll.method or ""
+                start_date = parse_day(poll.start_date)
+                end_date = parse_day(poll.end_date)
+
+                if start_date < first_poll_day:
+                    continue
+
+                subpops = q.subpopulations
+
+                if len(subpops) >= 2:
+                    for subpop in subpops:
+                        vtype = subpop.name or ""
+                        if vtype == "Likely Voter":
+                            process_subpop(poll_org, method, state, start_date, end_date, subpop)
+                else:
+                    for subpop in subpops:
+                        process_subpop(poll_org, method, state, start_date, end_date, subpop)
+            except Exception as e:
+                print "Problem processing poll #%s: %s" % (poll.poll_id, e)
+                print poll
 
 
 ############################################################################
@@ -543,24 +837,17 @@ def process_pollfile(xmldoc, state):
 #
 ############################################################################
 
-# Parses a date_string into a datetime.date. Included here to support
-# Python 2.4, which lacks datetime.datetime.strpdate()
-
-def strpdate(date_string, format="%Y-%m-%d"):
-    return datetime.date(*(time.strptime(date_string, format)[0:3]))
-
-
-# Generates all of the dates in the general election campaign season,
-# starting from today and working back to May 22nd
+# Generates all of the dates in the general election campaign season, as
+# day numbers, starting from today and working back to May 22nd
 
 def campaign_season():
-    day = datetime.date.today()
-    # start = datetime.date(2012, 5, 22)
-    start = datetime.date(2016, 5, 22)
+    day = day_number(datetime.date.today())
+    # start = day_number(datetime.date(2012, 5, 22))
+    start = day_number(datetime.date(2016, 5, 22))
 
     while day >= start:
         yield day
-        day = day - datetime.timedelta(1, 0, 0)
+        day -= 1
 
 
 # Hard-code 2012 results for several states since there is no current
@@ -0,0 +1,71 @@
+############################################################################
+#
+# Bounded-concurrency fetching for the poll updaters.
+#
+# The HuffPost feeds are paged, and each state (or race) is an independent
+# chain of requests. fetch_engine runs those chains on a small pool of
+# worker threads (the request rate itself is policed by request_scheduler,
+# which the chains fetch through). Results are handed back
+# to the caller in the order the tasks were submitted, so anything that
+# depends on processing order (e.g. de-duplicating poll IDs) behaves
+# exactly as it did when the feeds were fetched one at a time.
+#
+############################################################################
+
+import sys, threading, time
+
+
+def imap_ordered(worker, tasks, num_threads):
+    """Run worker(task) for every task on num_threads threads.
+
+    Yields (task, result, elapsed seconds) in the order of tasks, as soon
+    as each one (and every task before it) is done. An exception raised by
+    the worker is re-raised here when its task comes up."""
+
+    tasks = list(tasks)
+    slots = [None] * len(tasks)
+    done = [threading.Event() for task in tasks]
+    next_task = [0]
+    lock = threading.Lock()
+
+    def run():
+        while True:
+            with lock:
+                i = next_task[0]
+                if i >= len(tasks):
+                    return
+                next_task[0] += 1
+
+            start = time.time()
+            try:
+                slots[i] = (True, worker(tasks[i]), time.time() - start)
+            except Exception:
+                slots[i] = (False, sys.exc_info(), time.time() - start)
+            done[i].set()
+
+    for n in range(max(1, min(num_threads, len(tasks)))):
+        t = threading.Thread(target=run)
+        t.daemon = True # don't hold up the interpreter on ^C
+        t.start()
+
+    for i, task in enumerate(tasks):
+        # Event.wait() without a timeout can't be interrupted on Python 2
+        while not done[i].wait(1):
+            pass
+
+        (ok, result, elapsed) = slots[i]
+        slots[i] = None
+        if not ok:
+            raise result[0], result[1], result[2]
+        yield (task, result, elapsed)
+
+
+def report_latencies(latencies, out=sys.stdout):
+    """Print (name, elapsed seconds, number of requests) rows, slowest
+    first, so that slow feeds stand out in the nightly log."""
+
+    out.write("Fetch time by feed (slowest first):\n")
+    for (name, elapsed, requests) in sorted(latencies, key=lambda x: x[1], reverse=True):
+        out.write("  %-4s %7.2fs  %3d request%s\n" % (name, elapsed, requests,
+                  "" if requests == 1 else "s"))
+    out.flush()
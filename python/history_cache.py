@@ -0,0 +1,121 @@
+############################################################################
+#
+# Cache of the day-by-day statistics written by the poll updaters.
+#
+# Every night the updaters write statistics for every state (or race) for
+# every day of the season, though usually only the newest day, and the
+# days after a late-entered poll, have anything new in them. The cache
+# keeps each (state, day) cell from the last run together with a digest
+# of what it was computed from: the polls which had ended before that day,
+# in order, plus anything else the caller says the cell depends on. A cell
+# whose digest hasn't changed is copied over rather than recomputed.
+#
+# A poll entered late, with an end date in the past, changes the digest of
+# every day after it ended, so those days (and only those) are redone.
+#
+############################################################################
+
+import os, json, hashlib
+
+# Bump this when the way the statistics are computed changes, to throw
+# away cells computed the old way
+cache_version = 2
+
+
+class HistoryCache(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.old_cells = {}
+        self.cells = {}
+        self.reused = 0
+        self.changed = 0
+
+        try:
+            with open(filename) as f:
+                saved = json.load(f)
+            if saved.get("version") == cache_version:
+                self.old_cells = saved["cells"]
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def lookup(self, state, day, digest):
+        """The cell saved for (state, day), if its digest matches, else None"""
+        cell = self.old_cells.get(cell_key(state, day))
+        if cell is None or cell[0] != digest:
+            return None
+        return as_str(cell[1])
+
+    def store(self, state, day, digest, value, reused=False):
+        """Keep value (a string, or a list of them) for the next run.
+        reused says whether it came from lookup(), for the summary."""
+        self.cells[cell_key(state, day)] = [digest, value]
+        if reused:
+            self.reused += 1
+        else:
+            self.changed += 1
+
+    def updates(self):
+        """The cells stored since the last call (or since loading), and
+        forget them. A worker process sends these back to be merged into
+        the parent's cache."""
+        updates = (self.cells, self.reused, self.changed)
+        self.cells = {}
+        self.reused = 0
+        self.changed = 0
+        return updates
+
+    def merge(self, updates):
+        (cells, reused, changed) = updates
+        self.cells.update(cells)
+        self.reused += reused
+        self.changed += changed
+
+    def save(self):
+        # Only cells stored on this run are kept, so days which have
+        # dropped out of the season don't pile up
+        tmp = "%s.%d.tmp" % (self.filename, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({"version": cache_version, "cells": self.cells}, f)
+        os.rename(tmp, self.filename)
+
+    def summary(self):
+        return ("History cache: %d cells unchanged since the last run, "
+                "%d new or changed" % (self.reused, self.changed))
+
+
+def cell_key(state, day):
+    return "%s %d" % (state, day)
+
+
+def as_str(value):
+    # json gives back unicode; the output files are plain ASCII
+    if isinstance(value, list):
+        return [as_str(v) for v in value]
+    return str(value)
+
+
+def digest_text(poll):
+    # A poll loaded from the poll index has its strings as unicode (json
+    # gives them back that way) and the same poll parsed from the feed has
+    # them as str; they must hash alike
+    return repr(tuple(v.encode("utf-8") if isinstance(v, unicode) else v
+                      for v in poll))
+
+
+def input_digests(polls, days, extra=""):
+    """{day: digest of the polls which ended before day} for polls sorted
+    newest first by end date (poll[2]), as the updaters keep them. Days
+    are day numbers. The
+    order of polls with the same end date counts, as the updaters break
+    ties by it. extra is mixed into every digest."""
+    oldest_first = polls[::-1]
+    h = hashlib.sha1(extra)
+    digests = {}
+    i = 0
+    for day in sorted(days):
+        while i < len(oldest_first) and oldest_first[i][2] < day:
+            h.update(digest_text(oldest_first[i]))
+            h.update("\n")
+            i += 1
+        digests[day] = h.hexdigest()
+    return digests
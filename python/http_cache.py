@@ -0,0 +1,207 @@
+#!/usr/bin/python
+
+############################################################################
+#
+# On-disk HTTP response cache for the HuffPost feeds.
+#
+# Every response body is kept in cache_dir along with its ETag and
+# Last-Modified headers. The next request for the same URL is made
+# conditional (If-None-Match / If-Modified-Since), and a 304 Not Modified
+# is answered from the cached copy. Most race pages don't change from one
+# night to the next, so most requests come back without a body.
+#
+# A body can be read as it arrives, with open(), in which case it is
+# written to the cache as it goes and kept only once all of it is in.
+#
+# Requests go out over the keep-alive connections in http_pool. Used by
+# ev_update_polls.py and senate_update_polls.py, and from the shell stages
+# in place of wget:
+#
+#     python http_cache.py URL OUTFILE [CACHE_DIR]
+#
+# which retries through a request_scheduler, as the updaters do, and only
+# replaces OUTFILE once the whole body is in.
+#
+############################################################################
+
+import os, sys, json, hashlib, threading, socket
+import http_pool, request_scheduler
+
+default_cache_dir = "archive/http/"
+
+
+class HTTPCache(object):
+    def __init__(self, cache_dir=default_cache_dir, pool=None):
+        self.cache_dir = cache_dir
+        self.pool = pool or http_pool.default_pool
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_fetched = 0
+        self.bytes_saved = 0
+
+    def paths(self, url):
+        key = os.path.join(self.cache_dir, hashlib.sha1(url).hexdigest())
+        return (key + ".body", key + ".meta")
+
+    def fetch(self, url):
+        """Return the body of url, from the cache if the server says it
+        hasn't changed. HTTP errors other than 304 are raised as
+        urllib2.HTTPError, as urlopen would."""
+        f = self.open(url)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def open(self, url):
+        """Like fetch(), but return a file-like object to read (or iterate
+        over the lines of) the body as it arrives, without holding all of
+        it in memory"""
+        (body_file, meta_file) = self.paths(url)
+        meta = read_meta(meta_file, url)
+
+        # The validators are no use without the body they validate (after
+        # a partial cleanup, say), so then the request is unconditional
+        headers = {}
+        if os.path.exists(body_file):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        response = self.pool.open(url, headers)
+        if response.status == 304 and headers:
+            response.finish()
+            try:
+                f = open(body_file, "rb")
+            except IOError:
+                # Gone since we looked: ask again, for the whole body
+                response = self.pool.open(url, {})
+            else:
+                self.count(hit=True, size=os.fstat(f.fileno()).st_size)
+                return f
+        if not 200 <= response.status < 300:
+            raise http_pool.http_error(response.finish())
+
+        meta = {"url": url,
+                "etag": response.getheader("ETag"),
+                "last_modified": response.getheader("Last-Modified")}
+        return CachingReader(self, response, body_file, meta_file, meta)
+
+    def count(self, hit, size):
+        with self.lock:
+            if hit:
+                self.hits += 1
+                self.bytes_saved += size
+            else:
+                self.misses += 1
+                self.bytes_fetched += size
+
+    def summary(self):
+        return ("HTTP cache: %d hits, %d misses, %d bytes fetched, "
+                "%d bytes saved" % (self.hits, self.misses,
+                                    self.bytes_fetched, self.bytes_saved))
+
+
+class CachingReader(object):
+    """Reads a response body, copying it into the cache on the way"""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, cache, response, body_file, meta_file, meta):
+        self.cache = cache
+        self.response = response
+        self.body_file = body_file
+        self.meta_file = meta_file
+        self.meta = meta
+        self.tmp = "%s.%d.%d.tmp" % (body_file, os.getpid(), id(self))
+        self.out = open(self.tmp, "wb")
+        self.size = 0
+        self.done = False
+
+    def read(self, size=-1):
+        if self.done:
+            return ""
+        if size is None or size < 0:
+            data = self.response.read()
+        else:
+            data = self.response.read(size)
+        self.out.write(data)
+        self.size += len(data)
+        if not data or size is None or size < 0:
+            self.finish()
+        return data
+
+    def __iter__(self):
+        # Split on newlines only, as iterating over a file would
+        pending = ""
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            data = pending + chunk
+            end = data.rfind("\n") + 1
+            pending = data[end:]
+            for line in data[:end].split("\n")[:-1]:
+                yield line + "\n"
+        if pending:
+            yield pending
+
+    def finish(self):
+        self.done = True
+        self.response.close()
+        self.out.close()
+        if self.meta["etag"] or self.meta["last_modified"]:
+            os.rename(self.tmp, self.body_file)
+            write_atomically(self.meta_file, json.dumps(self.meta))
+        else:
+            os.remove(self.tmp)
+        self.cache.count(hit=False, size=self.size)
+
+    def close(self):
+        # Anything not read to the end isn't kept
+        if not self.done:
+            self.done = True
+            self.response.close()
+            self.out.close()
+            os.remove(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_meta(meta_file, url):
+    try:
+        with open(meta_file) as f:
+            meta = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    # Guard against a (vanishingly unlikely) hash collision
+    return meta if meta.get("url") == url else {}
+
+
+def write_atomically(filename, data):
+    tmp = "%s.%d.tmp" % (filename, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.rename(tmp, filename)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        raise ValueError("Usage: requires 2 or 3 arguments: url output_file [cache_dir]")
+    socket.setdefaulttimeout(5)
+    cache = HTTPCache(*sys.argv[3:])
+    result = request_scheduler.RequestScheduler(cache.fetch, rate=0).fetch(sys.argv[1])
+    if not result.ok:
+        raise IOError("could not fetch %s: %s" % (sys.argv[1], result))
+    write_atomically(sys.argv[2], result.body)
+    print cache.summary()
+    print cache.pool.summary()
@@ -0,0 +1,214 @@
+############################################################################
+#
+# A keep-alive HTTP connection pool for the HuffPost fetchers.
+#
+# urllib2.urlopen opens a new TCP connection (and, for https, does a new
+# TLS handshake) for every request. A nightly run makes a few hundred
+# requests to the same one or two hosts, so instead we keep the
+# connections open and hand them out again: a request checks out an idle
+# connection to its host if there is one, and gives it back once the
+# response has been read.
+#
+# A response can also be read as it arrives (open() rather than get()), in
+# which case its connection goes back to the pool when it is closed.
+#
+# The pool counts how often a connection was reused and how long was
+# spent connecting and in the TLS handshake; summary() reports both.
+#
+# HTTPCache fetches through default_pool, so everything in one process
+# (the EV pager threads, the Senate race fetcher, the approval and House
+# downloads) shares its connections.
+#
+############################################################################
+
+import time, socket, threading, urllib2, urlparse, httplib, cStringIO
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+user_agent = "Python-urllib/2.7"
+redirect_statuses = (301, 302, 303, 307)
+max_redirects = 5
+
+
+class Response(object):
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers    # an httplib.HTTPMessage
+        self.body = body
+
+    def getheader(self, name, default=None):
+        return self.headers.getheader(name, default)
+
+
+class PooledResponse(object):
+    """A response whose body hasn't been read yet. Call close() when done
+    with it, to give the connection back to the pool."""
+
+    def __init__(self, pool, key, conn, url, response):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.url = url
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+
+    def getheader(self, name, default=None):
+        return self.headers.getheader(name, default)
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def finish(self):
+        """Read the rest of the body, close, and return it all as a Response"""
+        try:
+            body = self.read()
+        finally:
+            self.close()
+        return Response(self.url, self.status, self.reason, self.headers, body)
+
+    def close(self):
+        if self.conn is None:
+            return
+        # httplib closes the response once the whole body has been read.
+        # A connection with a half-read response on it is no use to anyone.
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.checkin(self.key, self.conn)
+        else:
+            self.conn.close()
+        self.conn = None
+
+
+class ConnectionPool(object):
+    def __init__(self, max_idle_per_host=8):
+        self.max_idle_per_host = max_idle_per_host
+        self.lock = threading.Lock()
+        self.idle = {}    # (scheme, host, port) -> [HTTPConnection, ...]
+
+        self.requests = 0
+        self.connections = 0
+        self.reused = 0
+        self.connect_time = 0.0
+        self.tls_time = 0.0
+
+    def get(self, url, headers={}):
+        """GET url, following redirects, and return a Response. The
+        status may be anything; it's up to the caller to check it.
+        Network errors are raised as socket.error or httplib.HTTPException."""
+        return self.open(url, headers).finish()
+
+    def open(self, url, headers={}):
+        """Like get(), but returns a PooledResponse to read the body from"""
+        for i in range(max_redirects + 1):
+            response = self.request(url, headers)
+            location = response.getheader("Location")
+            if response.status not in redirect_statuses or not location:
+                return response
+            response.finish()
+            url = urlparse.urljoin(url, location)
+        return response
+
+    def request(self, url, headers):
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        all_headers = {"User-Agent": user_agent, "Accept-Encoding": "identity"}
+        all_headers.update(headers)
+
+        (conn, reused) = self.checkout(key)
+        try:
+            response = self.send(conn, path, all_headers)
+        except (socket.error, httplib.HTTPException):
+            conn.close()
+            if not reused:
+                raise
+            # The server probably dropped the idle connection; one more go
+            # on a fresh one
+            (conn, reused) = self.checkout(key, fresh=True)
+            try:
+                response = self.send(conn, path, all_headers)
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                raise
+
+        with self.lock:
+            self.requests += 1
+        return PooledResponse(self, key, conn, url, response)
+
+    def send(self, conn, path, headers):
+        conn.request("GET", path, headers=headers)
+        return conn.getresponse()
+
+    def checkout(self, key, fresh=False):
+        with self.lock:
+            if not fresh and self.idle.get(key):
+                self.reused += 1
+                return (self.idle[key].pop(), True)
+        return (self.connect(key), False)
+
+    def checkin(self, key, conn):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def connect(self, key):
+        """Open a connection ourselves, rather than leaving it to httplib,
+        so that the TCP connect and the TLS handshake can be timed apart."""
+        (scheme, host, port) = key
+        start = time.time()
+        sock = socket.create_connection((host, port), socket.getdefaulttimeout())
+        connected = time.time()
+
+        if scheme == "https":
+            if ssl is None:
+                sock.close()
+                raise urllib2.URLError("https is not supported by this Python")
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+            conn = httplib.HTTPSConnection(host, port)
+        else:
+            conn = httplib.HTTPConnection(host, port)
+        conn.sock = sock
+        finished = time.time()
+
+        with self.lock:
+            self.connections += 1
+            self.connect_time += connected - start
+            self.tls_time += finished - connected
+        return conn
+
+    def close(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def summary(self):
+        return ("HTTP pool: %d requests over %d connections (%d reused), "
+                "%.2fs connecting, %.2fs in TLS" % (self.requests,
+                self.connections, self.reused, self.connect_time, self.tls_time))
+
+
+# Shared by every fetcher in the process
+default_pool = ConnectionPool()
+
+
+def http_error(response):
+    """An urllib2.HTTPError for response, for callers that expect urlopen's
+    behaviour of raising on an error status"""
+    return urllib2.HTTPError(response.url, response.status, response.reason,
+                             response.headers, cStringIO.StringIO(response.body))
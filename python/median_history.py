@@ -0,0 +1,133 @@
+#!/usr/bin/python
+
+############################################################################
+#
+# Binary copy of a polls.median history, for readers that want one day.
+#
+# The updaters write their statistics as text, one line per state (or
+# race) per day, newest day first. Alongside each text file they now write
+# the same numbers as a fixed-width binary file (2016.EV.polls.median.txt
+# gets 2016.EV.polls.median.bin) laid out as:
+#
+#   "PEC-POLLS-HISTORY <version> <header size>\n"
+#   a JSON header, padded with spaces to <header size> bytes, giving the
+#       state order, the newest and oldest days, and the field names
+#   little-endian float64 records, days x states x fields, newest day
+#       first and states in the order of the text file
+#
+# so the block for any one day is at a known offset, and numpy.memmap can
+# hand it back without reading the rest of the file.
+#
+#     python median_history.py FILE.bin [YYYY-MM-DD]
+#
+# prints the header, or the block for a day as the text file has it.
+#
+############################################################################
+
+import os, sys, json, datetime
+from numpy import zeros, memmap, dtype
+from day_numbers import date_of, day_number, parse_day
+
+magic = "PEC-POLLS-HISTORY"
+version = 1
+record_dtype = dtype("<f8")
+header_alignment = 64
+
+
+def binary_filename(text_filename):
+    return os.path.splitext(text_filename)[0] + ".bin"
+
+
+class HistoryWriter(object):
+    """Collects the lines written to a text history and writes them out as
+    a binary one. days are day numbers, newest first and one day apart,
+    as campaign_season() gives them; states are in the text file's order."""
+
+    def __init__(self, filename, states, days, fields):
+        for (newer, older) in zip(days, days[1:]):
+            assert newer - older == 1
+        self.filename = filename
+        self.states = list(states)
+        self.days = list(days)
+        self.fields = list(fields)
+        self.values = zeros((len(self.days), len(self.states), len(self.fields)),
+                            record_dtype)
+        self.day_index = dict((day, i) for (i, day) in enumerate(self.days))
+
+    def add_line(self, day, state_num, line):
+        """Record a line of the text file: state_num is its 1-based state
+        index, and line has the numbers for each of the fields"""
+        self.values[self.day_index[day], state_num - 1] = [float(x) for x in line.split()]
+
+    def close(self):
+        header = json.dumps({"states": self.states,
+                             "newest": date_of(self.days[0]).isoformat() if self.days else None,
+                             "oldest": date_of(self.days[-1]).isoformat() if self.days else None,
+                             "fields": self.fields})
+        first_line = "%s %d %%d\n" % (magic, version)
+        size = len(first_line % 0) + len(header) + 1 + 8 # room for the size
+        size += -size % header_alignment
+        first_line = first_line % size
+        padding = " " * (size - len(first_line) - len(header) - 1)
+
+        tmp = "%s.%d.tmp" % (self.filename, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(first_line + header + padding + "\n")
+            f.write(self.values.tostring())
+        os.rename(tmp, self.filename)
+
+
+class History(object):
+    """A binary history opened with numpy.memmap"""
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            first_line = f.readline()
+            fields = first_line.split()
+            if len(fields) != 3 or fields[0] != magic:
+                raise ValueError("%s is not a polls history" % filename)
+            if int(fields[1]) != version:
+                raise ValueError("%s is version %s; this reads version %d"
+                                 % (filename, fields[1], version))
+            header_size = int(fields[2])
+            header = json.loads(f.read(header_size - len(first_line)))
+
+        self.states = [str(state) for state in header["states"]]
+        self.fields = [str(field) for field in header["fields"]]
+        self.newest = header["newest"] and parse_day(header["newest"])
+        self.oldest = header["oldest"] and parse_day(header["oldest"])
+        num_days = self.newest - self.oldest + 1 if self.newest else 0
+
+        self.records = memmap(filename, record_dtype, "r", header_size,
+                              (num_days, len(self.states), len(self.fields)))
+
+    def block(self, day):
+        """The (states x fields) block for a day number (or datetime.date)"""
+        if isinstance(day, datetime.date):
+            day = day_number(day)
+        i = self.newest - day if self.newest else -1
+        if not 0 <= i < len(self.records):
+            raise KeyError("%s is not in the history" % date_of(day))
+        return self.records[i]
+
+    def days(self):
+        """The days in the history, as day numbers, newest first"""
+        return range(self.newest, self.newest - len(self.records), -1)
+
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        raise ValueError("Usage: median_history.py FILE.bin [YYYY-MM-DD]")
+    history = History(sys.argv[1])
+    if len(sys.argv) == 2:
+        print "%d states, %s back to %s" % (len(history.states), date_of(history.newest),
+                                            date_of(history.oldest))
+        print "states: %s" % " ".join(history.states)
+        print "fields: %s" % " ".join(history.fields)
+        return
+    for row in history.block(parse_day(sys.argv[2])):
+        print " ".join("%g" % x for x in row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/python
+
+############################################################################
+#
+# Append-only compressed archive for the pages the poll updaters fetch.
+#
+# Instead of one loose file per state page (archive/ev/OH2.xml) or per race
+# and campaign day (archive/senate/NH.csv, archive/senate/123.csv), each
+# archived document is appended to a segment file as its own gzip member,
+# and a line is added to a tab-separated index giving the segment, offset
+# and length of the member along with the document's kind, name, state,
+# date and digest. Concatenated gzip members are still a valid gzip file,
+# so a segment can be unpacked with zcat in a pinch.
+#
+# A reader loads the index and seeks straight to the documents it wants,
+# so all the pages for one state, or the day logs for a date range, can be
+# streamed without unpacking anything else. Nothing is rewritten: a new
+# version of a document is appended, and readers asking for latest=True
+# see only the newest version of each name. Documents that haven't changed
+# since they were last archived can be skipped.
+#
+# From the command line, lists the archive or unpacks the latest version
+# of each document into a directory:
+#
+#     python poll_archive.py ARCHIVE_DIR [--kind K] [--state S]
+#                            [--since YYYY-MM-DD] [--until YYYY-MM-DD]
+#                            [--extract OUTDIR]
+#
+############################################################################
+
+import os, gzip, zlib, hashlib, datetime, argparse, collections, cStringIO
+
+index_filename = "index.tsv"
+segment_format = "segment-%04d.gz"
+default_segment_size = 64 * 1024 * 1024
+
+ArchiveEntry = collections.namedtuple("ArchiveEntry",
+    "segment offset length kind name state date digest")
+
+
+def exists(archive_dir):
+    return os.path.exists(os.path.join(archive_dir, index_filename))
+
+
+class PollArchive(object):
+    def __init__(self, archive_dir, segment_size=default_segment_size):
+        self.archive_dir = archive_dir
+        self.segment_size = segment_size
+        if not os.path.isdir(archive_dir):
+            os.makedirs(archive_dir)
+
+        self.index_file = os.path.join(archive_dir, index_filename)
+        self.all_entries = read_index(archive_dir)
+        self.latest_by_name = {}
+        for entry in self.all_entries:
+            self.latest_by_name[(entry.kind, entry.name)] = entry
+
+        if self.all_entries:
+            self.segment_num = segment_number(self.all_entries[-1].segment)
+        else:
+            self.segment_num = 0
+
+    def segment_path(self):
+        path = os.path.join(self.archive_dir, segment_format % self.segment_num)
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_size:
+            self.segment_num += 1
+            path = os.path.join(self.archive_dir, segment_format % self.segment_num)
+        return path
+
+    def append(self, kind, name, body, state=None, date=None, skip_unchanged=False):
+        """Archive body as the newest version of (kind, name). date is a
+        datetime.date, or today if not given. Returns the new ArchiveEntry,
+        or None if skip_unchanged is set and body is the same as the
+        version already archived."""
+        digest = hashlib.sha1(body).hexdigest()
+        previous = self.latest_by_name.get((kind, name))
+        if skip_unchanged and previous is not None and previous.digest == digest:
+            return None
+
+        member = cStringIO.StringIO()
+        gz = gzip.GzipFile(name, "wb", 9, member, 0)
+        gz.write(body)
+        gz.close()
+        member = member.getvalue()
+
+        path = self.segment_path()
+        with open(path, "ab") as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(member)
+
+        entry = ArchiveEntry(path, offset, len(member), kind, name, state,
+                             (date or datetime.date.today()).isoformat(), digest)
+        # The index line goes in only once the data is on disk, so a crash
+        # can leave unreferenced bytes in a segment but never a bad entry.
+        # A crash while writing the index can leave a partial last line,
+        # which read_index() skips; start a new line rather than add to it.
+        line = "\t".join([os.path.basename(path), str(offset), str(len(member)),
+                          kind, name, state or "-", entry.date, digest]) + "\n"
+        with open(self.index_file, "a+b") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != "\n":
+                    line = "\n" + line
+            f.write(line)
+
+        self.all_entries.append(entry)
+        self.latest_by_name[(kind, name)] = entry
+        return entry
+
+    def entries(self, kind=None, state=None, since=None, until=None, latest=False):
+        """The ArchiveEntries matching the filters, oldest first. since and
+        until are inclusive datetime.dates. With latest, only the newest
+        version of each name is given (and only if it matches)."""
+        if latest:
+            candidates = sorted(self.latest_by_name.values(),
+                                key=lambda entry: (entry.segment, entry.offset))
+        else:
+            candidates = self.all_entries
+
+        since = since and since.isoformat()
+        until = until and until.isoformat()
+        return [entry for entry in candidates
+                if (kind is None or entry.kind == kind)
+                and (state is None or entry.state == state)
+                and (since is None or entry.date >= since)
+                and (until is None or entry.date <= until)]
+
+    def latest(self, kind, name):
+        """The newest ArchiveEntry for (kind, name), or None"""
+        return self.latest_by_name.get((kind, name))
+
+    def stream(self, **filters):
+        """Yield (entry, body) for the entries() matching filters"""
+        segment = None
+        f = None
+        try:
+            for entry in self.entries(**filters):
+                if entry.segment != segment:
+                    if f:
+                        f.close()
+                    segment = entry.segment
+                    f = open(segment, "rb")
+                f.seek(entry.offset)
+                yield (entry, decompress(f.read(entry.length)))
+        finally:
+            if f:
+                f.close()
+
+
+def read_index(archive_dir):
+    entries = []
+    try:
+        f = open(os.path.join(archive_dir, index_filename))
+    except IOError:
+        return entries
+    with f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 8: # a partly-written last line
+                continue
+            (segment, offset, length, kind, name, state, date, digest) = fields
+            entries.append(ArchiveEntry(os.path.join(archive_dir, segment),
+                                        int(offset), int(length), kind, name,
+                                        None if state == "-" else state,
+                                        date, digest))
+    return entries
+
+
+def segment_number(path):
+    return int(os.path.basename(path)[len("segment-"):-len(".gz")])
+
+
+def decompress(member):
+    return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(member)
+
+
+def read_entry(entry):
+    """The body archived under entry. Needs nothing but the entry itself,
+    so it can be handed to a multiprocessing worker."""
+    with open(entry.segment, "rb") as f:
+        f.seek(entry.offset)
+        return decompress(f.read(entry.length))
+
+
+def parse_date(date_string):
+    return datetime.datetime.strptime(date_string, "%Y-%m-%d").date()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List or unpack a poll archive")
+    parser.add_argument("archive_dir")
+    parser.add_argument("--kind")
+    parser.add_argument("--state")
+    parser.add_argument("--since", type=parse_date)
+    parser.add_argument("--until", type=parse_date)
+    parser.add_argument("--all", action="store_true",
+                        help="every version, not just the latest")
+    parser.add_argument("--extract", metavar="OUTDIR",
+                        help="write the documents out as files in OUTDIR")
+    args = parser.parse_args()
+
+    archive = PollArchive(args.archive_dir)
+    filters = dict(kind=args.kind, state=args.state, since=args.since,
+                   until=args.until, latest=not args.all)
+
+    if not args.extract:
+        for entry in archive.entries(**filters):
+            print "%s  %-5s %-10s %-4s %8d  %s" % (entry.date, entry.kind, entry.name,
+                                                 entry.state or "", entry.length,
+                                                 entry.digest[:12])
+        return
+
+    if not os.path.isdir(args.extract):
+        os.makedirs(args.extract)
+    for (entry, body) in archive.stream(**filters):
+        with open(os.path.join(args.extract, entry.name), "wb") as f:
+            f.write(body)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+############################################################################
+#
+# Persistent index of the polls we have already ingested from a HuffPost
+# feed, kept in a small sqlite database in the archive directory.
+#
+# Polls are keyed by (state, question code, poll id). Each row also holds
+# the parsed poll (a pollster_xml.PollRecord, as JSON) and its position in
+# the feed as of the last run, so that a run which stops paging at the
+# first page of already-known polls can load the rest of the state's
+# history from here, in the same order a full crawl would have seen it.
+#
+############################################################################
+
+import json, sqlite3
+from pollster_xml import PollRecord, Question, Subpopulation
+
+
+class PollIndex(object):
+    def __init__(self, filename):
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS polls (
+                                 state TEXT NOT NULL,
+                                 code TEXT NOT NULL,
+                                 poll_id INTEGER NOT NULL,
+                                 feed_order INTEGER NOT NULL,
+                                 record TEXT NOT NULL,
+                                 PRIMARY KEY (state, code, poll_id))""")
+
+    def known_ids(self, state, code):
+        """The set of poll IDs stored for this state and question"""
+        rows = self.conn.execute("SELECT poll_id FROM polls "
+                                 "WHERE state = ? AND code = ?", (state, code))
+        return set(row[0] for row in rows)
+
+    def polls(self, state, code):
+        """The stored PollRecords for this state and question, in feed order"""
+        rows = self.conn.execute("SELECT record FROM polls "
+                                 "WHERE state = ? AND code = ? "
+                                 "ORDER BY feed_order", (state, code))
+        return [record_from_json(row[0]) for row in rows]
+
+    def replace(self, state, code, polls):
+        """Make polls, in feed order, the stored history for this state and
+        question. Polls without an ID can't be matched up later and are
+        not stored."""
+        with self.conn:
+            self.conn.execute("DELETE FROM polls WHERE state = ? AND code = ?",
+                              (state, code))
+            self.conn.executemany("INSERT OR IGNORE INTO polls "
+                                  "VALUES (?, ?, ?, ?, ?)",
+                                  [(state, code, poll.poll_id, i, json.dumps(poll))
+                                   for (i, poll) in enumerate(polls)
+                                   if poll.poll_id is not None])
+
+    def close(self):
+        self.conn.close()
+
+
+def record_from_json(text):
+    (poll_id, pollster, method, start_date, end_date, questions) = json.loads(text)
+    return PollRecord(poll_id, pollster, method, start_date, end_date,
+                      [Question(code, [Subpopulation(name, obs, [tuple(r) for r in responses])
+                                       for (name, obs, responses) in subpops])
+                       for (code, subpops) in questions])
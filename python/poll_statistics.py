@@ -0,0 +1,96 @@
+############################################################################
+#
+# Batched median/MAD statistics for the poll updaters.
+#
+# Both updaters write, for every state (or race) and day, the median margin
+# of the polls in use that day and an estimate of its standard error. Rather
+# than one call per (state, day), window_statistics() takes every window of
+# polls at once, as a matrix with one row per window padded out to the
+# widest one, plus a mask saying which entries are real polls.
+#
+# The std. error is given by:
+#         std. deviation / sqrt(num of polls)
+#
+# We robustly estimate the std. deviation from the median absolute
+# deviation (MAD) using the standard formula:
+#        std. deviation =  MAD / invcdf(0.75)
+#
+# The MAD is defined as median( abs[samples - median(samples)] )
+# invcdf(0.75) is approximately 0.6745
+#
+# The special cases are as they were:
+#   1 poll      the poll's margin, with a std. error given by the caller
+#   2 polls     the mean, with a std. error of at least two_poll_min_sem
+#   SEM of 0    optionally replaced by SD/sqrt(n)
+#
+# Windows with the same number of polls are done together as a dense
+# block, so every median, mean and std. deviation is computed over the
+# same numbers in the same order as the one-window-at-a-time code did, and
+# comes out the same to the last bit.
+#
+############################################################################
+
+from numpy import arange, array, asarray, empty, flatnonzero, maximum, median, nan, \
+    sqrt, unique, zeros, float64
+
+mad_to_sd = 0.6745
+two_poll_min_sem = 3
+
+
+def window_statistics(margins, mask, midtype="median", single_sem=None,
+                      zero_sem_fallback=False):
+    """Returns (mid, sem, count) arrays with an entry for each row of the
+    margins matrix, using only the entries where mask is set, in the order
+    they appear in the row. midtype is "median" or "mean". single_sem gives
+    the std. error to use for each window with only one poll; windows with
+    no polls get nan."""
+    count = mask.sum(axis=1)
+    mid = empty(len(count), float64)
+    sem = empty(len(count), float64)
+    mid.fill(nan)
+    sem.fill(nan)
+
+    for n in unique(count).tolist():
+        if n == 0:
+            continue
+        which = flatnonzero(count == n)
+        block = margins[which][mask[which]].reshape(len(which), n)
+
+        if n == 1:
+            mid[which] = block[:, 0]
+            if single_sem is not None:
+                sem[which] = single_sem[which]
+        elif n == 2:
+            # Special case for when only two polls are available
+            mid[which] = block.mean(axis=1)
+            sem[which] = maximum(block.std(axis=1) / sqrt(n), two_poll_min_sem)
+        elif midtype == "median":
+            median_margin = median(block, axis=1)
+            mad = median(abs(block - median_margin[:, None]), axis=1)
+            sem_est = mad/mad_to_sd/sqrt(n)
+
+            # Sometimes SEM is 0. Sam want this to be replaced by SD/sqrt(n)
+            if zero_sem_fallback:
+                zero = sem_est == 0
+                sem_est[zero] = block[zero].std(axis=1) / sqrt(n)
+
+            mid[which] = median_margin
+            sem[which] = sem_est
+        else:
+            assert midtype == "mean"
+            mid[which] = block.mean(axis=1)
+            sem[which] = block.std(axis=1) / sqrt(n)
+
+    return (mid, sem, count)
+
+
+def padded(values, lengths):
+    """The (len(lengths) x max length) matrix, and mask, holding values
+    (a flat array) split into rows of the given lengths"""
+    values = asarray(values)
+    lengths = array(lengths, int)
+    width = lengths.max() if len(lengths) else 0
+    mask = arange(width) < lengths[:, None]
+    matrix = zeros(mask.shape, values.dtype)
+    matrix[mask] = values
+    return (matrix, mask)
@@ -0,0 +1,185 @@
+############################################################################
+#
+# Columnar store of the polls for each state (or race).
+#
+# The updaters used to keep every poll as a tuple of Python objects
+# (margin, start date, end date, mid date, pop, polling org[, affil]) and
+# select from them with filter() and sorted() for every state and day.
+# PollStore keeps the same polls as NumPy columns instead:
+#
+#   margin                  float64
+#   start, end, mid         int32 day numbers (see day_numbers)
+#   pop                     int32, -1 if not given
+#   pollster                int32 code; codes sort the way the names do
+#   affil                   int8 code: 0 none, 1 'D', 2 'R'
+#   seq                     int32, the order the polls were added in
+#
+# plus any extra string columns the caller asks for, stored as codes into
+# a table of the distinct strings. Polls are grouped by state: those for
+# the i'th state are rows offsets[i] to offsets[i+1], sorted newest first
+# by end date, ties in the order they were added. (Both updaters sorted
+# their tuples this way before doing anything else with them.)
+#
+# Polls are added one at a time and then freeze() builds the columns. The
+# queries work on arrays of row numbers (poll_window.WindowIndex answers
+# the date-window ones for a state's rows), and tuples() turns rows back into
+# the tuples the statistics code and the CSV writers were written for (with
+# the dates still as day numbers).
+#
+# Margins stay float64: they are printed with "%s" and must come out
+# exactly as the tuples did.
+#
+############################################################################
+
+from numpy import array, arange, empty, concatenate, lexsort, argsort, \
+    searchsorted, int8, int32, float64
+
+affiliations = [None, 'D', 'R']
+affiliation_codes = {None: 0, 'D': 1, 'R': 2}
+
+
+class StringTable(object):
+    """Maps strings to small integer codes and back"""
+
+    def __init__(self):
+        self.strings = []
+        self.codes = {}
+
+    def code(self, s):
+        if s not in self.codes:
+            self.codes[s] = len(self.strings)
+            self.strings.append(s)
+        return self.codes[s]
+
+    def sorted_codes(self):
+        """Renumber so that codes sort the way the strings do. Returns an
+        array mapping each old code to its new one."""
+        order = sorted(range(len(self.strings)), key=lambda c: self.strings[c])
+        remap = empty(len(order), int32)
+        remap[order] = arange(len(order), dtype=int32)
+        self.strings = [self.strings[c] for c in order]
+        self.codes = dict((s, c) for (c, s) in enumerate(self.strings))
+        return remap
+
+
+class PollStore(object):
+    numeric_columns = [("margin", float64), ("start", int32), ("end", int32),
+                       ("mid", int32), ("pop", int32), ("pollster", int32),
+                       ("affil", int8), ("seq", int32)]
+
+    def __init__(self, extra_columns=()):
+        self.extra_columns = list(extra_columns)
+        self.pollsters = StringTable()
+        self.extra_strings = StringTable()
+
+        self.states = []
+        self.state_index = {}
+        self.offsets = array([0], int32)
+        self.columns = {}
+        for (name, dtype) in self.numeric_columns:
+            self.columns[name] = empty(0, dtype)
+        self.state_code = empty(0, int32)
+        for name in self.extra_columns:
+            self.columns[name] = empty(0, int32)
+
+        self.pending = []
+        self.next_seq = 0
+
+    ########################################################################
+    # Building
+
+    def add_state(self, state):
+        """Make sure state is in the store, even if it has no polls"""
+        if state not in self.state_index:
+            self.state_index[state] = len(self.states)
+            self.states.append(state)
+
+    def add(self, state, margin, start, end, mid, pop, pollster, affil=None, **extra):
+        """Add one poll. Dates are day numbers; pop is a number (or the
+        text of one), and anything else counts as not given. extra gives
+        the extra string columns."""
+        self.add_state(state)
+        try:
+            pop = int(pop)
+        except (TypeError, ValueError):
+            pop = -1
+        self.pending.append((self.state_index[state], margin, start, end, mid, pop,
+                             self.pollsters.code(pollster), affiliation_codes[affil],
+                             self.next_seq,
+                             [self.extra_strings.code(extra.get(name, ""))
+                              for name in self.extra_columns]))
+        self.next_seq += 1
+
+    def freeze(self):
+        """Build the columns from everything added so far"""
+        state_code = concatenate([self.state_code,
+                                  array([p[0] for p in self.pending], int32)])
+        columns = {}
+        for (i, (name, dtype)) in enumerate(self.numeric_columns):
+            columns[name] = concatenate([self.columns[name],
+                                         array([p[i + 1] for p in self.pending], dtype)])
+        for (i, name) in enumerate(self.extra_columns):
+            columns[name] = concatenate([self.columns[name],
+                                         array([p[9][i] for p in self.pending], int32)])
+        self.pending = []
+
+        # Pollster codes in name order, so sorting by code sorts by name
+        remap = self.pollsters.sorted_codes()
+        if len(remap):
+            columns["pollster"] = remap[columns["pollster"]]
+
+        # Group by state, newest first by end date, ties in the order added
+        order = lexsort((columns["seq"], -columns["end"], state_code))
+        self.state_code = state_code[order]
+        for name in columns:
+            self.columns[name] = columns[name][order]
+        self.offsets = searchsorted(self.state_code,
+                                    arange(len(self.states) + 1)).astype(int32)
+
+    ########################################################################
+    # Queries. These take and return arrays of row numbers.
+
+    def rows(self, state):
+        """All the polls for state, newest first by end date"""
+        i = self.state_index.get(state)
+        if i is None or i + 1 >= len(self.offsets): # no polls as of freeze()
+            return arange(0)
+        return arange(self.offsets[i], self.offsets[i + 1])
+
+    ########################################################################
+    # Back to tuples
+
+    def tuples(self, rows):
+        """(margin, start, end, mid, pop, pollster, affil) for each row,
+        with pop as None if not given"""
+        c = self.columns
+        return [(margin, start, end, mid,
+                 None if pop < 0 else pop, self.pollsters.strings[pollster],
+                 affiliations[affil])
+                for (margin, start, end, mid, pop, pollster, affil) in
+                zip(c["margin"][rows].tolist(), c["start"][rows].tolist(),
+                    c["end"][rows].tolist(), c["mid"][rows].tolist(),
+                    c["pop"][rows].tolist(), c["pollster"][rows].tolist(),
+                    c["affil"][rows].tolist())]
+
+    def strings(self, rows, column):
+        """The values of an extra string column for rows"""
+        table = self.extra_strings.strings
+        return [table[code] for code in self.columns[column][rows].tolist()]
+
+    def state_of(self, rows):
+        return [self.states[code] for code in self.state_code[rows].tolist()]
+
+    def in_added_order(self, rows):
+        return rows[argsort(self.columns["seq"][rows], kind="mergesort")]
+
+    def digest_rows(self, rows):
+        """Plain tuples of numbers and strings for rows, for hashing. The
+        end date is the third field, as history_cache.input_digests wants."""
+        c = self.columns
+        return zip(c["margin"][rows].tolist(), c["start"][rows].tolist(),
+                   c["end"][rows].tolist(), c["mid"][rows].tolist(),
+                   c["pop"][rows].tolist(),
+                   [self.pollsters.strings[p] for p in c["pollster"][rows].tolist()],
+                   c["affil"][rows].tolist(),
+                   *[self.strings(rows, name) for name in self.extra_columns])
@@ -0,0 +1,108 @@
+############################################################################
+#
+# Windowing index for the "recent polls" rules.
+#
+# Each day, the Senate updater keeps the polls for a race which ended
+# before that day, only the latest one from each pollster, and of those
+# the three most recent by mid date plus any which ended within the last N
+# days, with N narrowing over the season. Rather than filter and sort all
+# of a race's polls for every day, WindowIndex keeps them sorted by end
+# date, with each pollster's polls in a list of their own, so that
+#
+#   the polls which ended before a day      are a bisect away
+#   each pollster's latest poll before it   is a bisect per pollster
+#
+# and a window costs O(log n) per pollster rather than O(n). The N days
+# come from a WindowSchedule.
+#
+############################################################################
+
+import bisect
+from day_numbers import parse_day, date_of
+
+
+class WindowSchedule(object):
+    """How many days back the window of recent polls reaches, by date. A
+    schedule is written like "42,2016-08-01=28,2016-09-01=28/2,2016-10-01=14":
+    42 days to start with; from August 1, 28 days; from September 1, 28
+    days, narrowing by a day every 2 days; from October 1, 14 days."""
+
+    def __init__(self, spec):
+        items = [item.strip() for item in spec.split(",")]
+        self.starts = []
+        self.widths = [(int(items[0]), 0)]
+        for item in items[1:]:
+            (date, width) = item.split("=")
+            (width, ease) = width.split("/") if "/" in width else (width, 0)
+            self.starts.append(parse_day(date.strip()))
+            self.widths.append((int(width), int(ease)))
+        if self.starts != sorted(self.starts):
+            raise ValueError("window schedule dates out of order: %s" % spec)
+
+    def width(self, day):
+        """The number of days back the window reaches on day (a day number)"""
+        i = bisect.bisect_right(self.starts, day)
+        (width, ease) = self.widths[i]
+        if ease:
+            width -= (day - self.starts[i - 1]) / ease
+        return width
+
+    def __repr__(self):
+        spec = [str(self.widths[0][0])]
+        for (start, (width, ease)) in zip(self.starts, self.widths[1:]):
+            spec.append("%s=%d%s" % (date_of(start).isoformat(), width,
+                                     "/%d" % ease if ease else ""))
+        return "WindowSchedule(%r)" % ",".join(spec)
+
+
+class WindowIndex(object):
+    """The polls for one state (or race) in a poll_store.PollStore, for
+    window queries. rows must be sorted newest first by end date, as
+    PollStore.rows() gives them. The queries return positions in rows."""
+
+    def __init__(self, store, rows):
+        self.rows = rows
+        self.end = store.columns["end"][rows].tolist()
+        self.mid = store.columns["mid"][rows].tolist()
+
+        # Negated, so that they ascend for bisect
+        self.neg_end = [-end for end in self.end]
+        self.by_pollster = {}    # pollster code -> (positions, negated end dates)
+        for (i, pollster) in enumerate(store.columns["pollster"][rows].tolist()):
+            (positions, neg_ends) = self.by_pollster.setdefault(pollster, ([], []))
+            positions.append(i)
+            neg_ends.append(-self.end[i])
+
+    def ended_before(self, day):
+        """The positions of the polls which ended before day, newest first"""
+        return range(bisect.bisect_right(self.neg_end, -day), len(self.end))
+
+    def latest_by_pollster(self, day):
+        """The position of each pollster's latest poll which ended before
+        day, newest first by end date. Ties go to the poll added first."""
+        latest = []
+        for (positions, neg_ends) in self.by_pollster.itervalues():
+            i = bisect.bisect_right(neg_ends, -day)
+            if i < len(positions):
+                latest.append(positions[i])
+        latest.sort()
+        return latest
+
+    def by_mid(self, positions):
+        """positions sorted newest first by mid date, ties kept in order"""
+        return sorted(positions, key=lambda i: -self.mid[i])
+
+    def recent(self, day, num_recent, width):
+        """The latest poll from each pollster which ended before day,
+        keeping the num_recent most recent by mid date (and any tied with
+        the last of them) and any which ended no more than width days
+        before day. Newest first by mid date if there are at least
+        num_recent, otherwise newest first by end date."""
+        positions = self.latest_by_pollster(day)
+        if len(positions) < num_recent:
+            return positions
+
+        positions = self.by_mid(positions)
+        oldest_mid = self.mid[positions[num_recent - 1]]
+        oldest_end = day - width
+        return [i for i in positions if self.mid[i] >= oldest_mid or self.end[i] >= oldest_end]
@@ -0,0 +1,290 @@
+#!/usr/bin/python
+
+############################################################################
+#
+# A local stand-in for the HuffPost Pollster server, for measuring the
+# fetch and parse side of the pipeline without touching the real API.
+#
+# It answers the two kinds of request the updaters make:
+#
+#   /pollster/api/polls.xml?question=16-OH-Pres-GE%20TrumpvClinton&page=N
+#       one page of the XML feed, as read by ev_update_polls.py
+#   /pollster/<chart>.csv
+#       a per-race (or approval / House) CSV, as read by
+#       senate_update_polls.py and the shell stages
+#
+# Responses come from fixture files when a fixture directory is given (the
+# archive/ev and archive/senate layouts both work) and otherwise from a
+# deterministic synthetic generator, so the poll volume can be turned up
+# far past what the real feeds carry. Latency, error rate, page size and
+# polls per feed are all configurable. Responses carry an ETag, so the
+# conditional GETs made by http_cache work too.
+#
+# Run it with e.g.
+#
+#     python pollster_standin.py --port 8000 --polls 500 --latency 0.2
+#
+# and point the updaters at it with --base-url http://localhost:8000
+#
+############################################################################
+
+import os, sys, re, csv, time, random, datetime, hashlib, argparse, threading
+import cStringIO, urllib, urlparse, BaseHTTPServer, SocketServer
+
+pollsters = ["Public Policy Polling (D)", "Quinnipiac", "Marist/NBC",
+             "SurveyUSA", "Remington (R)", "Emerson College", "Gravis",
+             "Monmouth University", "YouGov/CBS", "Ipsos/Reuters"]
+
+season_start = datetime.date(2016, 3, 1)
+season_end = datetime.date(2016, 11, 7)
+
+question_re = re.compile(r"^16-([A-Z]{2})-Pres-GE TrumpvClinton$")
+
+
+class StandinConfig(object):
+    def __init__(self, polls=40, page_size=10, latency=0.0, jitter=0.0,
+                 error_rate=0.0, fixture_dir=None, races_file=None, seed=0):
+        self.polls = polls               # polls per synthetic feed
+        self.page_size = page_size       # polls per XML page
+        self.latency = latency           # seconds added to every response
+        self.jitter = jitter             # +/- seconds of random latency
+        self.error_rate = error_rate     # fraction of requests given a 503
+        self.fixture_dir = fixture_dir
+        self.races = read_races(races_file) if races_file else {}
+        self.seed = seed
+
+
+# The candidate names in a race CSV's header must match senate_data.csv,
+# which can't be recovered from the lower-cased chart name alone
+def read_races(filename):
+    races = {}
+    with open(filename, 'rb') as f:
+        reader = csv.reader(f)
+        reader.next()
+        for row in reader:
+            races[row[0]] = (row[1].split(" ")[0], row[2].split(" ")[0])
+    return races
+
+
+############################################################################
+#
+# Synthetic feeds. Every feed is a pure function of its name and the seed,
+# so repeated runs (and repeated pages) see the same polls.
+#
+############################################################################
+
+def feed_random(config, name):
+    return random.Random("%s:%s" % (config.seed, name))
+
+
+def synthetic_polls(config, name):
+    """(id, pollster, start, end, observations, dem, rep), newest first"""
+    r = feed_random(config, name)
+    base_id = int(hashlib.md5(name).hexdigest()[:6], 16) * 100000
+    days = (season_end - season_start).days
+    polls = []
+    for i in range(config.polls):
+        end = season_start + datetime.timedelta(days * (i + 1) // config.polls)
+        start = end - datetime.timedelta(r.randint(0, 6))
+        dem = r.randint(35, 52)
+        polls.append((base_id + i, r.choice(pollsters), start, end,
+                      r.randint(400, 1500), dem, r.randint(35, 52)))
+    polls.reverse()
+    return polls
+
+
+def synthetic_xml_page(config, state, page_num):
+    polls = synthetic_polls(config, state)
+    page = polls[(page_num - 1) * config.page_size:page_num * config.page_size]
+
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n<polls>\n']
+    for (poll_id, pollster, start, end, obs, dem, rep) in page:
+        out.append("<poll><id>%d</id><pollster>%s</pollster>"
+                   "<start_date>%s</start_date><end_date>%s</end_date>"
+                   "<method>Phone</method><questions><question>"
+                   "<code>16-%s-Pres-GE TrumpvClinton</code><subpopulations>"
+                   "<subpopulation><name>Likely Voters</name>"
+                   "<observations>%d</observations><responses>"
+                   "<response><choice>Clinton</choice><value>%d</value></response>"
+                   "<response><choice>Trump</choice><value>%d</value></response>"
+                   "<response><choice>Undecided</choice><value>%d</value></response>"
+                   "</responses></subpopulation></subpopulations>"
+                   "</question></questions></poll>\n"
+                   % (poll_id, pollster.replace("&", "&amp;"), start, end,
+                      state, obs, dem, rep, 100 - dem - rep))
+    out.append("</polls>\n")
+    return "".join(out)
+
+
+def synthetic_csv(config, chart, choices):
+    out = cStringIO.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["Pollster", "Start Date", "End Date", "Entry Date/Time (ET)",
+                     "Number of Observations", "Population", "Mode",
+                     choices[0], choices[1], "Undecided", "Pollster URL",
+                     "Source URL", "Partisan", "Affiliation", "Question Text",
+                     "Question Iteration"])
+    for (poll_id, pollster, start, end, obs, dem, rep) in synthetic_polls(config, chart):
+        writer.writerow([pollster, start, end, "%sT12:00:00Z" % end, obs,
+                         "Likely Voters", "Phone", dem, rep, 100 - dem - rep,
+                         "", "", "Nonpartisan", "None", "", 1])
+    return out.getvalue()
+
+
+# Pick column names for a chart: the candidates, for a Senate race we know
+# about, or else something approval-shaped
+def chart_choices(config, chart):
+    for (state, (dem, rep)) in config.races.items():
+        if ("-%s-vs-" % rep.lower()) in chart and dem.lower() in chart:
+            return (state, (dem, rep))
+    m = re.search(r"-([a-z]+)-vs-([a-z]+)", chart)
+    if m:
+        return (None, (m.group(2).title(), m.group(1).title()))
+    return (None, ("Approve", "Disapprove"))
+
+
+############################################################################
+#
+# The server
+#
+############################################################################
+
+class StandinHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, like the real server
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        config = self.server.config
+
+        delay = config.latency + random.uniform(-config.jitter, config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if random.random() < config.error_rate:
+            return self.reply(503, "Service Unavailable\n", "text/plain")
+
+        url = urlparse.urlparse(self.path)
+        if url.path.endswith("/api/polls.xml"):
+            query = urlparse.parse_qs(url.query)
+            body = self.xml_page(query.get("question", [""])[0],
+                                 int(query.get("page", ["1"])[0]))
+            content_type = "application/xml"
+        elif url.path.endswith(".csv"):
+            body = self.race_csv(os.path.basename(url.path)[:-len(".csv")])
+            content_type = "text/csv"
+        else:
+            body = None
+
+        if body is None:
+            return self.reply(404, "Not Found\n", "text/plain")
+        self.reply(200, body, content_type)
+
+    def xml_page(self, question, page_num):
+        m = question_re.match(urllib.unquote(question))
+        if not m:
+            return None
+        state = m.group(1)
+
+        config = self.server.config
+        if config.fixture_dir:
+            return read_fixture(config.fixture_dir, "%s%d.xml" % (state, page_num),
+                                '<?xml version="1.0" encoding="UTF-8"?>\n<polls/>\n')
+        return synthetic_xml_page(config, state, page_num)
+
+    def race_csv(self, chart):
+        config = self.server.config
+        (state, choices) = chart_choices(config, chart)
+        if config.fixture_dir:
+            body = read_fixture(config.fixture_dir, chart + ".csv", None)
+            if body is None and state:
+                body = read_fixture(config.fixture_dir, state + ".csv", None)
+            return body
+        return synthetic_csv(config, chart, choices)
+
+    def reply(self, code, body, content_type):
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if code == 200 and self.headers.getheader("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if code == 200:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def read_fixture(fixture_dir, name, default):
+    try:
+        with open(os.path.join(fixture_dir, name), 'rb') as f:
+            return f.read()
+    except IOError:
+        return default
+
+
+class StandinServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, config):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StandinHandler)
+        self.config = config
+
+    def base_url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+
+def start_in_thread(config, host="127.0.0.1", port=0):
+    """Start a stand-in server on a background thread, for use from a
+    benchmark script. Returns the server; call shutdown() when done."""
+    server = StandinServer((host, port), config)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve stand-in HuffPost "
+                                     "Pollster feeds for benchmarking")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--polls", type=int, default=40,
+                        help="polls per synthetic feed")
+    parser.add_argument("--page-size", type=int, default=10,
+                        help="polls per XML page")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="random +/- seconds of latency")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests answered with a 503")
+    parser.add_argument("--fixtures", metavar="DIR",
+                        help="serve archived pages from DIR instead of "
+                        "synthetic ones")
+    parser.add_argument("--races", metavar="CSV",
+                        help="senate_data.csv, for the candidate names")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = StandinConfig(args.polls, args.page_size, args.latency,
+                           args.jitter, args.error_rate, args.fixtures,
+                           args.races, args.seed)
+    server = StandinServer((args.host, args.port), config)
+    print "Serving stand-in Pollster feeds on %s" % server.base_url()
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,88 @@
+############################################################################
+#
+# Streaming parser for the HuffPost Pollster XML feed (polls.xml).
+#
+# A page of the feed looks like:
+#
+#   <polls>
+#     <poll>
+#       <id>..</id> <pollster>..</pollster> <method>..</method>
+#       <start_date>..</start_date> <end_date>..</end_date> ...
+#       <questions>
+#         <question>
+#           <code>16-OH-Pres-GE TrumpvClinton</code> ...
+#           <subpopulations>
+#             <subpopulation>
+#               <name>Likely Voters</name> <observations>..</observations>
+#               <responses>
+#                 <response> <choice>..</choice> <value>..</value> </response>
+#                 ...
+#
+# iter_polls() walks the document with iterparse and yields one PollRecord
+# per <poll> as soon as its closing tag has been read, then throws the
+# element away. Parse time and memory are therefore linear in the size of
+# the page, rather than the size of the page times the number of
+# getElementsByTagName() lookups made against a full DOM.
+#
+# All fields are left as the strings found in the feed (or None when the
+# element is missing or empty); converting them and deciding what a broken
+# poll means is up to the caller.
+#
+############################################################################
+
+from collections import namedtuple
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+PollRecord = namedtuple("PollRecord",
+        "poll_id pollster method start_date end_date questions")
+Question = namedtuple("Question", "code subpopulations")
+Subpopulation = namedtuple("Subpopulation", "name observations responses")
+# responses is a list of (choice, value) pairs, in feed order
+
+
+def first_text(elem, name):
+    """Text of the first element called name at or below elem, or None if
+    there is no such element or it is empty."""
+    for e in elem.iter(name):
+        return e.text or None
+    return None
+
+
+def parse_subpopulation(elem):
+    responses = [(first_text(r, "choice"), first_text(r, "value"))
+                 for r in elem.iter("response")]
+    return Subpopulation(first_text(elem, "name"),
+                         first_text(elem, "observations"), responses)
+
+
+def parse_poll(elem):
+    questions = [Question(q.findtext("code") or None,
+                          [parse_subpopulation(s) for s in q.iter("subpopulation")])
+                 for q in elem.iter("question")]
+
+    poll_id = first_text(elem, "id")
+    if poll_id is not None:
+        poll_id = int(poll_id)
+
+    return PollRecord(poll_id,
+                      first_text(elem, "pollster"),
+                      first_text(elem, "method"),
+                      first_text(elem, "start_date"),
+                      first_text(elem, "end_date"),
+                      questions)
+
+
+def iter_polls(source):
+    """Yield a PollRecord for each <poll> in source, a filename or a file
+    object, as the document is read."""
+    root = None
+    for (event, elem) in ElementTree.iterparse(source, events=("start", "end")):
+        if root is None:
+            root = elem
+        elif event == "end" and elem.tag == "poll":
+            yield parse_poll(elem)
+            root.clear() # drop the polls we have already handed out
@@ -0,0 +1,155 @@
+############################################################################
+#
+# Request scheduling for the HuffPost fetchers.
+#
+# RequestScheduler sits between the updaters and the transport (normally
+# http_cache.HTTPCache.fetch) and decides when each request goes out:
+#
+#   - a token bucket caps the overall request rate. When the server pushes
+#     back (429 or 503) the rate is cut in half, and it creeps back up to
+#     the configured rate as requests succeed again;
+#   - a per-host semaphore bounds the number of requests in flight to any
+#     one server;
+#   - failed requests are retried with exponential backoff and full jitter,
+#     rather than after a fixed sleep.
+#
+# fetch() never raises for a network or HTTP failure and never exits. It
+# returns a FetchResult, and it is up to the caller to decide what a
+# missing page means.
+#
+############################################################################
+
+import sys, time, random, socket, threading, urllib2, urlparse, httplib
+
+
+class FetchResult(object):
+    def __init__(self, url, body=None, status=None, error=None, attempts=0,
+                 elapsed=0.0):
+        self.url = url
+        self.body = body          # None unless the fetch succeeded
+        self.status = status      # HTTP status, if we got that far
+        self.error = error        # description of the last failure
+        self.attempts = attempts
+        self.elapsed = elapsed    # seconds, including waits and retries
+
+    @property
+    def ok(self):
+        return self.body is not None
+
+    def __str__(self):
+        if self.ok:
+            return "OK %s (%d attempts, %.2fs)" % (self.url, self.attempts, self.elapsed)
+        return "FAIL %s: %s (%d attempts, %.2fs)" % (self.url, self.error,
+                                                     self.attempts, self.elapsed)
+
+
+class TokenBucket(object):
+    """Allow rate requests per second on average, in bursts of up to burst.
+    A rate of 0 disables limiting."""
+
+    def __init__(self, rate, burst=1):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.max_rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self):
+        with self.lock:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def speed_up(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+# Failures worth another try: the server is busy or briefly broken, or the
+# network is. Anything else (404, 403, ...) will fail the same way again.
+retryable_statuses = (429, 500, 502, 503, 504)
+
+
+class RequestScheduler(object):
+    def __init__(self, transport, rate=4.0, burst=2, per_host=4,
+                 max_attempts=4, backoff_base=0.5, backoff_cap=30.0):
+        self.transport = transport
+        self.bucket = TokenBucket(rate, burst)
+        self.per_host = per_host
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self.lock = threading.Lock()
+        self.host_slots = {}
+        self.failures = []
+
+    def host_slot(self, url):
+        host = urlparse.urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_slots[host]
+
+    def backoff(self, attempt):
+        # "Full jitter": anywhere between 0 and the exponential ceiling
+        return random.uniform(0, min(self.backoff_cap,
+                                     self.backoff_base * 2 ** attempt))
+
+    def fetch(self, url):
+        """Fetch url, retrying as needed. Returns a FetchResult."""
+        result = FetchResult(url)
+        start = time.time()
+        slot = self.host_slot(url)
+
+        while result.attempts < self.max_attempts:
+            if result.attempts > 0:
+                time.sleep(self.backoff(result.attempts - 1))
+
+            self.bucket.acquire()
+            result.attempts += 1
+            retry = True
+            with slot:
+                try:
+                    result.body = self.transport(url)
+                    result.status = 200
+                    result.error = None
+                except urllib2.HTTPError as e:
+                    result.status = e.code
+                    result.error = "HTTP %d" % e.code
+                    retry = e.code in retryable_statuses
+                    if e.code in (429, 503):
+                        self.bucket.slow_down()
+                except (urllib2.URLError, socket.error, httplib.HTTPException) as e:
+                    # socket.timeout is a socket.error
+                    result.error = "%s: %s" % (e.__class__.__name__, e)
+
+            if result.ok:
+                self.bucket.speed_up()
+                break
+            if not retry:
+                break
+
+        result.elapsed = time.time() - start
+        if not result.ok:
+            with self.lock:
+                self.failures.append(result)
+        return result
+
+    def report_failures(self, out=sys.stdout):
+        for result in self.failures:
+            out.write("%s\n" % result)
+        out.flush()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+############################################################################
+#
+# The Senate seat distribution, in NumPy.
+#
+# This is the part of Senate_estimator.m and Senate_median.m which
+# Senate_jerseyvotes.m builds on, without MATLAB: it reads the lines for one
+# day from 2016.Senate.polls.median.txt (as written by
+# senate_update_polls.py), turns each race's median margin into a
+# probability of a Democratic/Independent win, builds the distribution of
+# seats, and finds the meta-margin. From that it writes
+#
+# Senate_estimates.csv
+#    all in one line: the median and mean (to 0.01) Democratic/Independent
+#    seats; the probability of Democratic/Independent control; the seats
+#    assigned (>95% prob) to each party and those uncertain; the number of
+#    polls used; the +/-1 sigma band of Democratic/Independent seats; the
+#    mean margin in the contested races; and the meta-margin.
+#
+# Senate_jerseyvotes.csv
+#    The power of a voter in each race's state to influence control of the
+#    Senate (see voter_power), relative to the most powerful state's, one
+#    line per race, most powerful first: the race's index, its postal
+#    abbreviation, its median margin, and its voter power.
+#
+# formatted as Senate_estimator.m and Senate_jerseyvotes.m wrote them. As
+# with ev_estimator, the numbers are also available as functions, for one
+# day or a stack of them:
+#
+#    estimate = senate_estimator.estimate(senate_estimator.read_polls())
+#    estimate.median_seats, estimate.d_control_probability, ...
+#
+# Unlike the EV calculation, a race's probability comes from a Student's t
+# distribution with 2 degrees of freedom, and its SEM from the file (but at
+# least sem_floor).
+#
+# Script written for election.princeton.edu run by Samuel S.-H. Wang under
+# noncommercial-use-only license:
+# You may use or modify this software, but only for noncommericial purposes.
+# To seek a commercial-use license, contact sswang@princeton.edu
+#
+############################################################################
+
+import argparse, collections
+from numpy import arange, array, asarray, cumsum, sqrt, where, zeros, float64
+import ev_estimator, voter_power
+from ev_estimator import count_below, dlm_number, matlab_round, num2str, read_poll_history, \
+    num_polls_column, margin_column, sem_column, analysisdate_column
+
+############################################################################
+#
+# Global configuration and variables
+#
+############################################################################
+
+polls_filename = "2016.Senate.polls.median.txt"
+estimates_filename = "Senate_estimates.csv"
+jerseyvotes_filename = "Senate_jerseyvotes.csv"
+estimate_history_filename = "Senate_estimate_history.csv"
+
+# In the order of the lines for each day in polls_filename
+races = "AK AZ CO FL IA IL IN LA MO NC NH NV OH PA WI".split()
+contested = races               # races in serious question
+dem_safe = 44                   # the seats not up for election
+gop_safe = 41
+assert dem_safe + gop_safe + len(races) == 100
+
+sem_floor = 2
+safe_pct = 95                   # a race is assigned if this likely, either way
+# With the Vice President a Democrat, 49 seats or fewer is Republican control
+gop_control_seats = 49
+
+# The meta-margin is the bias, starting from metamargin_start and going up
+# in steps of metamargin_step, at which the median is metamargin_seats
+metamargin_start = -7
+metamargin_step = 0.02
+metamargin_seats = 50
+max_bias = 50
+no_metamargin = ev_estimator.no_metamargin
+
+# Voter power is the change in the probability of the Democrats/Independents
+# winning jerseyvotes_seats seats or fewer (as Senate_jerseyvotes.m counts
+# a Republican win) when a race's margin moves jerseyvotes_nudge points
+# towards the Republican, per thousand voters (in 2012), with the margins
+# biased by the meta-margin
+jerseyvotes_nudge = 0.1
+jerseyvotes_seats = 51
+kvoters = array([301, 2324, 2596, 8538, 1590, 5278, 2663, 2015, 2757, 4542, 719, 1017,
+                 5632, 5742, 3068])
+
+Estimate = collections.namedtuple("Estimate",
+        "margins sems num_polls analysisdate stateprobs histogram cumulative_prob "
+        "median_seats mean_seats d_control_probability assigned_seats "
+        "confidence_intervals mean_contested_margin")
+
+############################################################################
+#
+# The calculation
+#
+############################################################################
+
+
+def read_polls(filename=polls_filename, analysisdate=0):
+    return ev_estimator.read_polls(filename, analysisdate,
+                                   read_poll_history(filename, len(races)))
+
+
+def race_sems(polls):
+    sems = polls[..., sem_column].copy()
+    sems[sems < sem_floor] = sem_floor
+    return sems
+
+
+# Student's t cumulative distribution, 2 degrees of freedom (tcdf(t, 2))
+def t2_cdf(t):
+    return 0.5 + t / (2 * sqrt(2 + t * t))
+
+
+# Probability of a Democratic/Independent win in each race with biaspct
+# added to the margins; bias may be an array (of shape (n, 1) for n sets
+# of probabilities)
+
+def win_probabilities(margins, sems, bias=0):
+    return t2_cdf((margins + bias) / sems)
+
+
+# The histogram of seats won in the races for each set of probabilities:
+# histogram[..., i] is the probability of i + 1 seats, as in Senate_median.m
+# (which leaves out the chance of none)
+
+def seat_histograms(prob_dem):
+    prob_dem = asarray(prob_dem, float64)
+    distribution = zeros(prob_dem.shape[:-1] + (len(races) + 1,))
+    distribution[..., 0] = 1
+    for i in range(len(races)):
+        p = prob_dem[..., i:i + 1]
+        shifted = distribution[..., :i + 1] * p
+        distribution[..., :i + 1] *= 1 - p
+        distribution[..., 1:i + 2] += shifted
+    return distribution[..., 1:]
+
+
+# The median number of Democratic/Independent seats for each histogram
+def median_seats(histograms):
+    return (cumsum(histograms, axis=-1) < 0.5).sum(axis=-1) + dem_safe + 1
+
+
+def estimate(polls, biaspct=0):
+    margins = polls[..., margin_column]
+    sems = race_sems(polls)
+    prob_dem = win_probabilities(margins, sems, biaspct)
+    stateprobs = matlab_round(prob_dem * 100)
+
+    histogram = seat_histograms(prob_dem)
+    cumulative_prob = cumsum(histogram, axis=-1)
+    seats = arange(dem_safe + 1, dem_safe + len(races) + 1)
+
+    # Confidence bands from the cumulative histogram, as for the EV
+    confidence_intervals = [
+        count_below(cumulative_prob, ev_estimator.one_sigma_low, True) + dem_safe,
+        count_below(cumulative_prob, ev_estimator.one_sigma_high) + dem_safe + 1,
+        count_below(cumulative_prob, ev_estimator.ninety_five_low, True) + dem_safe,
+        count_below(cumulative_prob, ev_estimator.ninety_five_high) + dem_safe + 1]
+    assigned = [dem_safe + (stateprobs >= safe_pct).sum(axis=-1),
+                gop_safe + (stateprobs <= 100 - safe_pct).sum(axis=-1)]
+    assigned.append(100 - assigned[0] - assigned[1])
+
+    return Estimate(margins, sems, polls[..., num_polls_column].sum(axis=-1),
+                    polls[..., 0, analysisdate_column].astype(int), stateprobs, histogram,
+                    cumulative_prob, median_seats(histogram),
+                    matlab_round((histogram * seats).sum(axis=-1) * 100) / 100,
+                    1 - cumulative_prob[..., max(gop_control_seats - dem_safe, 0) - 1],
+                    tuple(assigned), tuple(confidence_intervals),
+                    margins[..., [races.index(race) for race in contested]].mean(axis=-1))
+
+
+# The meta-margin (for each day, given a stack of them): Senate_estimator.m
+# steps the bias up from metamargin_start until the median reaches
+# metamargin_seats. The median never goes down as the bias goes up, so
+# bisecting the same steps finds the same bias. The one exception is at
+# metamargin_start itself: if no seats at all is more likely than not
+# there, the histogram (which leaves that out) never gets to half, and the
+# median counts as reached, as it did in MATLAB.
+
+def metamargin(polls):
+    steps = int(round(1 / metamargin_step))
+    def reached(k):
+        biases = asarray(k / float(steps))[..., None]
+        prob_dem = win_probabilities(polls[..., margin_column], race_sems(polls), biases)
+        return median_seats(seat_histograms(prob_dem)) >= metamargin_seats
+
+    start = zeros(polls.shape[:-2], int) + metamargin_start * steps
+    end = zeros(polls.shape[:-2], int) + max_bias * steps
+    if not reached(end).all():
+        raise ValueError("no bias up to %d points gives a median of %d seats"
+                         % (max_bias, metamargin_seats))
+    end = where(reached(start), start, end)
+    return -ev_estimator.first_winning(reached, start - 1, end) / float(steps)
+
+
+############################################################################
+#
+# Voter power
+#
+############################################################################
+
+
+# The voter power in each race's state, given the day's polls and the
+# meta-margin
+def jerseyvotes(polls, metamargin):
+    biaspct = -metamargin if metamargin > no_metamargin else 0
+    margins = polls[:, margin_column]
+    sems = race_sems(polls)
+    differences = voter_power.window_changes(
+            win_probabilities(margins, sems, biaspct),
+            win_probabilities(margins - jerseyvotes_nudge, sems, biaspct),
+            [1] * len(races), 1, jerseyvotes_seats - dem_safe) * 10000
+    return voter_power.normalized(differences, kvoters)
+
+
+# The numbers in a line of Senate_estimates.csv, given the Estimate and the
+# meta-margin
+def estimate_outputs(estimate, metamargin):
+    return ([estimate.median_seats, estimate.mean_seats, estimate.d_control_probability]
+            + list(estimate.assigned_seats)
+            + [estimate.num_polls] + list(estimate.confidence_intervals[:2])
+            + [estimate.mean_contested_margin, metamargin])
+
+
+def write_estimates(outputs, filename=estimates_filename):
+    with open(filename, "w") as f:
+        f.write(",".join(dlm_number(x) for x in outputs) + "\n")
+
+
+def write_jerseyvotes(polls, power, filename=jerseyvotes_filename):
+    with open(filename, "w") as f:
+        for i in voter_power.display_order(power):
+            f.write("%d,%s,%s,%s\n" % (i + 1, races[i], num2str(polls[i, margin_column]),
+                                       num2str(power[i])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute the Senate seat distribution "
+                                     "from %s and write %s and %s" % (polls_filename,
+                                     estimates_filename, jerseyvotes_filename))
+    parser.add_argument("--polls", default=polls_filename,
+                        help="the poll medians to read (default %(default)s)")
+    parser.add_argument("--analysisdate", type=int, default=0,
+                        help="the day of the year to use (default: the newest)")
+    args = parser.parse_args()
+
+    polls = read_polls(args.polls, args.analysisdate)
+    mm = metamargin(polls)
+    print "Meta-margin %g" % mm
+    write_estimates(estimate_outputs(estimate(polls), mm))
+    write_jerseyvotes(polls, jerseyvotes(polls, mm))
+
+
+if __name__ == "__main__":
+    main()
@@ -27,9 +27,13 @@
 #
 ############################################################################
 
-import os, sys, urllib2, datetime, time, socket
-from numpy import array, mean, median, sqrt, std
+import os, datetime, socket, cStringIO, argparse, collections
+import multiprocessing
+from numpy import array, arange, nan, sqrt, tile, zeros
 import csv
+import http_cache, request_scheduler, poll_archive, history_cache, poll_store
+import poll_statistics, median_history, poll_window
+from day_numbers import day_number, date_of, parse_day, day_of_year
 
 class RaceInfo(object):
     def __init__(self, line):
@@ -37,7 +41,7 @@ class RaceInfo(object):
         self.dem = line[1]
         self.rep = line[2]
         self.assumption = line[3]
-        self.url = "http://elections.huffingtonpost.com/pollster/2016-%s-senate-%s-vs-%s.csv" % (self.state, self.rep, self.dem).lower().replace(' ', '-')
+        self.url = huffpo_host + "/pollster/2016-%s-senate-%s-vs-%s.csv" % (self.state, self.rep, self.dem).lower().replace(' ', '-')
 
 
 states = {
@@ -106,15 +110,58 @@ states = {
 ############################################################################
 
 output_filename = "2016.Senate.polls.median.txt"
+# The columns of the output files, for the binary copies of them
+output_fields = ["num_polls", "oldest_mid_date", "margin", "sem", "analysisdate", "statenum"]
 midtype = "median"
 num_recent_polls_to_use = 3
+# The window of recent polls used narrows over the season (see clean_polls
+# and poll_window.WindowSchedule): 6 weeks, then 4 weeks from August 1,
+# easing from 28 days to 14 over September, and 2 weeks from October 1
+# (--window-schedule)
+default_window_schedule = "42,2016-08-01=28,2016-09-01=28/2,2016-10-01=14"
+window_schedule = poll_window.WindowSchedule(default_window_schedule)
+# The date given to the pseudopoll (see add_pseudopoll)
+pseudopoll_day = day_number(datetime.date(2016, 1, 1))
 archive_dir = "archive/senate/"
+# The race CSVs and the daily poll logs are appended to a compressed
+# poll_archive in archive_dir
+race_archive = None
+
+# With --incremental, the statistics for each (race, day) are kept in a
+# history_cache in archive_dir, and only recomputed when the polls which
+# had ended by that day have changed
+history_cache_filename = "history_cache.json"
+history = None
+
+# The races' statistics can be computed in parallel, in this many processes
+# (--jobs)
+process_jobs = 1
+
+# Race URLs are on huffpo_host, but requests go to base_url, which
+# --base-url can point at another server (e.g. a pollster_standin.py)
+huffpo_host = "http://elections.huffingtonpost.com"
+base_url = huffpo_host
 
 # Percentage to subtract from Dem-affiliated polls and add to Rep-affiliated ones
 # Used to generate polls.median.Xcorrected.txt
 bias_correction = 3
 corrected_filename_parts = ("2016.Senate.polls.median.", "corrected.txt")
 
+# A bias-correction scenario, written to name.join(corrected_filename_parts).
+# dem is subtracted from the margin of each poll by a Democratic-affiliated
+# pollster and rep added to each by a Republican one, and each pollster in
+# house_effects has its offset subtracted from its margins.
+BiasScenario = collections.namedtuple("BiasScenario", "name dem rep house_effects")
+
+# These files show the outcome if a bias is assigned to:
+# D: just Democratic pollsters
+# R: just Republican pollsters
+# B: both parties
+# --bias-scenarios replaces them with the scenarios in a CSV file
+bias_scenarios = [BiasScenario('D', bias_correction, 0, {}),
+                  BiasScenario('R', 0, bias_correction, {}),
+                  BiasScenario('B', bias_correction, bias_correction, {})]
+
 # Utility functions for getting the appropriate data from the CSV returned by HuffPo
 # Can be used for sorting: y = sorted(x, key = start_date)
 # For sorting by multiple keys: y = sorted(x, key = lambda z: (start_date(z), pollster(z)))
@@ -146,6 +193,12 @@ races_info_file = 'senate_data.csv'
 header_row = True
 DEM_NAME, REP_NAME, ASSUMPTION, URL = tuple(range(4)) # TODO use RaceInfo objects instead
 
+# Race pages are fetched through an on-disk HTTP cache, with conditional GETs,
+# at no more than max_requests_per_second, with retries (see request_scheduler)
+page_cache = None
+scheduler = None
+max_requests_per_second = 4.0
+
 races_info = {}
 # races_info is a dictionary containing the information in the file specified
 # by races_info_file. Each key is a state abbreviation and each value is a list,
@@ -163,97 +216,90 @@ def main():
     global output_filename
     global races
     global races_info
+    global page_cache, scheduler
+    global base_url
+    global race_archive
+    global history
+    global process_jobs
+    global bias_scenarios
+    global window_schedule
+
+    parser = argparse.ArgumentParser(description="Fetch the HuffPost Senate "
+                                     "polls and write %s" % output_filename)
+    parser.add_argument("--replay", metavar="ARCHIVE_DIR",
+                        help="rebuild the polls from the race CSVs archived in "
+                        "ARCHIVE_DIR instead of fetching them")
+    parser.add_argument("--base-url", default=huffpo_host,
+                        help="fetch from this server instead of HuffPost")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only recompute the days whose polls have "
+                        "changed since the last run")
+    parser.add_argument("--jobs", type=int, default=process_jobs,
+                        help="number of processes to compute the races' "
+                        "statistics in")
+    parser.add_argument("--bias-scenarios", metavar="CSV",
+                        help="write the bias-correction scenarios in CSV "
+                        "(see read_bias_scenarios) instead of D, R and B")
+    parser.add_argument("--window-schedule", metavar="SCHEDULE",
+                        default=default_window_schedule,
+                        help="how far back the window of recent polls "
+                        "reaches, by date (default %(default)s; see "
+                        "poll_window.WindowSchedule)")
+    args = parser.parse_args()
+    process_jobs = args.jobs
+    if args.bias_scenarios:
+        bias_scenarios = read_bias_scenarios(args.bias_scenarios)
+    window_schedule = poll_window.WindowSchedule(args.window_schedule)
+    base_url = args.base_url.rstrip("/")
 
     races_info = read_races_info(races_info_file, header_row)
+    race_archive = poll_archive.PollArchive(archive_dir)
 
-    # get the latest polls and store the info in the races dict
-    socket.setdefaulttimeout(5)
-    races = fetch_latest_polls()
+    if args.replay:
+        # rebuild the polls offline, from an earlier run's archive
+        races = store_races(replay_archive(args.replay))
+    else:
+        # get the latest polls and store the info in the races dict
+        socket.setdefaulttimeout(5)
+        page_cache = http_cache.HTTPCache()
+        scheduler = request_scheduler.RequestScheduler(page_cache.fetch,
+                rate=max_requests_per_second)
+        races = store_races(fetch_latest_polls())
+        print page_cache.summary()
+        print page_cache.pool.summary()
+        scheduler.report_failures()
+
+    if args.incremental:
+        history = history_cache.HistoryCache(os.path.join(archive_dir, history_cache_filename))
 
     process_polls(races)
 
+    if history:
+        history.save()
+        print history.summary()
+
 ############################################################################
 #
-# Returns the median and std. error
+# Returns the margins to take the median and std. error of (which
+# poll_statistics.window_statistics does for all of the days at once)
 #
 ############################################################################
 
-# The std. error is given by:
-#         std. deviation / sqrt(num of polls)
-#
-# We robustly estimate the std. deviation from the median absolute
-# deviation (MAD) using the standard formula:
-#        std. deviation =  MAD / invcdf(0.75)
-#
-# The MAD is defined as median( abs[samples - median(samples)] )
-# invcdf(0.75) is approximately 0.6745
-
-def get_statistics(margins):
-
-    num = margins.size
-    assert num >= 3
-
-    if midtype == "median":
-        median_margin = median(margins)
-        mad = median(abs(margins - median_margin))
-        sem_est = mad/0.6745/sqrt(num)
-
-        #Sometimes SEM is 0. Sam want this to be replaced by SD/sqrt(n)
-        if sem_est == 0:
-            sem_est = std(margins) / sqrt(num)
-
-        return (median_margin, sem_est)
-
-    else:
-        assert midtype == "mean"
-
-        mean_margin = mean(margins)
-        sem = std(margins) / sqrt(num)
-
-        return (mean_margin, sem)
-
-# Special case for when only two polls are available
-
-def get_two_statistics(margins):
-
-    assert margins.size == 2
+# The amount to add to the margin of each of polls (a column) for the
+# uncorrected statistics (the first row) and each of the bias_scenarios
+def bias_offsets(polls):
+    is_dem = array([p[6] == 'D' for p in polls], bool)
+    is_rep = array([p[6] == 'R' for p in polls], bool)
+    pollsters = array([p[5] for p in polls], object)
 
-    mean_margin = mean(margins)
-    sem = max(std(margins) / sqrt(margins.size), 3)
+    offsets = zeros((len(bias_scenarios) + 1, len(polls)))
+    for (row, scenario) in zip(offsets[1:], bias_scenarios):
+        row[is_dem] -= scenario.dem
+        row[is_rep] += scenario.rep
+        for (pollster, offset) in scenario.house_effects.items():
+            row[pollsters == pollster] -= offset
 
-    return (mean_margin, sem)
-
-# Special case where there's only one poll, and it might be the pseudopoll
-def get_one_statistics(polls, pseudo, correct_bias):
-    assert len(polls) == 1
-
-    poll = polls[0]
-    if pseudo: # Use hard-coded SEM of 0.05
-            return (poll[0], 0.05)
-    else: # currently this will never run because we add a pseudopoll if there's only 1 real poll
-          # It should work though
-        if poll[-1] == 'D' and (correct_bias == 'D' or correct_bias == 'B'):
-            margin = poll[0] - bias_correction
-        elif poll[-1] == 'R' and (correct_bias == 'R' or correct_bias == 'B'):
-            margin = poll[0] + bias_correction
-        else:
-            margin = poll[0]
-
-        return (margin, sqrt(1.0/poll[4]))
-
-
-# Get the array of margins, allowing for a bias correction
-def get_margins_array(polls, correct_bias):
-    if correct_bias == 'D': #for each poll: get the margin, and correct for bias if it's from a Democratic pollster
-        margins = [p[0] - bias_correction if p[-1] == 'D' else p[0] for p in polls]
-    elif correct_bias == 'R':
-        margins = [p[0] + bias_correction if p[-1] == 'R' else p[0] for p in polls]
-    elif correct_bias == 'B':
-        margins = [p[0] - bias_correction if p[-1] == 'D' else (p[0] + bias_correction if p[-1] == 'R' else p[0]) for p in polls]
-    else:
-        margins = [p[0] for p in polls]
-
-    return array(margins)
+    return offsets
 
 
 ############################################################################
@@ -274,75 +320,161 @@ def get_margins_array(polls, correct_bias):
 # Remember, the format of the tuple for each list:
 # (margin, start date, end date, mid date, pop, polling organization, affil)
 
-def write_statistics(pfile, polls, pseudo, correct_bias):
-    # Number of polls available on this date for this state
-    num = len(polls)
-
-    #rnum is the number of real polls (excluding pseudo)
-    rnum = num - 1 if pseudo else num
-
-    polls.sort(key=mid_date, reverse=True)
-
-    # Get the mid date of the oldest poll
-    date = int(polls[-1][3].strftime('%j'))
+# Returns the lines for output_filename and each of the bias_scenarios'
+# files for each of day_polls, a list of (polls, pseudo) for the days to
+# write. polls is sorted newest first by mid date, and pseudo says whether
+# one of them is the pseudopoll. The statistics for every day and scenario
+# are computed all at once.
+def write_statistics(day_polls):
+    if not day_polls:
+        return []
 
-    def w(num, date, stats):
-        pfile.write('%2d  ' % num)
-        pfile.write('%3s  ' % date)
-        pfile.write('% 5.1f  %.4f  ' % stats)
+    # Every day's polls, one after the other, and where each goes in a
+    # (days x polls) matrix
+    all_polls = [poll for (day, pseudo) in day_polls for poll in day]
+    (index, mask) = poll_statistics.padded(arange(len(all_polls)),
+                                           [len(day) for (day, pseudo) in day_polls])
+
+    # (scenarios x days x polls) corrected margins
+    margins = array([p[0] for p in all_polls]) + bias_offsets(all_polls)
+    matrix = margins[:, index]
+    (variants, days, width) = matrix.shape
+
+    # Special case where there's only one poll, and it might be the pseudopoll:
+    # use a hard-coded SEM of 0.05 for that
+    single_sem = array([nan if len(polls) != 1 else
+                        0.05 if pseudo else sqrt(1.0/float(polls[0][4]))
+                        for (polls, pseudo) in day_polls])
+
+    (mid, sem, count) = poll_statistics.window_statistics(
+            matrix.reshape(variants * days, width), tile(mask, (variants, 1)),
+            midtype, tile(single_sem, variants), zero_sem_fallback=True)
+    mid = mid.reshape(variants, days)
+    sem = sem.reshape(variants, days)
+
+    lines = []
+    for (i, (polls, pseudo)) in enumerate(day_polls):
+        #rnum is the number of real polls (excluding pseudo)
+        rnum = len(polls) - 1 if pseudo else len(polls)
+
+        # Get the mid date of the oldest poll
+        date = day_of_year(polls[-1][3])
+
+        lines.append(['%2d  %3s  % 5.1f  %.4f  ' % (rnum, date, mid[v, i], sem[v, i])
+                      for v in range(variants)])
+
+    return lines
+
+# Computes one race's statistics for every day. With --jobs this runs in a
+# multiprocessing worker, so the cells it stores in the history cache are
+# sent back along with them.
+def race_history(job):
+    (state, days) = job
+    cells = race_statistics_by_day(state, days)
+    return (cells, history.updates() if history else None)
 
-    if num == 0:
-        assert False
-    elif num == 1:
-        w(rnum, date, get_one_statistics(polls, pseudo, correct_bias))
-    elif num == 2:
-        margins = get_margins_array(polls, correct_bias)
-        w(rnum, date, get_two_statistics(margins))
+def process_polls(races):
+    # The uncorrected statistics, then those for each of the bias scenarios,
+    # each in text and in binary
+    filenames = [output_filename] + [scenario.name.join(corrected_filename_parts)
+                                     for scenario in bias_scenarios]
+    files = [open(filename, 'w') for filename in filenames]
+
+    days = list(campaign_season())
+    states = sorted(races.states)
+    binaries = [median_history.HistoryWriter(median_history.binary_filename(filename),
+                                             states, days, output_fields)
+                for filename in filenames]
+    jobs = [(state, days) for state in sorted(races.states)]
+    if process_jobs > 1:
+        pool = multiprocessing.Pool(process_jobs)
+        try:
+            results = pool.map(race_history, jobs, chunksize=1)
+        finally:
+            pool.terminate()
     else:
-        margins = get_margins_array(polls, correct_bias)
-        w(rnum, date, get_statistics(margins))
+        results = map(race_history, jobs)
 
-def process_polls(races):
-    pfile = open(output_filename, 'w')
-
-    # These files show the outcome if a bias is assigned to:
-    # D: just Democratic pollsters
-    # R: just Republican pollsters
-    # B: both parties
-    dfile = open('D'.join(corrected_filename_parts), 'w')
-    rfile = open('R'.join(corrected_filename_parts), 'w')
-    bfile = open('B'.join(corrected_filename_parts), 'w')
-
-    for day in campaign_season():
-        date = int(day.strftime('%j'))
+    cells = {}
+    for ((state, days), (race_cells, updates)) in zip(jobs, results):
+        cells[state] = race_cells
+        if history:
+            history.merge(updates)
+
+    for day in days:
+        date = day_of_year(day)
         print 'processing polls for day %d' % date
 
-        # Make a file to which we'll log the polls used in calculating today's numbers, and write the header
-        dayfile = open(os.path.join(archive_dir, str(date)) + '.csv', 'w')
+        # Log the polls used in calculating today's numbers, starting with the header.
+        # The log is only archived again if it has changed since the last run.
+        dayfile = cStringIO.StringIO()
         dayfile_writer = csv.writer(dayfile)
         dayfile_writer.writerow(['state', 'margin', 'start_date', 'end_date', 'mid_date', 'pop', 'polling_org', 'affiliation'])
 
-        for state_num, state in one_indexed_enumerate(sorted(races.keys())):
-
-            cleaned = clean_polls(races[state], day)
-
-            need_pseudo = add_pseudopoll(state, cleaned)
-
-            for f, correct_bias in [(pfile, None), (dfile, 'D'), (rfile, 'R'), (bfile, 'B')]:
-                write_statistics(f, cleaned, need_pseudo, correct_bias)
+        for state_num, state in one_indexed_enumerate(sorted(races.states)):
+            cell = cells[state][day]
 
+            for f, binary, stats in zip(files, binaries, cell):
                 # Write the date and the index of the state
-                f.write('%3d  %2d\n' % (date, state_num))
-
-            for poll in cleaned:
-                dayfile_writer.writerow([state] + list(poll))
-
-        dayfile.close()
-
-    pfile.close()
-    dfile.close()
-    rfile.close()
-    bfile.close()
+                line = stats + '%3d  %2d\n' % (date, state_num)
+                f.write(line)
+                binary.add_line(day, state_num, line)
+
+            dayfile.write(cell[-1])
+
+        race_archive.append('day', str(date) + '.csv', dayfile.getvalue(), date=date_of(day),
+                            skip_unchanged=True)
+
+    for f in files:
+        f.close()
+    for binary in binaries:
+        binary.close()
+
+# The statistics for one race on each of days, for output_filename and each
+# of the bias scenarios' files, and the rows for the day's log of the polls used. Days whose polls
+# haven't changed since the last run come from the history cache, if it's
+# on, and the rest are computed together
+def race_statistics_by_day(state, days):
+    if history:
+        digests = history_cache.input_digests(
+                races.digest_rows(races.rows(state)), days,
+                repr((midtype, num_recent_polls_to_use, bias_scenarios,
+                      window_schedule, races_info[state][ASSUMPTION])))
+
+    cells = {}
+    todo = []
+    for day in days:
+        cached = None
+        if history:
+            cached = history.lookup(state, day, digests[day])
+        if cached is not None:
+            cells[day] = cached
+        else:
+            todo.append(day)
+
+    day_polls = []
+    windows = poll_window.WindowIndex(races, races.rows(state))
+    for day in todo:
+        polls = clean_polls(windows, day)
+        pseudo = add_pseudopoll(state, polls)
+        polls.sort(key=mid_date, reverse=True)
+        day_polls.append((polls, pseudo))
+
+    for (day, (polls, pseudo), lines) in zip(todo, day_polls, write_statistics(day_polls)):
+        f = cStringIO.StringIO()
+        dayfile_writer = csv.writer(f)
+        for poll in polls:
+            dayfile_writer.writerow([state, poll[0], date_of(poll[1]), date_of(poll[2]),
+                                     date_of(poll[3])] + list(poll[4:]))
+        cells[day] = lines + [f.getvalue()]
+
+    if history:
+        computed = set(todo)
+        for day in days:
+            history.store(state, day, digests[day], cells[day],
+                          reused=day not in computed)
+
+    return cells
 
 # Add a pseudopoll to the list of polls, if necessary. Return True if we needed to do so
 def add_pseudopoll(state, polls):
@@ -351,59 +483,32 @@ def add_pseudopoll(state, polls):
     
     # get the specified assumption to use from races_info
     assumption = float(races_info[state][ASSUMPTION])
-    date = datetime.date(2016, 1, 1)
+    date = pseudopoll_day
 
     # (margin, start date, end date, mid date, pop, polling organization, affil)
     polls.append((assumption, date, date, date, 1, 'FAKE: Assumption', None))
     return True
 
-# Clean up the polls, following Sam's rules
-def clean_polls(polls, day):
-
-    # -1. Make sure there's something to clean
-    if not polls:
-        return []
-
-    # 0. Sort the polls by ending date
-    polls.sort(key = end_date, reverse = True)
+# Clean up the polls for a race, following Sam's rules. Returns a list of
+# poll tuples, newest first by mid date
+def clean_polls(windows, day):
 
+    # 0. The polls in windows are sorted by ending date already
     # 1. Drop all polls ending after "today"
-    polls = filter(lambda x: x[2] < day, polls)
-
     # 2. Only use the latest poll from each organization
-    pollsters = []
-    def seen(pollster):
-        if pollster in pollsters:
-            return True
-        else:
-            pollsters.append(pollster)
-            return False
-
-    polls = [poll for poll in polls if not seen(poll_org(poll))]
-
-    # If we don't need to eliminate any more polls, return
-    if len(polls) < num_recent_polls_to_use:
-
-        return polls
-
     # 3. Find third oldest mid date of a poll, and include any from this date or newer
-    polls.sort(key=mid_date, reverse=True)
-    third_oldest_date = mid_date(polls[num_recent_polls_to_use - 1])
-
-    # 4. Find N weeks ago, where N is a function of "today"
-    if day < datetime.date(2016, 8, 1): # Before August 1
-        n = datetime.timedelta(7 * 6, 0, 0) # 6 weeks
-    elif day < datetime.date(2016, 9, 1):   # Month of August
-        n = datetime.timedelta(7 * 4, 0, 0) # 4 weeks
-    elif day < datetime.date(2016, 10, 1):  # September
-        #n = datetime.timedelta(7 * 2, 0, 0) # 2 weeks
-	n = datetime.timedelta(28 - (day.day - 1) / 2, 0, 0) # Ease from 28 days to 14 over the course of the month
-    else:                                   # October onwards
-        n = datetime.timedelta(7 * 2, 0, 0) # now also 2 weeks
-    n_weeks_ago = day - n
-
+    # 4. Find N days ago, where N is a function of "today" (window_schedule)
     # 5. Return all polls with a median date of (#3) or newer, or an ending date of (#4) or newer
-    return filter(lambda x: x[3] >= third_oldest_date or x[2] >= n_weeks_ago, polls)
+    #
+    # If there are fewer than three polls after (#2), they are all used
+    positions = windows.recent(day, num_recent_polls_to_use, window_schedule.width(day))
+    return poll_tuples(windows.rows[positions])
+
+# The (margin, start date, end date, mid date, pop, polling organization,
+# affiliation) tuples for rows of races, with pop as it was in the CSV
+def poll_tuples(rows):
+    return [poll[:4] + (pop,) + poll[5:]
+            for (poll, pop) in zip(races.tuples(rows), races.strings(rows, "observations"))]
 
 ############################################################################
 #
@@ -412,24 +517,9 @@ def clean_polls(polls, day):
 ############################################################################
 
 
+# Returns a request_scheduler.FetchResult
 def url_fetcher(url):
-    tries = 0
-    while True:
-        try:
-            f = urllib2.urlopen(url)
-            return f
-        except urllib2.HTTPError as e:
-            if e.code == 404:
-                print "404 for %s" % url
-                return None
-        except urllib2.URLError:
-            if tries < 3:
-                tries += 1
-                time.sleep(1)
-            else:
-                print "FAIL on %s (tried three times)" % url
-                sys.stdout.flush()
-                raise
+    return scheduler.fetch(url)
 
 # Get the latest polls from Huffington Post, and save them to the archive directory
 def fetch_latest_polls():
@@ -447,100 +537,32 @@ def fetch_latest_polls():
             print 'nothing to fetch for %s. We\'ll use the given assumption' % state
             continue
 
-        # Try to deal with timeouts
-        tries = 0
-        while True:
-            try:
-                page = url_fetcher(url)
-                break
-            except socket.timeout:
-                if tries < 3:
-                    tries += 1
-                    time.sleep(1)
-                else:
-                    print 'Kept timing out on: %s. Aborting' % state
-                    exit()
-
-        # if we can't fetch the page, just continue
-        if not page:
+        result = url_fetcher(url)
+
+        # if the page doesn't exist, just continue
+        if result.status == 404:
+            print "404 for %s" % url
             continue
 
-        reader = csv.reader(page, delimiter=',')
-
-        # Get the first row, containing the names
-        header = reader.next()
-        mapping = {} # {column number: column name}
-        for i in range(len(header)):
-            mapping[header[i].strip()] = i # Updated 08/21/16 to account for 'Undecided ' (note space) in IN CSV
-        header[mapping["Undecided"]] = 'Difference' # This was 'Undecided' in the csv from HuffPo
-
-        # Determine whether the candidates are in the correct order (Dem, then Rep)
-        dem_name = info[DEM_NAME].split(" ")[0]
-        rep_name = info[REP_NAME].split(" ")[0]
-        #reverse = None
-
-        # Check to see if we have an exact match
-        #if dem(header) == dem_name:
-        #    reverse = False
-        #elif dem(header) == rep_name:
-        #    reverse = True
-
-        # Check to see if the name we have is a partial match (part of a hyphenated name)
-        #if reverse == None:
-        #    if dem(header).startswith(dem_name) or dem(header).endswith(dem_name):
-        #        reverse = False
-        #    elif dem(header).startswith(rep_name) or dem(header).endswith(rep_name):
-        #        reverse = True
-        #    elif rep(header).startswith(dem_name) or rep(header).endswith(dem_name):
-        #        reverse = True
-        #    elif rep(header).startswith(rep_name) or rep(header).endswith(rep_name):
-        #        reverse = False
-
-        # Something is very wrong with the names. We can't handle this situation
-        #if reverse == None:
-        #    print 'Could not handle names. Looking for:'
-        #    print 'Dem: %s' % dem_name
-        #    print 'Rep: %s' % rep_name
-        #    print 'Got instead:'
-        #    print 'In Dem spot: %s' % dem(header)
-        #    print 'In Rep spot: %s' % rep(header)
-        #    exit(1)
-
-        rows = []
-        for row in reader:
-            #if reverse: # the Dem and Rep are flipped in the returned page
-            #    row[DEM], row[REP] = row[REP], row[DEM]
-
-            start_date = strpdate(row[mapping["Start Date"]])
-            end_date = strpdate(row[mapping["End Date"]])
-            mid_date = start_date + ((end_date - start_date) / 2)
-
-            # Determine the pollster's apolitical affiliation
-            affil = None
-            pster = row[mapping["Pollster"]]
-            if pster.find('(D') != -1:
-                affil = 'D'
-            elif pster.find('(R') != -1:
-                affil = 'R'
-
-            # Trim off any parenthesizes info (such as the party and/or organization
-            # for whom the poll was taken), as well as any partner organizations
-            pster = pster.split('(')[0].split('/')[0].strip()
-
-            # Replace the Undecided vote with the difference between Dem and Rep
-            row[mapping["Undecided"]] = float(row[mapping[dem_name]]) - float(row[mapping[rep_name]])
-
-            # Store the info in the form:
-            # (margin, start_date, end_date, mid_date, pop, poll_org, affil)
-            races[state].append((row[mapping["Undecided"]], start_date, end_date, mid_date, row[mapping["Number of Observations"]], pster, affil))
-            rows.append(row)
-
-        # Write all of the data to a file in the archive dir
-        with open(os.path.join(archive_dir, state) + '.csv', 'w') as f:
-            writer = csv.writer(f, delimiter=',')
-            writer.writerow(header)
-            writer.writerows(rows)
-            print 'Wrote %d polls to %s.csv' % (len(rows), state)
+        # if we can't fetch it, fall back on the copy from the last run
+        if not result.ok:
+            print 'Could not fetch polls for %s: %s' % (state, result.error)
+            archived = race_archive.latest('race', state + '.csv')
+            if archived:
+                print 'Using the polls archived on %s' % archived.date
+                races[state] = parse_race_csv(cStringIO.StringIO(poll_archive.read_entry(archived)), info)[2]
+            continue
+
+        (header, rows, races[state]) = parse_race_csv(cStringIO.StringIO(result.body), info)
+
+        # Archive all of the data
+        f = cStringIO.StringIO()
+        writer = csv.writer(f, delimiter=',')
+        writer.writerow(header)
+        writer.writerows(rows)
+        if race_archive.append('race', state + '.csv', f.getvalue(), state=state,
+                               skip_unchanged=True):
+            print 'Archived %d polls from %s.csv' % (len(rows), state)
 
     return races
 
@@ -552,6 +574,160 @@ def fetch_latest_polls():
 #
 ############################################################################
 
+# Parse the CSV of polls for one race, from HuffPo or from the archive dir.
+# Returns the header and rows to archive, and the list of poll tuples
+def parse_race_csv(lines, info):
+    reader = csv.reader(lines, delimiter=',')
+
+    # Get the first row, containing the names
+    header = reader.next()
+    mapping = {} # {column number: column name}
+    for i in range(len(header)):
+        mapping[header[i].strip()] = i # Updated 08/21/16 to account for 'Undecided ' (note space) in IN CSV
+    if "Undecided" not in mapping: # an archived copy, where this has been done already
+        mapping["Undecided"] = mapping["Difference"]
+    header[mapping["Undecided"]] = 'Difference' # This was 'Undecided' in the csv from HuffPo
+
+    # Determine whether the candidates are in the correct order (Dem, then Rep)
+    dem_name = info[DEM_NAME].split(" ")[0]
+    rep_name = info[REP_NAME].split(" ")[0]
+    #reverse = None
+
+    # Check to see if we have an exact match
+    #if dem(header) == dem_name:
+    #    reverse = False
+    #elif dem(header) == rep_name:
+    #    reverse = True
+
+    # Check to see if the name we have is a partial match (part of a hyphenated name)
+    #if reverse == None:
+    #    if dem(header).startswith(dem_name) or dem(header).endswith(dem_name):
+    #        reverse = False
+    #    elif dem(header).startswith(rep_name) or dem(header).endswith(rep_name):
+    #        reverse = True
+    #    elif rep(header).startswith(dem_name) or rep(header).endswith(dem_name):
+    #        reverse = True
+    #    elif rep(header).startswith(rep_name) or rep(header).endswith(rep_name):
+    #        reverse = False
+
+    # Something is very wrong with the names. We can't handle this situation
+    #if reverse == None:
+    #    print 'Could not handle names. Looking for:'
+    #    print 'Dem: %s' % dem_name
+    #    print 'Rep: %s' % rep_name
+    #    print 'Got instead:'
+    #    print 'In Dem spot: %s' % dem(header)
+    #    print 'In Rep spot: %s' % rep(header)
+    #    exit(1)
+
+    rows = []
+    polls = []
+    for row in reader:
+        #if reverse: # the Dem and Rep are flipped in the returned page
+        #    row[DEM], row[REP] = row[REP], row[DEM]
+
+        start_date = parse_day(row[mapping["Start Date"]])
+        end_date = parse_day(row[mapping["End Date"]])
+        mid_date = start_date + ((end_date - start_date) / 2)
+
+        # Determine the pollster's apolitical affiliation
+        affil = None
+        pster = row[mapping["Pollster"]]
+        if pster.find('(D') != -1:
+            affil = 'D'
+        elif pster.find('(R') != -1:
+            affil = 'R'
+
+        # Trim off any parenthesizes info (such as the party and/or organization
+        # for whom the poll was taken), as well as any partner organizations
+        pster = pster.split('(')[0].split('/')[0].strip()
+
+        # Replace the Undecided vote with the difference between Dem and Rep
+        row[mapping["Undecided"]] = float(row[mapping[dem_name]]) - float(row[mapping[rep_name]])
+
+        # Store the info in the form:
+        # (margin, start_date, end_date, mid_date, pop, poll_org, affil)
+        polls.append((row[mapping["Undecided"]], start_date, end_date, mid_date, row[mapping["Number of Observations"]], pster, affil))
+        rows.append(row)
+
+    return (header, rows, polls)
+
+
+# Rebuild the races dict from the latest race CSVs archived by an earlier
+# fetch_latest_polls, or from a directory of loose per-race CSVs written by
+# older versions of this script. The races are parsed in parallel.
+def load_archived_race(args):
+    # Runs in a multiprocessing worker
+    (race, info) = args
+    if isinstance(race, poll_archive.ArchiveEntry):
+        return parse_race_csv(cStringIO.StringIO(poll_archive.read_entry(race)), info)[2]
+    with open(race, 'rb') as f:
+        return parse_race_csv(f, info)[2]
+
+# Put the polls from fetch_latest_polls or replay_archive into a
+# poll_store.PollStore, keeping the CSV's text of each pop as it was
+def store_races(polls_by_race):
+    store = poll_store.PollStore(["observations"])
+    for state in races_info:
+        store.add_state(state)
+    for state in polls_by_race:
+        for poll in polls_by_race[state]:
+            store.add(state, *poll, observations=poll[4])
+    store.freeze()
+    return store
+
+def replay_archive(replay_dir):
+    races = {}
+    for state in races_info:
+        races[state] = []
+
+    found = {}
+    if poll_archive.exists(replay_dir):
+        archive = poll_archive.PollArchive(replay_dir)
+        for state in races_info:
+            entry = archive.latest('race', state + '.csv')
+            if entry:
+                found[state] = entry
+    else:
+        for state in races_info:
+            filename = os.path.join(replay_dir, state) + '.csv'
+            if os.path.exists(filename):
+                found[state] = filename
+    states = [state for state in races_info if state in found]
+
+    pool = multiprocessing.Pool()
+    try:
+        loaded = pool.map(load_archived_race,
+                          [(found[state], races_info[state]) for state in states])
+    finally:
+        pool.terminate()
+
+    for (state, polls) in zip(states, loaded):
+        races[state] = polls
+        print 'Replayed %d polls for %s' % (len(polls), state)
+
+    return races
+
+
+# Read bias-correction scenarios, one per line of the form
+#     name,dem,rep[,pollster=offset,...]
+# e.g. "B2,2,2" or "houseA,0,0,Rasmussen=-2,PPP=1.5". Blank lines and lines
+# starting with # are skipped.
+def read_bias_scenarios(csvfile):
+    scenarios = []
+    with open(csvfile, 'rb') as f:
+        for row in csv.reader(f, delimiter=',', quotechar='"'):
+            if not row or not row[0].strip() or row[0].startswith('#'):
+                continue
+            house_effects = {}
+            for cell in row[3:]:
+                (pollster, offset) = cell.rsplit('=', 1)
+                house_effects[pollster.strip()] = float(offset)
+            scenarios.append(BiasScenario(row[0].strip(), float(row[1]), float(row[2]),
+                                          house_effects))
+    return scenarios
+
+
 def read_races_info(csvfile = races_info_file, header_row = True):
     with open(csvfile, 'rb') as f:
         reader = csv.reader(f, delimiter=',', quotechar='"')
@@ -568,7 +744,9 @@ def read_races_info(csvfile = races_info_file, header_row = True):
             if row[4]:
                 url = row[4] if row[4].endswith(".csv") else row[4] + ".csv"
             else:
-		url = ("http://elections.huffingtonpost.com/pollster/2016-%s-senate-%s-vs-%s.csv" % (states[row[0]], row[2], row[1])).lower().replace(' ', '-')
+		url = huffpo_host + ("/pollster/2016-%s-senate-%s-vs-%s.csv" % (states[row[0]], row[2], row[1])).lower().replace(' ', '-')
+            if url.startswith(huffpo_host):
+                url = base_url + url[len(huffpo_host):]
 
             races_info[row[0]] = row[1:4] + [url]
 
@@ -580,23 +758,16 @@ def read_races_info(csvfile = races_info_file, header_row = True):
 #
 ############################################################################
 
-# Parses a date_string into a datetime.date. Included here to support
-# Python 2.4, which lacks datetime.datetime.strpdate()
-
-def strpdate(date_string, format="%Y-%m-%d"):
-    return datetime.date(*(time.strptime(date_string, format)[0:3]))
-
-
-# Generates all of the dates in the general election campaign season,
-# starting from today and working back to March 1
+# Generates all of the dates in the general election campaign season, as
+# day numbers, starting from today and working back to March 1
 
 def campaign_season():
-    day = datetime.date.today()
-    start = datetime.date(2016, 3, 1)
+    day = day_number(datetime.date.today())
+    start = day_number(datetime.date(2016, 3, 1))
 
     while day >= start:
         yield day
-        day = day - datetime.timedelta(1, 0, 0)
+        day -= 1
 
 # Take an iterable and enumerate it, but use 1-indexing
 # This makes MATLAB happy
@@ -0,0 +1,51 @@
+#!/usr/bin/python
+
+############################################################################
+#
+# Checks that history_cache.input_digests gives the same digests for the
+# same polls whether they were parsed from the XML feed or loaded from the
+# poll index, so that a run which picks its older polls up from the index
+# doesn't recompute every day they are in.
+#
+#     python test_history_cache.py
+#
+############################################################################
+
+import os, shutil, tempfile, cStringIO, unittest
+import ev_update_polls, history_cache, poll_store, pollster_standin, pollster_xml
+from poll_index import PollIndex
+from day_numbers import day_number
+
+
+def digests(polls, days):
+    ev_update_polls.state_polls = poll_store.PollStore(ev_update_polls.analysis_columns)
+    ev_update_polls.process_pollfile(polls, "OH")
+    ev_update_polls.state_polls.freeze()
+    store = ev_update_polls.state_polls
+    return history_cache.input_digests(store.digest_rows(store.rows("OH")), days)
+
+
+class InputDigestTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="test_history_cache.")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_feed_and_index_polls_digest_alike(self):
+        config = pollster_standin.StandinConfig(polls=10)
+        page = pollster_standin.synthetic_xml_page(config, "OH", 1)
+        from_feed = list(pollster_xml.iter_polls(cStringIO.StringIO(page)))
+
+        index = PollIndex(os.path.join(self.root, "poll_index.sqlite"))
+        index.replace("OH", "code", from_feed)
+        from_index = index.polls("OH", "code")
+        index.close()
+
+        days = range(day_number(pollster_standin.season_start),
+                     day_number(pollster_standin.season_end) + 1)
+        self.assertEqual(digests(from_feed, days), digests(from_index, days))
+
+
+if __name__ == "__main__":
+    unittest.main()
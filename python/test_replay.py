@@ -0,0 +1,95 @@
+#!/usr/bin/python
+
+############################################################################
+#
+# Checks that ev_update_polls.py --replay rebuilds what the live runs did.
+#
+# Two nightly runs are made with --incremental against a local
+# pollster_standin, with more polls published for the second, so that the
+# second run stops paging early and picks the older polls up from the poll
+# index. Replaying the archive they leave must then give the same sweep.
+#
+#     python test_replay.py
+#
+############################################################################
+
+import os, sys, shutil, tempfile, subprocess, unittest
+import pollster_standin
+
+module_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Runs ev_update_polls.py with the campaign season fixed, so that the
+# output doesn't depend on today's date
+driver = """
+import sys, datetime
+sys.path.insert(0, %r)
+import ev_update_polls
+def campaign_season():
+    day = datetime.date(2016, 11, 8).toordinal()
+    while day >= datetime.date(2016, 5, 22).toordinal():
+        yield day
+        day -= 1
+ev_update_polls.campaign_season = campaign_season
+sys.argv = ["ev_update_polls.py"] + sys.argv[1:]
+ev_update_polls.main()
+""" % module_dir
+
+
+def run_update(workdir, *args):
+    with open(os.devnull, "w") as null:
+        subprocess.check_call([sys.executable, "-c", driver] + list(args),
+                              cwd=workdir, stdout=null)
+
+
+def read(filename):
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="test_replay.")
+        self.live = os.path.join(self.root, "live")
+        self.replay = os.path.join(self.root, "replay")
+        os.makedirs(os.path.join(self.live, "archive", "ev"))
+        os.makedirs(self.replay)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    # Two nightly runs, the second with seven more polls in each feed
+    def nightly_runs(self):
+        config = pollster_standin.StandinConfig(polls=40)
+        server = pollster_standin.start_in_thread(config)
+        try:
+            for polls in (40, 47):
+                config.polls = polls
+                run_update(self.live, "--base-url", server.base_url(), "--incremental",
+                           "--threads", "4", "--rate", "0")
+        finally:
+            server.shutdown()
+
+    def test_replay_after_incremental_runs(self):
+        self.nightly_runs()
+
+        run_update(self.replay, "--replay", os.path.join(self.live, "archive", "ev"))
+
+        self.assertEqual(read(os.path.join(self.live, "2016.EV.polls.median.txt")),
+                         read(os.path.join(self.replay, "2016.EV.polls.median.txt")))
+        self.assertEqual(read(os.path.join(self.live, "2016_StatePolls.csv")),
+                         read(os.path.join(self.replay, "2016_StatePolls.csv")))
+
+    def test_replay_without_the_poll_index(self):
+        # Every poll has been on some version of some page, so the archive
+        # alone still has them all, even those only on old versions
+        self.nightly_runs()
+        os.remove(os.path.join(self.live, "archive", "ev", "poll_index.sqlite"))
+
+        run_update(self.replay, "--replay", os.path.join(self.live, "archive", "ev"))
+
+        self.assertEqual(sorted(read(os.path.join(self.live, "2016_StatePolls.csv")).splitlines()),
+                         sorted(read(os.path.join(self.replay, "2016_StatePolls.csv")).splitlines()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+############################################################################
+#
+# Voter power ("jerseyvotes"): how much a change in one state's margin
+# moves the probability of the overall result.
+#
+# EV_jerseyvotes.m and Senate_jerseyvotes.m take 0.1 point off one state's
+# margin, recompute the whole distribution of outcomes and see how much the
+# probability of a Republican win changes, once for every state. Here the
+# distribution is built once as prefix and suffix partial distributions:
+# prefix[i] over the contests before contest i, suffix[i] over contest i
+# and those after it. Leaving contest i out, the rest of the outcomes are
+# prefix[i] convolved with suffix[i + 1], and the probability that party
+# 1's total lands in a window [lo, hi] is then
+#
+#     p[i] * W(lo - w[i], hi - w[i]) + (1 - p[i]) * W(lo, hi)
+#
+# where W(a, b) is the probability the others put it in [a, b], w[i] is
+# contest i's weight (electoral votes or seats) and p[i] the probability
+# party 1 wins it. So the change from p[i] to p'[i] is exactly
+#
+#     (p'[i] - p[i]) * (W(lo - w[i], hi - w[i]) - W(lo, hi))
+#
+# and each W is one pass over prefix[i] against the cumulative sums of
+# suffix[i + 1]: O(states x EV) for all of the states, rather than the
+# O(states^2 x EV) of a full distribution per state, and without taking
+# the difference of two nearly equal probabilities.
+#
+############################################################################
+
+from numpy import arange, asarray, concatenate, cumsum, floor, zeros, float64
+
+
+# The changes in the probability that party 1's total is in [lo, hi] when
+# each contest's probability of going to party 1 changes from prob to
+# new_prob (one at a time), weights being what each contest is worth
+
+def window_changes(prob, new_prob, weights, lo, hi):
+    prob = asarray(prob, float64)
+    weights = [int(w) for w in weights]
+    n = len(weights)
+    total = sum(weights)
+
+    # prefix[i] and suffix[i], over party 1's total
+    prefix = zeros((n + 1, total + 1))
+    prefix[0, 0] = 1
+    width = 1
+    for (i, w) in enumerate(weights):
+        prefix[i + 1, :width] = prefix[i, :width] * (1 - prob[i])
+        prefix[i + 1, w:w + width] += prefix[i, :width] * prob[i]
+        width += w
+    suffix = zeros((n + 1, total + 1))
+    suffix[n, 0] = 1
+    width = 1
+    for i in range(n - 1, -1, -1):
+        w = weights[i]
+        suffix[i, :width] = suffix[i + 1, :width] * (1 - prob[i])
+        suffix[i, w:w + width] += suffix[i + 1, :width] * prob[i]
+        width += w
+
+    # below[i, m + 1] is the probability the contests after i total m or less
+    below = concatenate([zeros((n, 1)), cumsum(suffix[1:], axis=1)], axis=1)
+    rows = arange(n)[:, None]
+    k = arange(total + 1)
+
+    # The probability that the contests other than i total between a[i]
+    # and b[i]
+    def others_within(a, b):
+        upper = (asarray(b)[:, None] - k).clip(-1, total) + 1
+        lower = (asarray(a)[:, None] - 1 - k).clip(-1, total) + 1
+        return (prefix[:n] * (below[rows, upper] - below[rows, lower])).sum(axis=1)
+
+    w = asarray(weights)
+    lo = zeros(n, int) + lo
+    hi = zeros(n, int) + hi
+    return (asarray(new_prob, float64) - prob) * (others_within(lo - w, hi - w)
+                                                  - others_within(lo, hi))
+
+
+# Voter power as the jerseyvotes scripts write it: each difference per
+# thousand voters, as a percentage of the largest, rounded to the nearest
+# tenth (as MATLAB's roundn(x, -1) does) except for the states in unrounded
+
+def normalized(differences, kvoters, unrounded=()):
+    power = asarray(differences, float64) / kvoters
+    power = 100 * power / power.max()
+    for i in range(len(power)):
+        if i not in unrounded:
+            x = power[i] / 0.1
+            power[i] = (floor(x + 0.5) if x >= 0 else -floor(-x + 0.5)) * 0.1
+    return power
+
+
+# The order the jerseyvotes files list the states in: most powerful first,
+# ties with the last state first (the reverse of MATLAB's sort())
+
+def display_order(power):
+    order = sorted(range(len(power)), key=lambda i: power[i])
+    return order[::-1]